@@ -0,0 +1,288 @@
+'''
+Контроль допуска запросов: ограничение параллельности по классам маршрутов,
+ограниченная очередь ожидания и дедлайн запроса, доходящий до БД.
+
+Когда Postgres замедляется, запросы не копятся в ожидании соединений
+из пула, а получают быстрый 503 с Retry-After.
+'''
+import asyncio
+import json
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.monitoring.metrics import registry
+
+
+# Момент (time.monotonic()), к которому запрос должен быть обслужен
+_deadline: ContextVar[float | None] = ContextVar("request_deadline", default=None)
+
+ADMISSION_ACTIVE = registry.gauge(
+    "admission_active_requests", "Запросы, допущенные к обработке", ("route_class",),
+)
+ADMISSION_QUEUED = registry.gauge(
+    "admission_queued_requests", "Запросы в очереди допуска", ("route_class",),
+)
+ADMISSION_REJECTED = registry.counter(
+    "admission_rejected", "Запросы, отклонённые контролем допуска", ("route_class", "reason"),
+)
+
+SHED_BODY = json.dumps({"detail": "Сервер перегружен, повторите запрос позже"}).encode()
+DEADLINE_BODY = json.dumps({"detail": "Запрос не обслужен за отведённое время"}).encode()
+
+
+def remaining_time() -> float | None:
+    '''Секунды до дедлайна текущего запроса или None, если дедлайна нет.'''
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def current_deadline() -> float | None:
+    '''Дедлайн текущего запроса (time.monotonic()) или None.'''
+    return _deadline.get()
+
+
+def set_deadline(deadline: float | None) -> None:
+    '''
+    Задаёт дедлайн в текущем контексте. Для работы вне контекста запроса,
+    выполняемой ради нескольких запросов (пачки BatchLoader).
+    '''
+    _deadline.set(deadline)
+
+
+class ConcurrencyLimiter:
+    '''
+    Семафор с ограниченной очередью. Слот освободившегося запроса
+    передаётся первому ожидающему (FIFO); если очередь заполнена,
+    acquire сразу возвращает причину отказа.
+
+    Не привязан к event loop: ожидающие futures создаются в loop вызывающего.
+    '''
+
+    def __init__(self, name: str, limit: int, queue_size: int):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.active = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    def _grant(self) -> None:
+        self.active += 1
+        ADMISSION_ACTIVE.inc(route_class=self.name)
+
+    async def acquire(self, timeout: float) -> str | None:
+        '''Занимает слот; возвращает None или причину отказа ("queue_full", "timeout").'''
+        if self.active < self.limit and not self._waiters:
+            self._grant()
+            return None
+        if len(self._waiters) >= self.queue_size or timeout <= 0:
+            return "queue_full" if timeout > 0 else "timeout"
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        ADMISSION_QUEUED.inc(route_class=self.name)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return None
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # слот выдан одновременно с отменой — возвращаем его
+                self.release()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return "timeout"
+        finally:
+            ADMISSION_QUEUED.dec(route_class=self.name)
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+
+    def release(self) -> None:
+        ADMISSION_ACTIVE.dec(route_class=self.name)
+        self.active -= 1
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._grant()
+                return
+
+
+class RouteClass:
+    __slots__ = ("name", "prefixes", "methods", "limiter", "deadline")
+
+    def __init__(
+        self, name: str, prefixes: tuple[str, ...], limit: int, queue_size: int, deadline: float,
+        methods: frozenset[str] | None = None,
+    ):
+        self.name = name
+        self.prefixes = prefixes
+        self.methods = methods  # None — любой метод
+        self.limiter = ConcurrencyLimiter(name, limit, queue_size)
+        self.deadline = deadline  # секунды, 0 — без дедлайна
+
+    def matches(self, path: str, method: str) -> bool:
+        return path.startswith(self.prefixes) and (self.methods is None or method in self.methods)
+
+
+READ_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+# Порядок важен: первый совпавший класс определяет лимиты, последний — класс по умолчанию
+ROUTE_CLASSES = (
+    # bcrypt: длинные запросы, упирающиеся в пул потоков хеширования
+    RouteClass(
+        "auth", ("/auth/register/", "/auth/login/"),
+        settings.ADMISSION_AUTH_CONCURRENCY, settings.ADMISSION_AUTH_QUEUE, settings.REQUEST_DEADLINE,
+    ),
+    # выгрузки и массовые операции: без дедлайна, но не больше нескольких одновременно
+    RouteClass(
+        "batch", ("/admin/export/", "/admin/users/bulk", "/admin/salary/stats/rebuild",
+                  "/admin/salary/projection"),
+        settings.ADMISSION_BATCH_CONCURRENCY, 0, 0,
+    ),
+    RouteClass(
+        "read", ("/",),
+        settings.ADMISSION_READ_CONCURRENCY, settings.ADMISSION_READ_QUEUE, settings.REQUEST_DEADLINE,
+        methods=READ_METHODS,
+    ),
+    # изменения (PATCH профиля, удаление, выход): свой лимит и более длинный дедлайн
+    RouteClass(
+        "write", ("/",),
+        settings.ADMISSION_WRITE_CONCURRENCY, settings.ADMISSION_WRITE_QUEUE, settings.REQUEST_WRITE_DEADLINE,
+    ),
+)
+# не ограничиваются: мониторинг должен отвечать и под перегрузкой
+EXEMPT_PATHS = ("/metrics", "/debug/")
+
+
+def route_class(path: str, method: str = "GET") -> RouteClass | None:
+    if path.startswith(EXEMPT_PATHS):
+        return None
+    for route in ROUTE_CLASSES:
+        if route.matches(path, method):
+            return route
+    return None
+
+
+async def _reply(send, status: int, body: bytes) -> None:
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"retry-after", str(settings.ADMISSION_RETRY_AFTER).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    '''
+    ASGI middleware контроля допуска.
+
+    - Запрос ждёт слот своего класса не дольше ADMISSION_QUEUE_TIMEOUT
+      (и не дольше дедлайна); при полной очереди или истечении ожидания
+      сразу отвечает 503 с Retry-After.
+    - Допущенный запрос выполняется не дольше дедлайна класса; если ответ
+      ещё не начат, клиент получает 503, а обработка (в том числе ожидание
+      соединения из пула и запрос в БД) отменяется.
+    - Обработка отменяется и при отключении клиента.
+    - Дедлайн доступен через remaining_time() и на Postgres ограничивает
+      statement_timeout транзакции (см. install_statement_deadline).
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        route = None
+        if scope["type"] == "http" and settings.ADMISSION_ENABLED:
+            route = route_class(scope["path"], scope["method"])
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+
+        deadline = time.monotonic() + route.deadline if route.deadline else None
+        wait = settings.ADMISSION_QUEUE_TIMEOUT
+        if deadline is not None:
+            wait = min(wait, route.deadline)
+        reason = await route.limiter.acquire(wait)
+        if reason is not None:
+            ADMISSION_REJECTED.inc(route_class=route.name, reason=reason)
+            await _reply(send, 503, SHED_BODY)
+            return
+
+        token = _deadline.set(deadline)
+        try:
+            await self._run(scope, receive, send, route, deadline)
+        finally:
+            _deadline.reset(token)
+            route.limiter.release()
+
+    async def _run(self, scope, receive, send, route: RouteClass, deadline: float | None) -> None:
+        response_started = False
+        response_finished = False
+        messages: asyncio.Queue = asyncio.Queue()
+
+        async def send_tracking(message):
+            nonlocal response_started, response_finished
+            if message["type"] == "http.response.start":
+                response_started = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_finished = True
+            await send(message)
+
+        app_task = asyncio.create_task(self.app(scope, messages.get, send_tracking))
+
+        async def watch_disconnect():
+            # единственный читатель receive: сообщения передаются приложению через очередь
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    if not response_finished:
+                        app_task.cancel()
+                    return
+
+        watcher = asyncio.create_task(watch_disconnect())
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            done, _ = await asyncio.wait({app_task}, timeout=timeout)
+        except asyncio.CancelledError:
+            app_task.cancel()
+            raise
+        finally:
+            watcher.cancel()
+
+        if not done:
+            app_task.cancel()
+            await asyncio.gather(app_task, return_exceptions=True)
+            ADMISSION_REJECTED.inc(route_class=route.name, reason="deadline")
+            if not response_started:
+                await _reply(send, 503, DEADLINE_BODY)
+        elif not app_task.cancelled():
+            app_task.result()  # пробрасываем исключение приложения
+        # иначе клиент отключился и обработка отменена — отвечать некому
+
+
+def _set_statement_timeout(session, transaction, connection) -> None:
+    remaining = remaining_time()
+    if remaining is None or connection.dialect.name != "postgresql":
+        return
+    # SET LOCAL действует до конца транзакции и не переживает возврат соединения в пул
+    connection.exec_driver_sql(f"SET LOCAL statement_timeout = {max(1, int(remaining * 1000))}")
+
+
+def install_statement_deadline() -> None:
+    '''
+    Ограничивает statement_timeout каждой транзакции ORM-сессии
+    оставшимся временем дедлайна запроса (только Postgres). Повторный
+    вызов безопасен.
+    '''
+    if not event.contains(Session, "after_begin", _set_statement_timeout):
+        event.listen(Session, "after_begin", _set_statement_timeout)
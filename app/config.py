@@ -1,4 +1,5 @@
 import os
+from typing import Literal
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -14,6 +15,114 @@ class Settings(BaseSettings):
     ALGORITHM: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
 
+    # Пул соединений одного процесса; app.serve пересчитывает его из бюджета
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    # Бюджет соединений Postgres (max_connections) и резерв под миграции/админку
+    DB_MAX_CONNECTIONS: int = 100
+    DB_RESERVED_CONNECTIONS: int = 10
+    # Склейка одиночных выборок по id в WHERE id IN (...): окно (0 — один тик loop) и размер пачки
+    DB_BATCH_WINDOW_US: int = 0
+    DB_BATCH_MAX_SIZE: int = 500
+
+    # Снимок зарплат в памяти процесса для /salary/me/
+    SALARY_SNAPSHOT_ENABLED: bool = False
+    SALARY_SNAPSHOT_REFRESH_INTERVAL: float = 1.0
+    SALARY_SNAPSHOT_MAX_STALENESS: float = 5.0
+    SALARY_SNAPSHOT_OVERLAP: float = 30.0
+    # Агрегаты по зарплатам на снимке: шаг гистограммы и период полной пересборки
+    SALARY_STATS_BUCKET: int = 5000
+    SALARY_STATS_RECONCILE_INTERVAL: float = 3600.0
+
+    # Аудит просмотров зарплаты: очередь в памяти, запись пачками раз в интервал или по размеру пачки.
+    # При переполнении очереди "drop" отбрасывает событие, "block" задерживает запрос
+    SALARY_AUDIT_ENABLED: bool = True
+    SALARY_AUDIT_FLUSH_INTERVAL_MS: float = 200.0
+    SALARY_AUDIT_BATCH_SIZE: int = 500
+    SALARY_AUDIT_QUEUE_SIZE: int = 10000
+    SALARY_AUDIT_OVERFLOW: Literal["drop", "block"] = "drop"
+
+    # Шина инвалидации кэшей между воркерами (Postgres LISTEN/NOTIFY, в SQLite — опрос журнала)
+    INVALIDATION_BUS_ENABLED: bool = False
+    INVALIDATION_POLL_INTERVAL: float = 1.0
+    INVALIDATION_LOG_RETENTION: float = 600.0
+
+    # Шарды пользователей и зарплат {"имя": "url БД"}; пусто — всё в основной БД.
+    # Каталог user_shards в основной БД кэшируется на SHARD_CACHE_SIZE пользователей
+    SHARD_URLS: dict[str, str] = {}
+    SHARD_CACHE_SIZE: int = 100000
+
+    # Мягкое удаление пользователей: фоновая очистка помеченных строк пачками
+    USER_PURGE_ENABLED: bool = True
+    USER_PURGE_INTERVAL: float = 60.0
+    USER_PURGE_BATCH_SIZE: int = 500
+    USER_PURGE_GRACE: float = 0.0
+
+    # Контроль допуска: слоты и очереди по классам маршрутов, дедлайн запроса (0 — без дедлайна)
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_AUTH_CONCURRENCY: int = 8
+    ADMISSION_AUTH_QUEUE: int = 32
+    ADMISSION_READ_CONCURRENCY: int = 64
+    ADMISSION_READ_QUEUE: int = 256
+    ADMISSION_WRITE_CONCURRENCY: int = 16
+    ADMISSION_WRITE_QUEUE: int = 64
+    ADMISSION_BATCH_CONCURRENCY: int = 2
+    ADMISSION_QUEUE_TIMEOUT: float = 1.0
+    ADMISSION_RETRY_AFTER: int = 1
+    REQUEST_DEADLINE: float = 10.0
+    REQUEST_WRITE_DEADLINE: float = 30.0
+
+    # Idempotency-Key для регистрации и обновления профиля: кэш ответов и срок хранения ключей
+    IDEMPOTENCY_CACHE_SIZE: int = 10000
+    IDEMPOTENCY_TTL: float = 86400.0
+    IDEMPOTENCY_LOCK_TIMEOUT: float = 60.0
+    IDEMPOTENCY_PURGE_INTERVAL: float = 3600.0
+
+    # Размер пачки серверного курсора при потоковой выгрузке ведомости
+    EXPORT_BATCH_SIZE: int = 5000
+    # Каталог колоночных снимков ведомости для аналитики (python -m app.salary.columnar)
+    SALARY_COLUMNAR_DIR: str = "snapshots"
+
+    # Мульти-воркерный запуск (python -m app.serve)
+    WEB_CONCURRENCY: int | None = None
+    WORKER_MAX_REQUESTS: int = 0
+    WORKER_MAX_REQUESTS_JITTER: int = 0
+    WORKER_MAX_MEMORY_MB: int = 0
+
+    # Наблюдаемость: заголовок Server-Timing и структурированный access-лог
+    SERVER_TIMING_ENABLED: bool = False
+    ACCESS_LOG_ENABLED: bool = False
+
+    # Инструментирование SQL: счётчики на запрос, детектор N+1, лог медленных запросов
+    SQL_STATS_ENABLED: bool = False
+    SQL_N_PLUS_ONE_THRESHOLD: int = 5
+    SQL_SLOW_QUERY_MS: float = 500
+
+    # Монитор event loop: такт пульса, порог зависания и не чаще одного стека в LOOP_MONITOR_LOG_INTERVAL секунд
+    LOOP_MONITOR_ENABLED: bool = True
+    LOOP_MONITOR_INTERVAL_MS: float = 50.0
+    LOOP_MONITOR_BLOCK_MS: float = 200.0
+    LOOP_MONITOR_LOG_INTERVAL: float = 60.0
+
+    # Метрики Prometheus; каталог нужен для агрегации между воркерами uvicorn
+    METRICS_ENABLED: bool = True
+    METRICS_MULTIPROC_DIR: str | None = None
+    METRICS_FLUSH_INTERVAL: float = 1.0
+
+    # Пул потоков для bcrypt: хеширование и проверка паролей не блокируют event loop
+    BCRYPT_WORKERS: int = 4
+
+    # Токен администратора для служебных эндпоинтов (заголовок X-Admin-Token)
+    ADMIN_TOKEN: str | None = None
+
+    # Семплирующий профайлер по запросу; выключен по умолчанию
+    PROFILER_ENABLED: bool = False
+    PROFILER_INTERVAL_MS: float = 1.0
+    PROFILER_KEEP_LAST: int = 20
+    PROFILER_OUTPUT_DIR: str | None = None
+    # Срок действия подписанного флага ?__profile= по умолчанию, секунды
+    PROFILER_SIGNATURE_TTL: float = 900.0
+
     model_config = SettingsConfigDict(
         env_file=os.path.join(
             os.path.dirname(os.path.abspath(__file__)),
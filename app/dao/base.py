@@ -1,14 +1,18 @@
 from datetime import datetime
 
 from typing import Annotated
-from sqlalchemy import func
+from sqlalchemy import func, text
 from sqlalchemy import update as sqlalchemy_update
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase, declared_attr, Mapped, mapped_column
 from sqlalchemy.future import select
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.exc import StaleDataError
 
+from app.dao.invalidation import invalidation_bus
+from app.dao.sharding import shard_router
 from app.database import async_session_maker
+from app.monitoring.timing import timed_phase
 
 
 # Аннотации
@@ -32,45 +36,233 @@ class Base(AsyncAttrs, DeclarativeBase):
     updated_at: Mapped[updated_at]
 
 
+class Versioned:
+    '''
+    Примесь версии строки для оптимистичных блокировок: версия растёт на каждом
+    обновлении, запись с устаревшей версией отклоняется (StaleDataError) без
+    SELECT ... FOR UPDATE. Только для изменяемых таблиц; журналы без UPDATE
+    (salary_views, idempotency_keys) её не получают.
+    '''
+
+    version: Mapped[int] = mapped_column(server_default=text("1"), nullable=False)
+
+    @declared_attr.directive
+    def __mapper_args__(cls) -> dict:
+        return {"version_id_col": cls.__table__.c.version}
+
+
 class BaseDAO:
     model = None # Класс модели, с которой работает DAO; должен быть задан в наследниках
-        
+    # Колонка-ключ кэшей модели: изменения публикуются в шину инвалидации по её значениям
+    invalidation_key: str | None = None
+    # Колонка мягкого удаления: записи с заполненным значением не видны методам поиска
+    soft_delete_column: str | None = None
+    # Колонка с user_id, по которому записи распределены между шардами (app/dao/sharding.py)
+    shard_key: str | None = None
+    # Колонки быстрого чтения (read_one, read_many_by) — то, что нужно схемам ответа;
+    # None — все колонки таблицы
+    read_columns: tuple[str, ...] | None = None
+
+    @classmethod
+    def _not_deleted(cls) -> list:
+        '''Условие отбора неудалённых записей (пусто, если мягкого удаления нет).'''
+        if cls.soft_delete_column is None:
+            return []
+        return [getattr(cls.model, cls.soft_delete_column).is_(None)]
+
+    @classmethod
+    async def _session_makers(cls, filter_by: dict) -> list:
+        '''
+        Фабрики сессий БД, где могут лежать записи под фильтр filter_by:
+        без шардирования — основная БД, с фильтром по shard_key — шард
+        пользователя, иначе все шарды.
+        '''
+        if cls.shard_key is None or not shard_router.enabled:
+            return [async_session_maker]
+        if cls.shard_key in filter_by:
+            maker = await shard_router.maker_for_user(filter_by[cls.shard_key])
+            return [maker] if maker is not None else []
+        return shard_router.all_makers()
 
     @classmethod
     async def find_one_or_none_by_id(cls, data_id: int):
         '''Ищет запись по id, возвращает объект или None, если не найдено.'''
-        async with async_session_maker() as session:
-            query = select(cls.model).filter_by(id=data_id)
-            result = await session.execute(query)
-            return result.scalar_one_or_none()
-    
+        return await cls.find_one_or_none(id=data_id)
+
+    @classmethod
+    async def _groups_by_shard(cls, column: str, values: list) -> list:
+        '''Пары (фабрика сессий, значения) для выборки column IN values.'''
+        if column == cls.shard_key and shard_router.enabled:
+            return [
+                (shard_router.makers[shard], keys)
+                for shard, keys in (await shard_router.group_by_shard(values)).items()
+            ]
+        return [(maker, values) for maker in await cls._session_makers({})]
+
+    @classmethod
+    async def find_many_by(cls, column: str, values: list) -> dict:
+        '''
+        Ищет записи, у которых колонка column входит в values, одним запросом IN
+        (при шардировании по shard_key — одним запросом на шард).
+        Возвращает словарь {значение колонки: объект}.
+        '''
+        key = getattr(cls.model, column)
+        found = {}
+        for maker, keys in await cls._groups_by_shard(column, values):
+            async with maker() as session:
+                query = select(cls.model).where(key.in_(keys), *cls._not_deleted())
+                with timed_phase("db"):
+                    result = await session.execute(query)
+                found.update((getattr(obj, column), obj) for obj in result.scalars())
+        return found
+
+    @classmethod
+    def _read_query(cls, fields=None):
+        table = cls.model.__table__
+        names = fields or cls.read_columns or tuple(table.c.keys())
+        return select(*(table.c[name] for name in names)).where(*cls._not_deleted())
+
+    @classmethod
+    async def read_one(cls, fields=None, **filter_by):
+        '''
+        Быстрое чтение: Core select колонок fields (по умолчанию read_columns)
+        без объектов ORM и identity map. Возвращает Row — атрибуты по именам
+        колонок, пригодна для model_validate схем с from_attributes — или None.
+        Изменять строку нельзя: для записи — update().
+        '''
+        query = cls._read_query(fields).filter_by(**filter_by)
+        for maker in await cls._session_makers(filter_by):
+            async with maker() as session:
+                connection = await session.connection()
+                with timed_phase("db"):
+                    row = (await connection.execute(query)).one_or_none()
+                if row is not None:
+                    return row
+        return None
+
+    @classmethod
+    async def read_many_by(cls, column: str, values: list, fields=None) -> dict:
+        '''Быстрое чтение по column IN values (см. read_one); {значение колонки: Row}.'''
+        table = cls.model.__table__
+        if fields is not None and column not in fields:
+            fields = (*fields, column)
+        found = {}
+        for maker, keys in await cls._groups_by_shard(column, values):
+            async with maker() as session:
+                connection = await session.connection()
+                with timed_phase("db"):
+                    result = await connection.execute(cls._read_query(fields).where(table.c[column].in_(keys)))
+                found.update((getattr(row, column), row) for row in result)
+        return found
+
     @classmethod
     async def find_one_or_none(cls, **filter_by):
         '''Ищет запись по произвольным фильтрам, возвращает объект или None.'''
-        async with async_session_maker() as session:
-            query = select(cls.model).filter_by(**filter_by)
-            result = await session.execute(query)
-            return result.scalar_one_or_none()
+        for maker in await cls._session_makers(filter_by):
+            async with maker() as session:
+                query = select(cls.model).filter_by(**filter_by).where(*cls._not_deleted())
+                with timed_phase("db"):
+                    result = await session.execute(query)
+                obj = result.scalar_one_or_none()
+                if obj is not None:
+                    return obj
+        return None
             
     @classmethod
-    async def update(cls, filter_by, **values):
+    async def update(cls, filter_by, expected_version: int | None = None, **values):
         '''
-        Обновляет поля у записи(ей), удовлетворяющих фильтру filter_by.
-        Возвращает количество обновлённых строк.
+        Обновляет поля у записи(ей), удовлетворяющих фильтру filter_by,
+        и увеличивает их версию (у моделей с Versioned). Возвращает
+        количество обновлённых строк.
+
+        С expected_version обновляется только строка с этой версией;
+        если таких нет (строку уже изменил другой писатель), бросает
+        StaleDataError.
+
+        Если задан invalidation_key, ключи изменённых строк возвращаются
+        через RETURNING и публикуются в шину инвалидации в той же транзакции.
+        '''
+        conditions = [getattr(cls.model, k) == v for k, v in filter_by.items()]
+        if issubclass(cls.model, Versioned):
+            values = {**values, "version": cls.model.version + 1}
+            if expected_version is not None:
+                conditions.append(cls.model.version == expected_version)
+        elif expected_version is not None:
+            raise TypeError(f"{cls.model.__name__} не версионируется (нет примеси Versioned)")
+
+        key_column = getattr(cls.model, cls.invalidation_key) if cls.invalidation_key else None
+        updated = 0
+        keys = []
+        for maker in await cls._session_makers(filter_by):
+            async with maker() as session:
+                async with session.begin():
+                    query = (
+                        sqlalchemy_update(cls.model)
+                        .where(*conditions, *cls._not_deleted())
+                        .values(**values)
+                        .execution_options(synchronize_session="fetch")
+                    )
+                    if key_column is not None:
+                        query = query.returning(key_column)
+                    with timed_phase("db"):
+                        result = await session.execute(query)
+                        if key_column is not None:
+                            shard_keys = result.scalars().all()
+                            await invalidation_bus.publish(session, cls.model.__tablename__, shard_keys)
+                            keys.extend(shard_keys)
+                        else:
+                            updated += result.rowcount
+                        try:
+                            await session.commit()
+                        except SQLAlchemyError as e:
+                            await session.rollback()
+                            raise e
+        if key_column is not None:
+            invalidation_bus.dispatch(cls.model.__tablename__, keys)
+            updated = len(keys)
+        if expected_version is not None and not updated:
+            raise StaleDataError(f"{cls.model.__tablename__}: версия {expected_version} устарела")
+        return updated
+
+    @classmethod
+    async def update_versioned(cls, column: str, rows: list[dict]) -> list:
+        '''
+        Массовое обновление с оптимистичной блокировкой, без SELECT ... FOR UPDATE.
+
+        rows — словари {column: ключ, "version": ожидаемая версия, поле: значение, ...}.
+        Каждая строка обновляется, только если её версия не изменилась; все
+        обновления одной БД (шарда) выполняются в одной транзакции. Возвращает
+        ключи конфликтующих строк: их можно перечитать и повторить, не трогая
+        остальные.
         '''
-        
-        async with async_session_maker() as session:
-            async with session.begin():
-                query = (
-                    sqlalchemy_update(cls.model)
-                    .where(*[getattr(cls.model, k) == v for k, v in filter_by.items()])
-                    .values(**values)
-                    .execution_options(synchronize_session="fetch")
-                )
-                result = await session.execute(query)
-                try:
-                    await session.commit()
-                except SQLAlchemyError as e:
-                    await session.rollback()
-                    raise e
-                return result.rowcount
+        key = getattr(cls.model, column)
+        # ключи кэшей изменённых строк для шины инвалидации
+        cache_key = getattr(cls.model, cls.invalidation_key) if cls.invalidation_key else key
+        by_key = {row[column]: row for row in rows}
+        updated_keys, cache_keys = [], []
+        for maker, keys in await cls._groups_by_shard(column, list(by_key)):
+            async with maker() as session:
+                async with session.begin():
+                    shard_cache_keys = []
+                    for value in keys:
+                        row = by_key[value]
+                        values = {name: v for name, v in row.items() if name not in (column, "version")}
+                        query = (
+                            sqlalchemy_update(cls.model)
+                            .where(key == value, cls.model.version == row["version"], *cls._not_deleted())
+                            .values(**values, version=cls.model.version + 1)
+                            .returning(cache_key)
+                            .execution_options(synchronize_session=False)
+                        )
+                        with timed_phase("db"):
+                            changed = (await session.execute(query)).first()
+                        if changed is not None:
+                            updated_keys.append(value)
+                            shard_cache_keys.append(changed[0])
+                    if cls.invalidation_key:
+                        await invalidation_bus.publish(session, cls.model.__tablename__, shard_cache_keys)
+                cache_keys.extend(shard_cache_keys)
+        if cls.invalidation_key:
+            invalidation_bus.dispatch(cls.model.__tablename__, cache_keys)
+        updated = set(updated_keys)
+        return [value for value in by_key if value not in updated]
@@ -0,0 +1,315 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+
+from fastapi import HTTPException, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlalchemy import delete, insert, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.future import select
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.config import settings
+from app.dao.base import Base
+from app.database import async_session_maker
+from app.monitoring.timing import timed_phase
+
+
+logger = logging.getLogger("app.idempotency")
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+class IdempotencyKey(Base):
+    '''
+    Результат запроса с заголовком Idempotency-Key.
+
+    Поля:
+    - scope: эндпоинт и, для авторизованных запросов, id пользователя
+    - key: значение заголовка Idempotency-Key
+    - request_hash: HMAC тела запроса (request_fingerprint); повтор ключа с другим телом отклоняется
+    - status_code, response: сохранённый ответ; NULL — запрос ещё выполняется
+    - headers: заголовки ответа (JSON), например ETag; повтор отдаёт их же
+    - locked_at: когда запрос начал выполняться (для перехвата брошенных ключей)
+    - expires_at: после этого времени ключ можно использовать заново
+    '''
+
+    __tablename__ = "idempotency_keys"
+    scope: Mapped[str] = mapped_column(primary_key=True)
+    key: Mapped[str] = mapped_column(primary_key=True)
+    request_hash: Mapped[str]
+    status_code: Mapped[int] = mapped_column(nullable=True)
+    response: Mapped[str] = mapped_column(nullable=True)
+    headers: Mapped[str] = mapped_column(nullable=True)
+    locked_at: Mapped[datetime]
+    expires_at: Mapped[datetime] = mapped_column(index=True)
+
+
+def request_fingerprint(payload: BaseModel) -> str:
+    '''
+    HMAC-SHA256 тела запроса на SECRET_KEY. Тело регистрации содержит пароль
+    в открытом виде: простой sha256 из утёкшей таблицы idempotency_keys
+    позволил бы подбирать пароли по словарю.
+    '''
+    body = payload.model_dump_json().encode()
+    return hmac.new(settings.SECRET_KEY.encode(), body, hashlib.sha256).hexdigest()
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# куки не сохраняются — в них могут быть токены; длину и тип выставит JSONResponse
+_UNSTORED_HEADERS = frozenset({"set-cookie", "content-length", "content-type"})
+
+
+def _stored_headers(response: Response) -> dict[str, str]:
+    '''Заголовки ответа handler (например, ETag), которые отдаются и при повторах.'''
+    return {name: value for name, value in response.headers.items() if name not in _UNSTORED_HEADERS}
+
+
+class _Outcome:
+    __slots__ = ("request_hash", "status_code", "body", "headers", "expires_at")
+
+    def __init__(self, request_hash: str, status_code: int, body, headers: dict[str, str], expires_at: float):
+        self.request_hash = request_hash
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers
+        self.expires_at = expires_at  # time.monotonic()
+
+
+class IdempotencyStore:
+    '''
+    Хранилище ответов для повторов запросов с Idempotency-Key.
+
+    Завершённые ответы лежат в LRU-кэше процесса (IDEMPOTENCY_CACHE_SIZE
+    записей, TTL — IDEMPOTENCY_TTL секунд) и в таблице idempotency_keys,
+    общей для всех воркеров. Повтор отдаётся из кэша без хеширования
+    пароля и записи в БД. Одновременные дубликаты в одном процессе ждут
+    первое выполнение; дубликат, выполняющийся в другом воркере, получает
+    409 с Retry-After. Ключ, брошенный упавшим воркером, перехватывается
+    через IDEMPOTENCY_LOCK_TIMEOUT секунд.
+
+    Сохраняются успешные ответы и ошибки 4xx; при 5xx и исключениях ключ
+    освобождается, и повтор выполняет запрос заново.
+    '''
+
+    def __init__(self):
+        self._cache: OrderedDict[tuple[str, str], _Outcome] = OrderedDict()
+        self._inflight: dict[tuple[str, str], asyncio.Future] = {}
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def _remember(self, cache_key: tuple[str, str], outcome: _Outcome) -> None:
+        self._cache[cache_key] = outcome
+        self._cache.move_to_end(cache_key)
+        if len(self._cache) > settings.IDEMPOTENCY_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    def _cached(self, cache_key: tuple[str, str]) -> _Outcome | None:
+        outcome = self._cache.get(cache_key)
+        if outcome is None:
+            return None
+        if outcome.expires_at < time.monotonic():
+            del self._cache[cache_key]
+            return None
+        self._cache.move_to_end(cache_key)
+        return outcome
+
+    async def _claim(self, scope: str, key: str, request_hash: str) -> _Outcome | None:
+        '''
+        Занимает ключ в БД. Возвращает сохранённый ответ, если запрос уже
+        выполнен, иначе None (ключ занят этим процессом).
+        '''
+        now = _utcnow()
+        expires_at = now + timedelta(seconds=settings.IDEMPOTENCY_TTL)
+        table = IdempotencyKey.__table__
+        async with async_session_maker() as session:
+            with timed_phase("db"):
+                try:
+                    await session.execute(
+                        insert(table).values(
+                            scope=scope, key=key, request_hash=request_hash,
+                            locked_at=now, expires_at=expires_at,
+                        )
+                    )
+                    await session.commit()
+                    return None
+                except IntegrityError:
+                    await session.rollback()
+
+                # ключ истёк или брошен упавшим воркером — перехватываем
+                result = await session.execute(
+                    update(table)
+                    .where(table.c.scope == scope, table.c.key == key)
+                    .where(or_(
+                        table.c.expires_at < now,
+                        (table.c.status_code.is_(None))
+                        & (table.c.locked_at < now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)),
+                    ))
+                    .values(
+                        request_hash=request_hash, status_code=None, response=None, headers=None,
+                        locked_at=now, expires_at=expires_at,
+                    )
+                    .returning(table.c.key)
+                )
+                if result.first() is not None:
+                    await session.commit()
+                    return None
+
+                row = (await session.execute(
+                    select(
+                        table.c.request_hash, table.c.status_code, table.c.response, table.c.headers,
+                        table.c.expires_at,
+                    )
+                    .where(table.c.scope == scope, table.c.key == key)
+                )).first()
+
+        if row is None or row.status_code is None:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Запрос с этим Idempotency-Key ещё выполняется",
+                headers={"Retry-After": "1"},
+            )
+        ttl = (row.expires_at - now).total_seconds()
+        return _Outcome(
+            row.request_hash, row.status_code, json.loads(row.response), json.loads(row.headers or "{}"),
+            time.monotonic() + ttl,
+        )
+
+    async def _complete(self, scope: str, key: str, outcome: _Outcome) -> None:
+        table = IdempotencyKey.__table__
+        async with async_session_maker() as session:
+            with timed_phase("db"):
+                await session.execute(
+                    update(table)
+                    .where(table.c.scope == scope, table.c.key == key)
+                    .values(
+                        status_code=outcome.status_code,
+                        response=json.dumps(outcome.body),
+                        headers=json.dumps(outcome.headers),
+                    )
+                )
+                await session.commit()
+
+    async def _release(self, scope: str, key: str) -> None:
+        table = IdempotencyKey.__table__
+        async with async_session_maker() as session:
+            await session.execute(delete(table).where(table.c.scope == scope, table.c.key == key))
+            await session.commit()
+
+    async def run(
+        self,
+        scope: str,
+        key: str | None,
+        payload: BaseModel,
+        handler: Callable[[], Awaitable],
+        status_code: int = status.HTTP_200_OK,
+    ):
+        '''
+        Выполняет handler() не более одного раза для пары (scope, key).
+
+        Без ключа просто возвращает результат handler(). С ключом возвращает
+        JSONResponse с сохранённым (или только что полученным) ответом;
+        HTTPException 4xx из handler тоже сохраняется и повторяется.
+
+        handler может вернуть готовый Response (уже сериализованный JSON):
+        тогда сохраняются его тело, статус и заголовки (например, ETag),
+        и отдаются и при первом выполнении, и при повторах.
+        '''
+        if key is None:
+            return await handler()
+
+        request_hash = request_fingerprint(payload)
+        cache_key = (scope, key)
+
+        replayed = True
+        outcome = self._cached(cache_key)
+        if outcome is None and cache_key in self._inflight:
+            outcome = await asyncio.shield(self._inflight[cache_key])
+        if outcome is None:
+            outcome, replayed = await self._execute(cache_key, request_hash, handler, status_code)
+
+        if outcome.request_hash != request_hash:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key уже использован с другим телом запроса",
+            )
+        headers = {**outcome.headers, REPLAYED_HEADER: "true"} if replayed else outcome.headers
+        return JSONResponse(outcome.body, status_code=outcome.status_code, headers=headers)
+
+    async def _execute(
+        self, cache_key, request_hash: str, handler, status_code: int,
+    ) -> tuple[_Outcome, bool]:
+        '''Выполняет запрос или читает ответ из БД; второй элемент — был ли ответ сохранён раньше.'''
+        scope, key = cache_key
+        future = self._inflight[cache_key] = asyncio.get_running_loop().create_future()
+        claimed = False
+        try:
+            stored = await self._claim(scope, key, request_hash)
+            if stored is not None:
+                self._remember(cache_key, stored)
+                future.set_result(stored)
+                return stored, True
+            claimed = True
+
+            try:
+                result = await handler()
+                if isinstance(result, Response):
+                    body, code, headers = json.loads(result.body), result.status_code, _stored_headers(result)
+                else:
+                    body, code, headers = jsonable_encoder(result), status_code, {}
+            except HTTPException as e:
+                if e.status_code >= 500:
+                    raise
+                body, code, headers = {"detail": e.detail}, e.status_code, dict(e.headers or {})
+
+            outcome = _Outcome(request_hash, code, body, headers, time.monotonic() + settings.IDEMPOTENCY_TTL)
+            await self._complete(scope, key, outcome)
+            self._remember(cache_key, outcome)
+            future.set_result(outcome)
+            return outcome, False
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+                future.exception()  # ошибку получат ожидающие; без них не логируем
+            if claimed:
+                # освобождаем ключ, чтобы повтор выполнил запрос заново
+                try:
+                    await self._release(scope, key)
+                except Exception:
+                    logger.exception("Не удалось освободить Idempotency-Key")
+            raise
+        finally:
+            self._inflight.pop(cache_key, None)
+
+    async def purge_expired(self) -> int:
+        '''Удаляет из таблицы истёкшие ключи; возвращает их число.'''
+        table = IdempotencyKey.__table__
+        async with async_session_maker() as session:
+            result = await session.execute(delete(table).where(table.c.expires_at < _utcnow()))
+            await session.commit()
+        return result.rowcount
+
+    async def purge_periodically(self) -> None:
+        '''Фоновая очистка истёкших ключей; ошибки БД не останавливают цикл.'''
+        while True:
+            await asyncio.sleep(settings.IDEMPOTENCY_PURGE_INTERVAL)
+            try:
+                await self.purge_expired()
+            except Exception:
+                logger.exception("Не удалось удалить истёкшие Idempotency-Key")
+
+
+idempotency_store = IdempotencyStore()
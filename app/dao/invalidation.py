@@ -0,0 +1,203 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, delete, func, insert
+from sqlalchemy.future import select
+
+from app.config import settings
+from app.database import async_session_maker, engine
+
+
+logger = logging.getLogger("app.invalidation")
+
+CHANNEL = "cache_invalidation"
+# лимит payload у NOTIFY — 8000 байт, ключи отправляем пачками
+NOTIFY_KEYS_PER_MESSAGE = 500
+
+# Журнал событий для СУБД без LISTEN/NOTIFY (SQLite в тестах).
+# Отдельная MetaData: таблица создаётся шиной при старте и не попадает в миграции.
+log_metadata = MetaData()
+invalidation_log = Table(
+    "cache_invalidation_log",
+    log_metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("table_name", String, nullable=False),
+    Column("key", Integer, nullable=False),
+    Column("created_at", DateTime, server_default=func.now(), nullable=False),
+)
+
+
+class InvalidationBus:
+    '''
+    Шина инвалидации кэшей между воркерами и узлами.
+
+    Пути записи DAO публикуют события (таблица, ключ, updated_at) в той же
+    транзакции, что и изменение: на Postgres — через pg_notify (доставка
+    только после коммита), на остальных СУБД — строкой в журнал
+    cache_invalidation_log. Каждый воркер держит одно выделенное asyncpg-
+    соединение с LISTEN (или опрашивает журнал) и вызывает подписчиков,
+    которые вытесняют ключи из своих кэшей.
+
+    Локальные подписчики вызываются и сразу после коммита в этом же
+    процессе, поэтому собственные записи видны без задержки. Пока шина
+    выключена (INVALIDATION_BUS_ENABLED=false), работает только локальная
+    доставка, и пути записи не выполняют лишних запросов.
+    '''
+
+    def __init__(self):
+        self._subscribers: dict[str, list] = defaultdict(list)
+        self._reset_subscribers: list = []
+        self._last_log_id = 0
+
+    def subscribe(self, table: str, callback) -> None:
+        '''callback(key, updated_at) вызывается на каждое событие таблицы.'''
+        self._subscribers[table].append(callback)
+
+    def subscribe_reset(self, callback) -> None:
+        '''callback() вызывается, когда события могли быть потеряны (переподключение).'''
+        self._reset_subscribers.append(callback)
+
+    def clear(self) -> None:
+        self._subscribers.clear()
+        self._reset_subscribers.clear()
+
+    def dispatch(self, table: str, keys, updated_at: datetime | None = None) -> None:
+        '''Доставляет событие подписчикам этого процесса.'''
+        for callback in self._subscribers.get(table, ()):
+            for key in keys:
+                try:
+                    callback(key, updated_at)
+                except Exception:
+                    logger.exception("Ошибка подписчика инвалидации %s", table)
+
+    def _reset(self) -> None:
+        for callback in self._reset_subscribers:
+            try:
+                callback()
+            except Exception:
+                logger.exception("Ошибка подписчика сброса кэшей")
+
+    async def publish(self, session, table: str, keys) -> None:
+        '''
+        Публикует событие для других воркеров в транзакции session.
+        Вызывается до коммита; другие процессы увидят событие после него.
+        '''
+        keys = list(keys)
+        if not settings.INVALIDATION_BUS_ENABLED or not keys:
+            return
+        if session.get_bind().dialect.name == "postgresql":
+            now = datetime.now(timezone.utc).isoformat()
+            for i in range(0, len(keys), NOTIFY_KEYS_PER_MESSAGE):
+                payload = json.dumps({"table": table, "keys": keys[i:i + NOTIFY_KEYS_PER_MESSAGE], "updated_at": now})
+                await session.execute(select(func.pg_notify(CHANNEL, payload)))
+        else:
+            await session.execute(
+                insert(invalidation_log), [{"table_name": table, "key": key} for key in keys],
+            )
+
+    def _on_notify(self, connection, pid, channel, payload) -> None:
+        try:
+            event = json.loads(payload)
+            updated_at = datetime.fromisoformat(event["updated_at"]) if event.get("updated_at") else None
+            self.dispatch(event["table"], event["keys"], updated_at)
+        except (ValueError, KeyError):
+            logger.warning("Некорректное событие инвалидации: %r", payload)
+
+    async def listen_postgres(self, dsn: str | None = None) -> None:
+        '''
+        Держит выделенное LISTEN-соединение и переподключается при обрыве.
+        dsn — другая БД (шард), по умолчанию основная.
+        '''
+        import asyncpg
+
+        params = {"dsn": dsn} if dsn is not None else {
+            "host": settings.DB_HOST,
+            "port": settings.DB_PORT,
+            "user": settings.DB_USER,
+            "password": settings.DB_PASSWORD,
+            "database": settings.DB_NAME,
+        }
+        delay = 1.0
+        reconnect = False
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(**params)
+                await connection.add_listener(CHANNEL, self._on_notify)
+                if reconnect:
+                    # пока соединения не было, события могли потеряться
+                    self._reset()
+                reconnect = True
+                delay = 1.0
+                while not connection.is_closed():
+                    await asyncio.sleep(settings.INVALIDATION_POLL_INTERVAL)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("LISTEN-соединение шины инвалидации потеряно")
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    async def poll_log(self) -> None:
+        '''Опрашивает журнал событий (fallback для СУБД без LISTEN/NOTIFY).'''
+        async with engine.begin() as conn:
+            await conn.run_sync(log_metadata.create_all)
+        async with async_session_maker() as session:
+            self._last_log_id = (await session.scalar(select(func.max(invalidation_log.c.id)))) or 0
+
+        while True:
+            await asyncio.sleep(settings.INVALIDATION_POLL_INTERVAL)
+            try:
+                await self.poll_once()
+            except Exception:
+                logger.exception("Не удалось прочитать журнал инвалидации")
+
+    async def poll_once(self) -> None:
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(invalidation_log.c.id, invalidation_log.c.table_name,
+                       invalidation_log.c.key, invalidation_log.c.created_at)
+                .where(invalidation_log.c.id > self._last_log_id)
+                .order_by(invalidation_log.c.id)
+            )
+            for log_id, table, key, created_at in result:
+                self.dispatch(table, [key], created_at)
+                self._last_log_id = log_id
+
+            # события старше окна хранения уже прочитаны всеми живыми воркерами
+            await session.execute(
+                delete(invalidation_log).where(
+                    invalidation_log.c.created_at
+                    < datetime.now(timezone.utc).replace(tzinfo=None)
+                    - timedelta(seconds=settings.INVALIDATION_LOG_RETENTION)
+                )
+            )
+            await session.commit()
+
+    async def run(self) -> None:
+        '''
+        Фоновая задача приёма событий от других воркеров. Записи на шардах
+        публикуют события в БД шарда, поэтому LISTEN держится и на каждом
+        шарде Postgres.
+        '''
+        from app.dao.sharding import shard_router
+
+        listeners = [
+            self.listen_postgres(shard_engine.url.set(drivername="postgresql").render_as_string(hide_password=False))
+            for shard_engine in shard_router.engines.values()
+            if shard_engine.dialect.name == "postgresql"
+        ]
+        if engine.dialect.name == "postgresql":
+            listeners.append(self.listen_postgres())
+        else:
+            listeners.append(self.poll_log())
+        await asyncio.gather(*listeners)
+
+
+invalidation_bus = InvalidationBus()
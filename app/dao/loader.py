@@ -0,0 +1,106 @@
+import asyncio
+import contextvars
+from weakref import WeakKeyDictionary
+
+from app.admission import current_deadline, set_deadline
+from app.config import settings
+from app.monitoring.sql import attribute_queries, collect_queries
+from app.monitoring.timing import timed_phase
+
+
+class _LoopState:
+    __slots__ = ("pending", "deadlines", "inflight", "scheduled")
+
+    def __init__(self):
+        self.pending: dict = {}  # ключи следующей пачки (dict — порядок и быстрый in)
+        self.deadlines: list[float | None] = []  # дедлайны ожидающих следующей пачки
+        self.inflight: dict = {}
+        self.scheduled = False
+
+
+class BatchLoader:
+    '''
+    Загрузчик в стиле DataLoader: склеивает одиночные запросы по ключу,
+    пришедшие в пределах одного тика event loop (или окна
+    DB_BATCH_WINDOW_US микросекунд), в один запрос WHERE key IN (...).
+
+    batch_fn — корутина, принимающая список уникальных ключей и
+    возвращающая словарь {ключ: значение}; отсутствующим ключам
+    достаётся None. Одинаковые ключи, запрошенные одновременно,
+    загружаются один раз. Результаты не кэшируются: после завершения
+    пачки следующий load снова идёт в БД.
+
+    Состояние хранится отдельно для каждого event loop, поэтому загрузчик
+    можно объявлять на уровне модуля. Пачка выполняется в пустом контексте
+    contextvars, а не в контексте запроса, который её запланировал; каждый
+    ожидающий учитывает время ожидания в фазе db и SQL-выражения пачки
+    в своих счётчиках. Дедлайн пачки — самый поздний из дедлайнов её
+    ожидающих (без дедлайна, если он есть не у всех): statement_timeout
+    ограничивает и пакетные запросы, но не обрывает их раньше, чем нужно
+    кому-то из ожидающих.
+    '''
+
+    def __init__(self, batch_fn, max_batch_size: int | None = None):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size or settings.DB_BATCH_MAX_SIZE
+        self._states: WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopState] = WeakKeyDictionary()
+
+    async def load(self, key):
+        loop = asyncio.get_running_loop()
+        state = self._states.get(loop)
+        if state is None:
+            state = self._states[loop] = _LoopState()
+
+        future = state.inflight.get(key)
+        if future is None or key in state.pending:
+            state.deadlines.append(current_deadline())
+        if future is None:
+            future = state.inflight[key] = loop.create_future()
+            state.pending[key] = None
+            if len(state.pending) >= self.max_batch_size:
+                self._dispatch(loop, state)
+            elif not state.scheduled:
+                state.scheduled = True
+                window = settings.DB_BATCH_WINDOW_US / 1_000_000
+                if window > 0:
+                    loop.call_later(window, self._dispatch, loop, state)
+                else:
+                    loop.call_soon(self._dispatch, loop, state)
+
+        # отмена одного из ожидающих не должна отменять общую загрузку
+        with timed_phase("db"):
+            value, stats = await asyncio.shield(future)
+        attribute_queries(stats)
+        return value
+
+    def _dispatch(self, loop, state: _LoopState) -> None:
+        state.scheduled = False
+        if not state.pending:
+            return
+        keys, state.pending = list(state.pending), {}
+        deadlines, state.deadlines = state.deadlines, []
+        # пачка общая для нескольких запросов: без чистого контекста она унаследовала бы
+        # фазы Server-Timing, счётчики SQL и дедлайн того, кто её запланировал
+        context = contextvars.Context()
+        context.run(set_deadline, None if None in deadlines else max(deadlines))
+        loop.create_task(self._run_batch(state, keys), context=context)
+
+    async def _run_batch(self, state: _LoopState, keys: list) -> None:
+        futures = [state.inflight[key] for key in keys]
+        try:
+            with collect_queries() as stats:
+                values = await self.batch_fn(keys)
+        except BaseException as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+                    future.exception()  # ошибку получат ожидающие; без них не логируем
+            if not isinstance(e, Exception):
+                raise
+        else:
+            for key, future in zip(keys, futures):
+                if not future.done():
+                    future.set_result((values.get(key), stats))
+        finally:
+            for key in keys:
+                state.inflight.pop(key, None)
@@ -0,0 +1,417 @@
+'''
+Горизонтальное шардирование пользователей и зарплат по user_id.
+
+Строки users и salary одного пользователя всегда лежат на одном шарде.
+Основная БД (app.database) хранит глобальный каталог user_shards:
+из него выдаются id новых пользователей, по нему вход находит шард
+по email, и в нём записан текущий шард каждого пользователя.
+Новый пользователь попадает на шард, который ему назначает кольцо
+консистентного хеширования; перенос (rebalance) возвращает
+пользователей на назначенные кольцом шарды после изменения SHARD_URLS.
+
+Шарды задаются SHARD_URLS ({"имя": "url"}); пустой словарь — без
+шардирования, все запросы идут в основную БД. Схема шардов создаётся
+миграциями Alembic: alembic -x db_url=<url шарда> upgrade head.
+
+Пока шардирование выключено, каталог не ведётся; при включении
+(основная БД — шард "default") он сверяется с таблицей users основной
+БД (sync_directory, выполняется и в начале rebalance).
+
+    python -m app.dao.sharding sync
+    python -m app.dao.sharding rebalance [--dry-run]
+'''
+import argparse
+import asyncio
+import bisect
+import hashlib
+import logging
+from collections import OrderedDict, defaultdict
+from datetime import timedelta
+
+from sqlalchemy import (
+    bindparam, Column, DateTime, Integer, MetaData, String, Table, delete, func, insert, literal, text, update,
+)
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.future import select
+
+from app.config import settings
+from app.dao.invalidation import invalidation_bus
+from app.dao.loader import BatchLoader
+from app.monitoring.sql import install_query_instrumentation
+
+
+logger = logging.getLogger("app.sharding")
+
+# Каталог живёт только в основной БД, поэтому у него своя MetaData
+directory_metadata = MetaData()
+user_shards = Table(
+    "user_shards",
+    directory_metadata,
+    Column("user_id", Integer, primary_key=True, autoincrement=True),
+    Column("email", String, nullable=False, unique=True),
+    Column("shard", String, nullable=False),
+    Column("created_at", DateTime, server_default=func.now(), nullable=False),
+)
+
+
+class HashRing:
+    '''
+    Кольцо консистентного хеширования: у каждого шарда vnodes точек,
+    ключ принадлежит первой точке по часовой стрелке. При добавлении
+    шарда переезжает примерно 1/N ключей, а не почти все, как при key % N.
+    '''
+
+    def __init__(self, shards, vnodes: int = 64):
+        self._points: list[int] = []
+        self._owners: list[str] = []
+        for point, shard in sorted(
+            (self._hash(f"{shard}#{i}"), shard) for shard in shards for i in range(vnodes)
+        ):
+            self._points.append(point)
+            self._owners.append(shard)
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def shard_for(self, key) -> str:
+        index = bisect.bisect(self._points, self._hash(str(key))) % len(self._points)
+        return self._owners[index]
+
+
+class ShardRouter:
+    '''
+    Выбор БД для запросов пользователя.
+
+    Текущий шард пользователя читается из каталога и кэшируется
+    в LRU процесса (SHARD_CACHE_SIZE записей); одиночные поиски
+    склеиваются в один запрос IN (см. BatchLoader). Перенос пользователя
+    публикует событие user_shards в шину инвалидации, и воркеры
+    вытесняют его из кэша.
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.ring: HashRing | None = None
+        self.engines: dict = {}
+        self.makers: dict[str, async_sessionmaker] = {}
+        self._cache: OrderedDict[int, str] = OrderedDict()
+        self._loader = BatchLoader(self._load_shards)
+
+    def configure(self, urls: dict[str, str], **engine_kw) -> None:
+        '''Создаёт движки шардов; пустой словарь выключает шардирование.'''
+        self.engines = {name: create_async_engine(url, **engine_kw) for name, url in urls.items()}
+        for engine in self.engines.values():
+            install_query_instrumentation(engine)
+        self.makers = {
+            name: async_sessionmaker(engine, expire_on_commit=False) for name, engine in self.engines.items()
+        }
+        self.ring = HashRing(sorted(urls)) if urls else None
+        self.enabled = bool(urls)
+        self._cache.clear()
+
+    async def dispose(self) -> None:
+        for engine in self.engines.values():
+            await engine.dispose()
+
+    def subscribe_to_invalidation(self, bus) -> None:
+        bus.subscribe("user_shards", lambda user_id, updated_at: self._cache.pop(user_id, None))
+        bus.subscribe_reset(self._cache.clear)
+
+    def all_makers(self) -> list:
+        '''Фабрики сессий всех шардов (без шардирования — основной БД).'''
+        from app import database
+
+        return list(self.makers.values()) if self.enabled else [database.async_session_maker]
+
+    def _remember(self, user_id: int, shard: str) -> None:
+        self._cache[user_id] = shard
+        self._cache.move_to_end(user_id)
+        if len(self._cache) > settings.SHARD_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    async def _load_shards(self, user_ids: list[int]) -> dict[int, str]:
+        from app import database
+
+        async with database.async_session_maker() as session:
+            result = await session.execute(
+                select(user_shards.c.user_id, user_shards.c.shard).where(user_shards.c.user_id.in_(user_ids))
+            )
+            return dict(result.all())
+
+    async def shard_of(self, user_id: int) -> str | None:
+        '''Текущий шард пользователя или None, если его нет в каталоге.'''
+        shard = self._cache.get(user_id)
+        if shard is not None:
+            self._cache.move_to_end(user_id)
+            return shard
+        shard = await self._loader.load(user_id)
+        if shard is not None:
+            self._remember(user_id, shard)
+        return shard
+
+    async def maker_for_user(self, user_id: int):
+        shard = await self.shard_of(user_id)
+        return self.makers.get(shard) if shard is not None else None
+
+    async def group_by_shard(self, user_ids) -> dict[str, list]:
+        '''Раскладывает user_id по шардам; отсутствующие в каталоге пропускаются.'''
+        shards = await asyncio.gather(*(self.shard_of(user_id) for user_id in user_ids))
+        groups: dict[str, list] = defaultdict(list)
+        for user_id, shard in zip(user_ids, shards):
+            if shard is not None:
+                groups[shard].append(user_id)
+        return groups
+
+    async def locate_email(self, email: str) -> tuple[int, str] | None:
+        '''(user_id, шард) по email из глобального каталога.'''
+        from app import database
+
+        async with database.async_session_maker() as session:
+            row = (await session.execute(
+                select(user_shards.c.user_id, user_shards.c.shard).where(user_shards.c.email == email)
+            )).first()
+        if row is None:
+            return None
+        self._remember(row.user_id, row.shard)
+        return row.user_id, row.shard
+
+    async def email_of(self, user_id: int) -> str | None:
+        from app import database
+
+        async with database.async_session_maker() as session:
+            return await session.scalar(select(user_shards.c.email).where(user_shards.c.user_id == user_id))
+
+    async def allocate(self, emails: list[str]) -> list[tuple[int, str]]:
+        '''
+        Регистрирует пользователей в каталоге: выдаёт глобальные id и шарды
+        по кольцу. Занятый email — IntegrityError. Порядок — как у emails.
+        '''
+        from app import database
+
+        async with database.async_session_maker() as session:
+            async with session.begin():
+                result = await session.scalars(
+                    insert(user_shards).returning(user_shards.c.user_id, sort_by_parameter_order=True),
+                    [{"email": email, "shard": ""} for email in emails],
+                )
+                user_ids = list(result)
+                placement = [(user_id, self.ring.shard_for(user_id)) for user_id in user_ids]
+                await session.execute(
+                    update(user_shards).where(user_shards.c.user_id == bindparam("key")).values(shard=bindparam("target")),
+                    [{"key": user_id, "target": shard} for user_id, shard in placement],
+                )
+        for user_id, shard in placement:
+            self._remember(user_id, shard)
+        return placement
+
+    async def release(self, user_ids: list[int]) -> None:
+        '''Удаляет пользователей из каталога (откат регистрации, окончательное удаление).'''
+        from app import database
+
+        async with database.async_session_maker() as session:
+            await session.execute(delete(user_shards).where(user_shards.c.user_id.in_(user_ids)))
+            await session.commit()
+        for user_id in user_ids:
+            self._cache.pop(user_id, None)
+
+    async def rename(self, user_id: int, email: str) -> None:
+        '''Меняет email в каталоге; занятый email — IntegrityError.'''
+        from app import database
+
+        async with database.async_session_maker() as session:
+            await session.execute(update(user_shards).where(user_shards.c.user_id == user_id).values(email=email))
+            await session.commit()
+
+
+shard_router = ShardRouter()
+if settings.SHARD_URLS:
+    shard_router.configure(
+        settings.SHARD_URLS,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+    )
+
+
+async def move_user(user_id: int, source: str, target: str) -> bool:
+    '''
+    Переносит пользователя и его зарплату с шарда source на target.
+
+    1. На source блокируются строка пользователя и его зарплаты (FOR UPDATE
+       на Postgres; SQLite блокирует запись во всю БД): конкурирующие записи,
+       в том числе SalaryDAO.update по salary.user_id, ждут окончания
+       переноса и затем не находят строк, то есть ничего не обновляют,
+       а не теряются.
+    2. Строки копируются на target (устаревшая копия от прерванного
+       переноса сначала удаляется) и коммитятся.
+    3. Каталог переключается на target, воркеры получают событие инвалидации.
+    4. Строки удаляются с source.
+    Прерванный на любом шаге перенос безопасно повторяется.
+    Возвращает False, если пользователя на source уже нет.
+    '''
+    from app import database
+    from app.salary.models import Salary
+    from app.users.models import User
+
+    users, salary = User.__table__, Salary.__table__
+    async with shard_router.makers[source]() as src, shard_router.makers[target]() as dst:
+        user_query = select(users).where(users.c.id == user_id)
+        salary_query = select(salary).where(salary.c.user_id == user_id)
+        if src.get_bind().dialect.name == "postgresql":
+            user_query = user_query.with_for_update()
+            salary_query = salary_query.with_for_update()
+        else:
+            # блокировок строк нет: транзакция сразу берёт блокировку записи
+            await src.execute(text("BEGIN IMMEDIATE"))
+        user_row = (await src.execute(user_query)).mappings().first()
+        if user_row is None:
+            return False
+        salary_rows = (await src.execute(salary_query)).mappings().all()
+
+        await dst.execute(delete(salary).where(salary.c.user_id == user_id))
+        await dst.execute(delete(users).where(users.c.id == user_id))
+        await dst.execute(insert(users).values(**user_row))
+        if salary_rows:
+            # id зарплат локальны для шарда: на target выдаётся новый
+            await dst.execute(insert(salary), [{k: v for k, v in row.items() if k != "id"} for row in salary_rows])
+        await dst.commit()
+
+        async with database.async_session_maker() as session:
+            await session.execute(update(user_shards).where(user_shards.c.user_id == user_id).values(shard=target))
+            await invalidation_bus.publish(session, "user_shards", [user_id])
+            await session.commit()
+        invalidation_bus.dispatch("user_shards", [user_id])
+
+        await src.execute(delete(salary).where(salary.c.user_id == user_id))
+        await src.execute(delete(users).where(users.c.id == user_id))
+        await src.commit()
+    return True
+
+
+# Строки каталога моложе этого срока sync_directory не удаляет: это может быть
+# регистрация, уже получившая id в каталоге, но ещё не записавшая строку на шард
+SYNC_IN_FLIGHT_GRACE = timedelta(minutes=10)
+
+
+async def sync_directory() -> int:
+    '''
+    Сверяет каталог с таблицей users основной БД (шард "default").
+
+    Без шардирования регистрации, смена email и очистка пишут только
+    в users, и каталог, заполненный миграцией, отстаёт. В одной транзакции:
+    1. удаляются строки шарда "default", которых нет в users или у которых
+       другой email (кроме совсем свежих, см. SYNC_IN_FLIGHT_GRACE);
+    2. добавляются пользователи users, которых нет в каталоге;
+    3. на Postgres последовательность user_id сдвигается за max(users.id),
+       чтобы allocate не выдал уже занятый id.
+    Возвращает число добавленных строк.
+    '''
+    from app import database
+    from app.users.models import User
+
+    users = User.__table__
+    async with database.async_session_maker() as session:
+        async with session.begin():
+            is_postgres = session.get_bind().dialect.name == "postgresql"
+            # created_at пишется часами СУБД — и граница считается ими же
+            if is_postgres:
+                cutoff = func.now() - SYNC_IN_FLIGHT_GRACE
+            else:
+                cutoff = func.datetime("now", f"-{int(SYNC_IN_FLIGHT_GRACE.total_seconds())} seconds")
+            current = select(users.c.id).where(users.c.id == user_shards.c.user_id, users.c.email == user_shards.c.email)
+            await session.execute(
+                delete(user_shards).where(
+                    user_shards.c.shard == "default",
+                    user_shards.c.created_at < cutoff,
+                    ~current.exists(),
+                )
+            )
+            missing = select(users.c.id, users.c.email, literal("default")).where(
+                ~select(user_shards.c.user_id).where(user_shards.c.user_id == users.c.id).exists()
+            )
+            result = await session.execute(
+                insert(user_shards).from_select(["user_id", "email", "shard"], missing)
+            )
+            if is_postgres:
+                await session.execute(text(
+                    "SELECT setval(pg_get_serial_sequence('user_shards', 'user_id'), "
+                    "GREATEST((SELECT MAX(user_id) FROM user_shards), (SELECT MAX(id) FROM users), 0) + 1, false)"
+                ))
+    shard_router._cache.clear()
+    added = result.rowcount
+    logger.info("Каталог шардов сверен с users: добавлено %d", added)
+    return added
+
+
+async def rebalance(batch_size: int = 1000, dry_run: bool = False) -> int:
+    '''
+    Переносит пользователей, чей шард в каталоге не совпадает с назначенным
+    кольцом (после добавления или удаления шардов в SHARD_URLS). Каталог
+    обходится пачками по user_id; сервис продолжает работать во время
+    переноса. Перед переносом каталог сверяется с users (sync_directory;
+    при dry_run — нет). Возвращает число перенесённых (или, при dry_run,
+    подлежащих переносу) пользователей.
+    '''
+    from app import database
+
+    if not dry_run:
+        await sync_directory()
+    moved = 0
+    last_id = 0
+    while True:
+        async with database.async_session_maker() as session:
+            rows = (await session.execute(
+                select(user_shards.c.user_id, user_shards.c.shard)
+                .where(user_shards.c.user_id > last_id)
+                .order_by(user_shards.c.user_id)
+                .limit(batch_size)
+            )).all()
+        if not rows:
+            return moved
+        for user_id, shard in rows:
+            target = shard_router.ring.shard_for(user_id)
+            if target == shard:
+                continue
+            if dry_run or await move_user(user_id, shard, target):
+                moved += 1
+        last_id = rows[-1].user_id
+        logger.info("Перенос шардов: user_id <= %d, перенесено %d", last_id, moved)
+
+
+async def _sync_cli() -> None:
+    from app import database
+
+    try:
+        print(f"Добавлено в каталог: {await sync_directory()} пользователей")
+    finally:
+        await shard_router.dispose()
+        await database.engine.dispose()
+
+
+async def _rebalance_cli(dry_run: bool) -> None:
+    from app import database
+
+    try:
+        moved = await rebalance(dry_run=dry_run)
+        print(f"{'К переносу' if dry_run else 'Перенесено'}: {moved} пользователей")
+    finally:
+        await shard_router.dispose()
+        await database.engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Управление шардами пользователей")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("sync", help="сверить каталог user_shards с users основной БД")
+    rebalance_parser = commands.add_parser("rebalance", help="перенести пользователей на назначенные кольцом шарды")
+    rebalance_parser.add_argument("--dry-run", action="store_true", help="только посчитать пользователей к переносу")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "sync":
+        asyncio.run(_sync_cli())
+    elif args.command == "rebalance":
+        asyncio.run(_rebalance_cli(args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,17 @@
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
-from app.config import get_db_url
+from app.config import get_db_url, settings
+from app.monitoring.sql import install_query_instrumentation
 
 
 DATABASE_URL = get_db_url()
 # Создаем асинхронный движок SQLAlchemy для подключения к базе данных
-engine = create_async_engine(DATABASE_URL)
+engine = create_async_engine(
+    DATABASE_URL,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+)
+install_query_instrumentation(engine)
 async_session_maker = async_sessionmaker(
     engine,
     expire_on_commit=False,
@@ -0,0 +1,71 @@
+'''
+Разреженные наборы полей ответа: ?fields=amount,next_raise_date.
+
+Выбранные поля превращаются в SELECT только нужных колонок
+(BaseDAO.read_one) и в урезанную схему ответа, поэтому лёгкий
+клиент не платит за чтение и сериализацию лишнего.
+Неизвестные поля отклоняются с 422 до обращения к БД.
+'''
+from functools import lru_cache
+
+from fastapi import HTTPException, Query, Response, status
+from pydantic import BaseModel, ConfigDict, create_model
+
+
+def parse_fields(schema: type[BaseModel], raw: str | None) -> tuple[str, ...] | None:
+    '''Разбирает список полей через запятую; None — ответ целиком.'''
+    if raw is None:
+        return None
+    fields = tuple(dict.fromkeys(name.strip() for name in raw.split(",") if name.strip()))
+    unknown = [name for name in fields if name not in schema.model_fields]
+    if not fields or unknown:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=(
+                f"Неизвестные поля: {', '.join(unknown) or '(пусто)'}; "
+                f"допустимы: {', '.join(schema.model_fields)}"
+            ),
+        )
+    return fields
+
+
+def fields_param(schema: type[BaseModel]):
+    '''Зависимость FastAPI для параметра ?fields= эндпоинта со схемой ответа schema.'''
+
+    def dependency(
+        fields: str | None = Query(
+            None, description=f"Поля ответа через запятую: {', '.join(schema.model_fields)}",
+        ),
+    ) -> tuple[str, ...] | None:
+        return parse_fields(schema, fields)
+
+    return dependency
+
+
+@lru_cache(maxsize=256)
+def trimmed_model(schema: type[BaseModel], fields: tuple[str, ...]) -> type[BaseModel]:
+    '''Схема только с полями fields (ограничения полей сохраняются, валидаторы — нет).'''
+    return create_model(
+        f"{schema.__name__}Fields",
+        __config__=ConfigDict(from_attributes=True),
+        **{name: (schema.model_fields[name].annotation, schema.model_fields[name]) for name in fields},
+    )
+
+
+def fields_response(schema: type[BaseModel], fields: tuple[str, ...], obj) -> Response:
+    '''JSON-ответ из объекта или строки БД с полями fields.'''
+    return model_response(trimmed_model(schema, fields), obj)
+
+
+def model_response(
+    schema: type[BaseModel], obj, status_code: int = 200, headers: dict[str, str] | None = None,
+) -> Response:
+    '''
+    Готовый JSON-ответ из объекта или строки БД по схеме schema.
+
+    FastAPI не сериализует возвращённый Response повторно через
+    response_model, поэтому вся сериализация происходит здесь, внутри
+    фазы serialize эндпоинта; response_model остаётся для OpenAPI.
+    '''
+    body = schema.model_validate(obj).model_dump_json()
+    return Response(content=body, status_code=status_code, headers=headers, media_type="application/json")
@@ -1,10 +1,74 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
 
+from fastapi import Depends, FastAPI
+
+from app.admission import AdmissionMiddleware, install_statement_deadline
+from app.config import settings
+from app.dao.idempotency import idempotency_store
+from app.dao.invalidation import invalidation_bus
+from app.dao.sharding import shard_router
+from app.monitoring.loop import loop_monitor
+from app.monitoring.metrics import MetricsMiddleware, flush_metrics_periodically
+from app.monitoring.metrics import router as router_metrics
+from app.monitoring.profiler import ProfilerMiddleware
+from app.monitoring.profiler import router as router_profiler
+from app.monitoring.sql import QueryStatsMiddleware
+from app.monitoring.timing import ServerTimingMiddleware
+from app.users.dependencies import require_admin
+from app.users.purge import purge_periodically
 from app.users.router import router as router_users
+from app.salary.audit import salary_audit
+from app.salary.router import admin_router as router_salary_admin
 from app.salary.router import router as router_salary
+from app.salary.snapshot import salary_snapshot
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    '''Запускает фоновые задачи приложения и останавливает их при завершении.'''
+    background_tasks = []
+    if settings.LOOP_MONITOR_ENABLED:
+        # отмена пульса останавливает и поток-сторож
+        background_tasks.append(loop_monitor.start())
+    if shard_router.enabled:
+        shard_router.subscribe_to_invalidation(invalidation_bus)
+    if settings.METRICS_MULTIPROC_DIR:
+        background_tasks.append(asyncio.create_task(flush_metrics_periodically()))
+    if settings.SALARY_SNAPSHOT_ENABLED:
+        salary_snapshot.subscribe_to_invalidation(invalidation_bus)
+        await salary_snapshot.load()
+        background_tasks.append(asyncio.create_task(salary_snapshot.refresh_periodically()))
+        background_tasks.append(asyncio.create_task(salary_snapshot.rebuild_periodically()))
+    if settings.INVALIDATION_BUS_ENABLED:
+        background_tasks.append(asyncio.create_task(invalidation_bus.run()))
+    if settings.USER_PURGE_ENABLED:
+        background_tasks.append(asyncio.create_task(purge_periodically()))
+    background_tasks.append(asyncio.create_task(idempotency_store.purge_periodically()))
+    if settings.SALARY_AUDIT_ENABLED:
+        # при отмене задача дописывает остаток очереди аудита
+        background_tasks.append(asyncio.create_task(salary_audit.run()))
+
+    yield
+
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await shard_router.dispose()
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+# Разбивка времени запроса по фазам (Server-Timing), включается в настройках
+app.add_middleware(ServerTimingMiddleware)
+# Счётчик SQL-запросов и детектор N+1, включается в настройках
+app.add_middleware(QueryStatsMiddleware)
+# Метрики латентности и статусов для /metrics
+app.add_middleware(MetricsMiddleware)
+# Профайлер отдельных запросов по заголовку администратора или подписанному флагу
+app.add_middleware(ProfilerMiddleware)
+# Лимиты параллельности и дедлайн запроса; внешний слой — отказ 503 до всей остальной работы
+app.add_middleware(AdmissionMiddleware)
+install_statement_deadline()
 
 @app.get("/")
 def home_page():
@@ -13,3 +77,7 @@ def home_page():
 # Подключаем маршруты для пользователей и с зарплатами
 app.include_router(router_users)
 app.include_router(router_salary)
+app.include_router(router_salary_admin)
+# /metrics раскрывает латентность маршрутов и состояние очередей — только с X-Admin-Token
+app.include_router(router_metrics, dependencies=[Depends(require_admin)])
+app.include_router(router_profiler)
@@ -0,0 +1,166 @@
+import logging
+import time
+from typing import Callable
+
+from alembic import op
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, MetaData, String, Table, func, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.future import select
+
+
+logger = logging.getLogger("alembic.backfill")
+
+# Таблица контрольных точек живёт вне моделей приложения и создаётся по требованию
+checkpoint_metadata = MetaData()
+backfill_checkpoints = Table(
+    "backfill_checkpoints",
+    checkpoint_metadata,
+    Column("name", String, primary_key=True),
+    Column("last_key", BigInteger, nullable=False),
+    Column("rows_done", BigInteger, nullable=False, server_default=text("0")),
+    Column("finished", Boolean, nullable=False, server_default=text("false")),
+    Column("updated_at", DateTime, server_default=func.now(), nullable=False),
+)
+
+
+class Backfill:
+    '''
+    Пакетный онлайн-перенос данных для миграций Alembic.
+
+    Строки таблицы table обходятся по возрастанию key_column пачками
+    по batch_size (keyset-пагинация, без OFFSET). Каждая пачка
+    обрабатывается функцией process_batch(conn, after_key, last_key)
+    в отдельной короткой транзакции на отдельном соединении вместе
+    с записью контрольной точки, поэтому блокировки держатся только
+    на время одной пачки, а прерванный перенос продолжается с места
+    остановки при повторном запуске миграции.
+
+    process_batch должна обрабатывать строки с after_key < key <= last_key
+    и возвращать число изменённых строк; повторная обработка пачки
+    должна быть безопасной.
+
+    Транзакция миграции перед переносом коммитится (autocommit_block),
+    поэтому перенос стоит выносить в отдельную ревизию после изменений схемы:
+
+        def upgrade():
+            Backfill("users_lower_email", "users").run(process_batch)
+    '''
+
+    def __init__(
+        self,
+        name: str,
+        table: str,
+        key_column: str = "id",
+        batch_size: int = 1000,
+        pause: float = 0.05,
+    ):
+        self.name = name
+        self.table = table
+        self.key_column = key_column
+        self.batch_size = batch_size
+        self.pause = pause  # пауза между пачками, чтобы не забирать ресурсы у живого трафика
+
+    def _load_checkpoint(self, conn: Connection) -> tuple[int, int, bool]:
+        row = conn.execute(
+            select(backfill_checkpoints.c.last_key, backfill_checkpoints.c.rows_done, backfill_checkpoints.c.finished)
+            .where(backfill_checkpoints.c.name == self.name)
+        ).first()
+        if row is None:
+            conn.execute(backfill_checkpoints.insert().values(name=self.name, last_key=0, rows_done=0, finished=False))
+            return 0, 0, False
+        return row.last_key, row.rows_done, row.finished
+
+    def _next_upper_key(self, conn: Connection, after_key: int) -> int | None:
+        '''Ключ последней строки следующей пачки или None, если строк не осталось.'''
+        return conn.execute(
+            text(
+                f"SELECT max({self.key_column}) FROM ("
+                f"SELECT {self.key_column} FROM {self.table} WHERE {self.key_column} > :after "
+                f"ORDER BY {self.key_column} LIMIT :limit) AS batch"
+            ),
+            {"after": after_key, "limit": self.batch_size},
+        ).scalar()
+
+    def run(self, process_batch: Callable[[Connection, int, int], int]) -> int:
+        '''Выполняет перенос до конца; возвращает общее число обработанных строк.'''
+        migration_context = op.get_context()
+        if migration_context.as_sql:
+            raise RuntimeError(f"Перенос данных {self.name} невозможен в offline-режиме (--sql)")
+
+        # снимаем блокировки, взятые миграцией, иначе пачки будут ждать её коммита
+        with migration_context.autocommit_block():
+            return self._run(op.get_bind().engine, process_batch)
+
+    def _run(self, engine, process_batch) -> int:
+        with engine.begin() as conn:
+            checkpoint_metadata.create_all(conn, checkfirst=True)
+            after_key, rows_done, finished = self._load_checkpoint(conn)
+        if finished:
+            logger.info("%s: уже выполнен (%d строк)", self.name, rows_done)
+            return rows_done
+
+        started = time.monotonic()
+        while True:
+            with engine.begin() as conn:
+                upper_key = self._next_upper_key(conn, after_key)
+                if upper_key is None:
+                    conn.execute(
+                        backfill_checkpoints.update()
+                        .where(backfill_checkpoints.c.name == self.name)
+                        .values(finished=True, updated_at=func.now())
+                    )
+                    break
+                rows_done += process_batch(conn, after_key, upper_key) or 0
+                conn.execute(
+                    backfill_checkpoints.update()
+                    .where(backfill_checkpoints.c.name == self.name)
+                    .values(last_key=upper_key, rows_done=rows_done, updated_at=func.now())
+                )
+            after_key = upper_key
+            logger.info(
+                "%s: %s <= %d, обработано %d строк за %.1f с",
+                self.name, self.key_column, after_key, rows_done, time.monotonic() - started,
+            )
+            if self.pause:
+                time.sleep(self.pause)
+
+        logger.info("%s: завершён, %d строк", self.name, rows_done)
+        return rows_done
+
+
+def create_index_concurrently(index_name: str, table_name: str, columns: list, **kw) -> None:
+    '''
+    Создаёт индекс без блокировки записи в таблицу.
+
+    На Postgres — CREATE INDEX CONCURRENTLY вне транзакции миграции;
+    невалидный индекс, оставшийся от прерванной попытки, сначала удаляется.
+    На остальных СУБД — обычный CREATE INDEX IF NOT EXISTS.
+    '''
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        op.create_index(index_name, table_name, columns, if_not_exists=True, **kw)
+        return
+
+    with op.get_context().autocommit_block():
+        invalid = bind.execute(
+            text(
+                "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE c.relname = :name AND NOT i.indisvalid"
+            ),
+            {"name": index_name},
+        ).first()
+        if invalid:
+            op.drop_index(index_name, table_name=table_name, postgresql_concurrently=True)
+        op.create_index(
+            index_name, table_name, columns,
+            postgresql_concurrently=True, if_not_exists=True, **kw,
+        )
+
+
+def drop_index_concurrently(index_name: str, table_name: str) -> None:
+    '''Удаляет индекс без блокировки записи (DROP INDEX CONCURRENTLY на Postgres).'''
+    if op.get_bind().dialect.name != "postgresql":
+        op.drop_index(index_name, table_name=table_name, if_exists=True)
+        return
+    with op.get_context().autocommit_block():
+        op.drop_index(index_name, table_name=table_name, postgresql_concurrently=True, if_exists=True)
@@ -11,6 +11,8 @@ from sqlalchemy.ext.asyncio import async_engine_from_config
 sys.path.insert(0, dirname(dirname(abspath(__file__))))
 
 from app.dao.base import Base
+from app.dao.idempotency import IdempotencyKey
+from app.dao.sharding import directory_metadata
 from app.database import DATABASE_URL
 from app.users.models import User
 from app.salary.models import Salary
@@ -19,7 +21,8 @@ from app.salary.models import Salary
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
-config.set_main_option("sqlalchemy.url", DATABASE_URL)
+# alembic -x db_url=<url> upgrade head — миграция другой БД (шарда, см. app/dao/sharding.py)
+config.set_main_option("sqlalchemy.url", context.get_x_argument(as_dictionary=True).get("db_url", DATABASE_URL))
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
 if config.config_file_name is not None:
@@ -29,7 +32,7 @@ if config.config_file_name is not None:
 # for 'autogenerate' support
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
-target_metadata = Base.metadata
+target_metadata = [Base.metadata, directory_metadata]
 
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
@@ -62,7 +65,13 @@ def run_migrations_offline() -> None:
 
 
 def do_run_migrations(connection: Connection) -> None:
-    context.configure(connection=connection, target_metadata=target_metadata)
+    # отдельная транзакция на ревизию: переносы данных (app/migration/backfill.py)
+    # коммитят её раньше времени через autocommit_block
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        transaction_per_migration=True,
+    )
 
     with context.begin_transaction():
         context.run_migrations()
@@ -0,0 +1,37 @@
+"""users soft delete
+
+Revision ID: 01456c22244d
+Revises: bb6a89e2d747
+Create Date: 2026-10-19 11:05:48.203117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.migration.backfill import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision: str = '01456c22244d'
+down_revision: Union[str, Sequence[str], None] = 'bb6a89e2d747'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # nullable-колонка без значения по умолчанию добавляется без перезаписи таблицы
+    op.add_column('users', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    create_index_concurrently(
+        'ix_users_deleted_at', 'users', ['deleted_at'],
+        postgresql_where=sa.text('deleted_at IS NOT NULL'),
+        sqlite_where=sa.text('deleted_at IS NOT NULL'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    drop_index_concurrently('ix_users_deleted_at', 'users')
+    op.drop_column('users', 'deleted_at')
@@ -0,0 +1,59 @@
+"""backfill salary
+
+Revision ID: bb6a89e2d747
+Revises: 7670a8126a29
+Create Date: 2026-10-19 10:12:31.418207
+
+"""
+from datetime import date, timedelta
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.migration.backfill import Backfill, create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'bb6a89e2d747'
+down_revision: Union[str, Sequence[str], None] = '7670a8126a29'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+users = sa.table("users", sa.column("id", sa.Integer))
+salary = sa.table(
+    "salary",
+    sa.column("user_id", sa.Integer),
+    sa.column("amount", sa.Integer),
+    sa.column("next_raise_date", sa.Date),
+)
+
+
+def create_missing_salaries(conn, after_key: int, last_key: int) -> int:
+    '''
+    Ревизия 5ccdea9d79cf удалила users.amount без переноса данных:
+    пользователям без строки в salary создаётся зарплата по умолчанию.
+    '''
+    missing = (
+        sa.select(users.c.id, sa.literal(80000), sa.literal(date.today() + timedelta(days=180)))
+        .where(users.c.id > after_key, users.c.id <= last_key)
+        .where(~sa.exists().where(salary.c.user_id == users.c.id))
+    )
+    result = conn.execute(
+        sa.insert(salary).from_select(["user_id", "amount", "next_raise_date"], missing)
+    )
+    return result.rowcount
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # индекс нужен до переноса: по нему проверяется NOT EXISTS в каждой пачке
+    create_index_concurrently(op.f('ix_salary_user_id'), 'salary', ['user_id'], unique=False)
+    Backfill("salary_for_existing_users", "users", batch_size=5000).run(create_missing_salaries)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # созданные строки salary не удаляем: их невозможно отличить от настоящих
+    drop_index_concurrently(op.f('ix_salary_user_id'), 'salary')
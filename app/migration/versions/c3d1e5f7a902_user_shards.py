@@ -0,0 +1,50 @@
+"""user shards directory
+
+Revision ID: c3d1e5f7a902
+Revises: 4afd3a8e381f
+Create Date: 2026-10-19 14:05:41.218306
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3d1e5f7a902'
+down_revision: Union[str, Sequence[str], None] = '4afd3a8e381f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('user_shards',
+    sa.Column('user_id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('email', sa.String(), nullable=False),
+    sa.Column('shard', sa.String(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('user_id'),
+    sa.UniqueConstraint('email')
+    )
+    # Существующие пользователи попадают в каталог на шард "default":
+    # при включении шардирования текущая БД указывается в SHARD_URLS
+    # под этим именем. Без шардирования каталог не ведётся, поэтому
+    # при включении он дополняется (python -m app.dao.sharding sync,
+    # выполняется и в начале rebalance)
+    op.execute(
+        "INSERT INTO user_shards (user_id, email, shard) "
+        "SELECT id, email, 'default' FROM users"
+    )
+    if op.get_bind().dialect.name == "postgresql":
+        # новые id выдаются после уже существующих
+        op.execute(
+            "SELECT setval(pg_get_serial_sequence('user_shards', 'user_id'), "
+            "COALESCE(MAX(user_id), 0) + 1, false) FROM user_shards"
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('user_shards')
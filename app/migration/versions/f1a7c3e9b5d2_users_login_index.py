@@ -0,0 +1,92 @@
+"""users lowercase email and login index
+
+Revision ID: f1a7c3e9b5d2
+Revises: e8b4f2a61c37
+Create Date: 2026-10-19 16:40:55.731902
+
+"""
+import logging
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.migration.backfill import Backfill, create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1a7c3e9b5d2'
+down_revision: Union[str, Sequence[str], None] = 'e8b4f2a61c37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+logger = logging.getLogger("alembic.backfill")
+
+users = sa.table("users", sa.column("id", sa.Integer), sa.column("email", sa.String))
+user_shards = sa.table("user_shards", sa.column("user_id", sa.Integer), sa.column("email", sa.String))
+
+
+def _ambiguous_emails(conn, table) -> set[str]:
+    '''Адреса (в нижнем регистре), которые встречаются в таблице в нескольких вариантах регистра.'''
+    lowered = sa.func.lower(table.c.email)
+    return set(conn.scalars(
+        sa.select(lowered).group_by(lowered).having(sa.func.count() > 1)
+    ))
+
+
+def lower_emails(conn, table, key):
+    '''
+    Функция пачки для Backfill: приводит email таблицы к нижнему регистру.
+
+    Адреса, совпадающие без учёта регистра с другими строками (в том числе
+    друг с другом в пределах одной пачки, например A@x.com и a@X.com),
+    остаются как есть и требуют ручного разбора: войти по ним нельзя.
+    Такие группы ищутся один раз до переноса; адрес, который во время
+    переноса занял новый пользователь (регистрация пишет его уже в нижнем
+    регистре), отсекает проверка по уникальному индексу email.
+    '''
+    ambiguous = _ambiguous_emails(conn, table)
+    other = table.alias("other")
+
+    def process_batch(conn, after_key: int, last_key: int) -> int:
+        in_batch = sa.and_(key > after_key, key <= last_key, table.c.email != sa.func.lower(table.c.email))
+        taken = sa.or_(
+            sa.exists().where(other.c.email == sa.func.lower(table.c.email)),
+            sa.func.lower(table.c.email).in_(ambiguous),
+        )
+        conflicts = conn.scalar(sa.select(sa.func.count()).select_from(table).where(in_batch, taken))
+        if conflicts:
+            logger.warning(
+                "%s: %d адресов отличаются от существующих только регистром, оставлены без изменений",
+                table.name, conflicts,
+            )
+        result = conn.execute(
+            sa.update(table).where(in_batch, ~taken).values(email=sa.func.lower(table.c.email))
+        )
+        return result.rowcount
+
+    return process_batch
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    create_index_concurrently(
+        'ix_users_login', 'users', ['email'], unique=False,
+        postgresql_include=['id', 'password'],
+        postgresql_where=sa.text('deleted_at IS NULL'),
+        sqlite_where=sa.text('deleted_at IS NULL'),
+    )
+    bind = op.get_bind()
+    Backfill("users_lower_email", "users", batch_size=5000).run(lower_emails(bind, users, users.c.id))
+    # каталог обходится по своим ключам: на основной БД при шардировании users пуст,
+    # а вход ищет шард по email в нижнем регистре
+    Backfill("user_shards_lower_email", "user_shards", key_column="user_id", batch_size=5000).run(
+        lower_emails(bind, user_shards, user_shards.c.user_id)
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # приведённые к нижнему регистру адреса не восстанавливаются
+    drop_index_concurrently('ix_users_login', 'users')
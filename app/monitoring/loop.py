@@ -0,0 +1,145 @@
+'''
+Монитор задержки event loop и блокирующих вызовов.
+
+Синхронная работа в async-обработчике (bcrypt вне пула потоков, блокирующий
+ввод-вывод, тяжёлый цикл) останавливает loop для всех запросов воркера.
+Монитор состоит из двух частей:
+- пульс — задача в loop, которая раз в LOOP_MONITOR_INTERVAL_MS засыпает
+  и измеряет, насколько позже срока проснулась; задержка пишется
+  в гистограмму event_loop_lag_seconds;
+- сторож — поток, который замечает, что пульс не бился дольше
+  LOOP_MONITOR_BLOCK_MS, и снимает стек потока loop прямо во время
+  зависания: в стеке видна корутина или callback, который держит loop.
+  Стек пишется в лог не чаще раза в LOOP_MONITOR_LOG_INTERVAL секунд,
+  каждое зависание учитывается в event_loop_blocks_total.
+
+Для тестов detect_blocking включает отладочный режим asyncio и собирает
+шаги корутин и callbacks дольше заданного порога (см. фикстуру
+assert_no_loop_blocks и опцию pytest --loop-block-ms).
+'''
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from contextlib import asynccontextmanager
+
+from app.config import settings
+from app.monitoring.metrics import registry
+
+
+logger = logging.getLogger("app.loop")
+
+LOOP_LAG = registry.histogram(
+    "event_loop_lag_seconds",
+    "Задержка пробуждения пульса event loop относительно срока",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+LOOP_BLOCKS = registry.counter(
+    "event_loop_blocks", "Зависания event loop дольше LOOP_MONITOR_BLOCK_MS",
+)
+
+
+class LoopMonitor:
+    '''
+    Пульс в event loop и поток-сторож. start() вызывается из работающего
+    loop и возвращает задачу пульса; её отмена останавливает и сторожа.
+    '''
+
+    def __init__(self):
+        self.suppressed = 0
+        self._last_beat = 0.0
+        self._last_capture: float | None = None
+        self._thread_id: int | None = None
+        self._stop = threading.Event()
+
+    def start(self) -> asyncio.Task:
+        self._thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop = threading.Event()
+        watchdog = threading.Thread(target=self._watch, args=(self._stop,), name="loop-watchdog", daemon=True)
+        watchdog.start()
+        return asyncio.create_task(self._heartbeat())
+
+    async def _heartbeat(self) -> None:
+        interval = settings.LOOP_MONITOR_INTERVAL_MS / 1000
+        try:
+            while True:
+                expected = time.monotonic() + interval
+                await asyncio.sleep(interval)
+                now = time.monotonic()
+                self._last_beat = now
+                LOOP_LAG.observe(max(0.0, now - expected))
+        finally:
+            self._stop.set()
+
+    def _watch(self, stop: threading.Event) -> None:
+        interval = settings.LOOP_MONITOR_INTERVAL_MS / 1000
+        threshold = settings.LOOP_MONITOR_BLOCK_MS / 1000
+        reported_beat = None
+        # опрос чаще порога, чтобы стек снимался во время зависания, а не после
+        while not stop.wait(min(interval, threshold) / 2):
+            beat = self._last_beat
+            stalled = time.monotonic() - beat - interval
+            if stalled < threshold or beat == reported_beat:
+                continue
+            reported_beat = beat
+            LOOP_BLOCKS.inc()
+            self._capture(stalled)
+
+    def _capture(self, stalled: float) -> None:
+        now = time.monotonic()
+        if self._last_capture is not None and now - self._last_capture < settings.LOOP_MONITOR_LOG_INTERVAL:
+            self.suppressed += 1
+            return
+        self._last_capture = now
+        frame = sys._current_frames().get(self._thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else "(стек недоступен)\n"
+        logger.warning(
+            "Event loop заблокирован уже %.0f мс (пропущено стеков: %d), стек потока loop:\n%s",
+            stalled * 1000, self.suppressed, stack.rstrip(),
+        )
+        self.suppressed = 0
+
+
+loop_monitor = LoopMonitor()
+
+
+class _SlowCallbackHandler(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.messages: list[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # base_events: "Executing <Task ... coro=<handler() running at file:line>> took 0.250 seconds"
+        if isinstance(record.msg, str) and record.msg.startswith("Executing "):
+            self.messages.append(record.getMessage())
+
+
+@asynccontextmanager
+async def detect_blocking(threshold_ms: float):
+    '''
+    Включает отладочный режим asyncio в текущем loop и собирает шаги
+    корутин и callbacks, выполнявшиеся дольше threshold_ms. Отладочный
+    режим заметно замедляет loop, поэтому он только для тестов.
+
+        async with detect_blocking(50) as blocks:
+            await client.post("/auth/login/", ...)
+        assert not blocks
+    '''
+    loop = asyncio.get_running_loop()
+    asyncio_logger = logging.getLogger("asyncio")
+    handler = _SlowCallbackHandler()
+    debug, slow_duration = loop.get_debug(), loop.slow_callback_duration
+    loop.set_debug(True)
+    loop.slow_callback_duration = threshold_ms / 1000
+    asyncio_logger.addHandler(handler)
+    try:
+        yield handler.messages
+        # шаг, внутри которого закрывается блок, замеряется только после переключения
+        await asyncio.sleep(0)
+    finally:
+        asyncio_logger.removeHandler(handler)
+        loop.slow_callback_duration = slow_duration
+        loop.set_debug(debug)
@@ -0,0 +1,384 @@
+import asyncio
+import bisect
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from fastapi import APIRouter, Response
+
+from app.config import settings
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Суммы счётчиков и гистограмм завершённых воркеров, чей pid достался новому
+ARCHIVE_FILE = "archive.json"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, object] = {}
+
+    @property
+    def family(self) -> str:
+        '''Имя семейства метрик в строках HELP/TYPE.'''
+        return self.name
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> list[tuple[str, dict, float]]:
+        '''Возвращает список (имя сэмпла, метки, значение).'''
+        raise NotImplementedError
+
+    def dump(self) -> dict:
+        '''Состояние метрики для записи в файл мультипроцессного хранилища.'''
+        return {"type": self.type, "help": self.documentation, "samples": self.samples()}
+
+
+class Counter(_Metric):
+    '''Монотонно растущий счётчик.'''
+
+    type = "counter"
+
+    @property
+    def family(self) -> str:
+        return f"{self.name}_total"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        return [
+            (f"{self.name}_total", dict(zip(self.labelnames, key)), value)
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(_Metric):
+    '''
+    Мгновенное значение. Если задан callback, значение вычисляется
+    при каждом сборе метрик (например, состояние пула соединений).
+    '''
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.callback is not None:
+            value = self.callback()
+            return [] if value is None else [(self.name, {}, value)]
+        return [
+            (self.name, dict(zip(self.labelnames, key)), value)
+            for key, value in self._values.items()
+        ]
+
+
+class Histogram(_Metric):
+    '''Гистограмма с фиксированными границами корзин.'''
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # счётчики по корзинам (не накопительные), сумма наблюдений
+            state = self._values[key] = [[0] * len(self.buckets), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def samples(self):
+        result = []
+        for key, (counts, total) in self._values.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                result.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            result.append((f"{self.name}_sum", labels, total))
+            result.append((f"{self.name}_count", labels, cumulative))
+        return result
+
+
+class Registry:
+    '''
+    Реестр метрик процесса.
+
+    При заданном METRICS_MULTIPROC_DIR каждый воркер периодически пишет
+    свой снимок в файл <pid>.json, а /metrics суммирует снимки всех
+    воркеров: счётчики и гистограммы — по всем файлам (включая завершённые
+    воркеры, чтобы значения не убывали), gauge — только по живым процессам.
+    Если pid завершённого воркера достался новому, первая запись нового
+    переносит счётчики и гистограммы старого файла в ARCHIVE_FILE, а не
+    затирает их. Запись и чтение каталога сериализуются flock.
+    '''
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        # (pid, случайный id): отличает этот процесс от прежнего владельца pid
+        # и от мастера, создавшего реестр до fork
+        self._instance: tuple[int, str] | None = None
+        # write_snapshot вызывается из потоков (сбор и фоновая запись)
+        self._write_lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def dump(self) -> dict:
+        return {metric.family: metric.dump() for metric in self._metrics.values()}
+
+    def write_snapshot(self, directory: str, metrics: dict | None = None) -> None:
+        '''
+        Атомарно записывает снимок метрик процесса (metrics — готовый dump())
+        в мультипроцессное хранилище.
+        '''
+        pid = os.getpid()
+        path = os.path.join(directory, f"{pid}.json")
+        snapshot = {"pid": pid, "time": time.time(), "metrics": self.dump() if metrics is None else metrics}
+        with self._write_lock, _directory_lock(directory, fcntl.LOCK_EX):
+            if self._instance is None or self._instance[0] != pid:
+                self._instance = (pid, os.urandom(8).hex())
+                _archive_previous_owner(directory, path, self._instance[1])
+            snapshot["instance"] = self._instance[1]
+            _write_json(path, snapshot)
+
+    def collect(self, metrics: dict | None = None) -> dict:
+        '''
+        Собирает метрики процесса либо всех воркеров, если задан каталог
+        хранилища. Чтение файлов блокирующее: из event loop вызывайте
+        в потоке, передав metrics = dump(), снятый в потоке loop.
+        '''
+        if metrics is None:
+            metrics = self.dump()
+        directory = settings.METRICS_MULTIPROC_DIR
+        if not directory:
+            return metrics
+
+        self.write_snapshot(directory, metrics)
+        snapshots = []
+        with _directory_lock(directory, fcntl.LOCK_SH):
+            for path in glob.glob(os.path.join(directory, "*.json")):
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue  # файл повреждён — пропускаем
+        return merge_snapshots(snapshots)
+
+    def render(self, metrics: dict | None = None) -> str:
+        '''Формирует текстовое представление в формате Prometheus 0.0.4.'''
+        lines = []
+        for name, metric in sorted(self.collect(metrics).items()):
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for sample_name, labels, value in metric["samples"]:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def _directory_lock(directory: str, operation: int):
+    with open(os.path.join(directory, ".lock"), "a") as lock:
+        fcntl.flock(lock, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _write_json(path: str, data: dict) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _archive_previous_owner(directory: str, path: str, instance: str) -> None:
+    '''
+    Переносит счётчики и гистограммы из файла прежнего владельца pid
+    в ARCHIVE_FILE (gauge завершённого процесса не нужны). Вызывается
+    под эксклюзивной блокировкой каталога.
+    '''
+    try:
+        with open(path) as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        return
+    if previous.get("instance") == instance:
+        return
+    archive_path = os.path.join(directory, ARCHIVE_FILE)
+    snapshots = [{"metrics": {
+        name: metric for name, metric in previous["metrics"].items() if metric["type"] != "gauge"
+    }}]
+    try:
+        with open(archive_path) as f:
+            snapshots.append(json.load(f))
+    except (OSError, ValueError):
+        pass
+    _write_json(archive_path, {"time": time.time(), "metrics": merge_snapshots(snapshots)})
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def merge_snapshots(snapshots: list[dict]) -> dict:
+    '''Агрегирует снимки метрик нескольких процессов в один.'''
+    merged: dict[str, dict] = {}
+    for snapshot in snapshots:
+        # у архива нет pid: в нём только счётчики и гистограммы
+        alive = snapshot.get("pid") is not None and _pid_alive(snapshot["pid"])
+        for name, metric in snapshot["metrics"].items():
+            if metric["type"] == "gauge" and not alive:
+                continue
+            target = merged.setdefault(name, {"type": metric["type"], "help": metric["help"], "samples": {}})
+            for sample_name, labels, value in metric["samples"]:
+                key = (sample_name, tuple(sorted(labels.items())))
+                target["samples"][key] = target["samples"].get(key, 0) + value
+    for metric in merged.values():
+        metric["samples"] = [
+            (sample_name, dict(labels), value)
+            for (sample_name, labels), value in metric["samples"].items()
+        ]
+    return merged
+
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.counter(
+    "http_requests", "Число HTTP-запросов", ("method", "route", "status"),
+)
+HTTP_LATENCY = registry.histogram(
+    "http_request_duration_seconds", "Длительность обработки HTTP-запроса", ("method", "route"),
+)
+HTTP_IN_PROGRESS = registry.gauge(
+    "http_requests_in_progress", "Число запросов в обработке",
+)
+
+
+def _pool_stat(attribute: str):
+    def callback():
+        from app import database  # движок может быть подменён (например, в тестах)
+        stat = getattr(database.engine.pool, attribute, None)
+        return stat() if callable(stat) else None
+    return callback
+
+
+registry.gauge("db_pool_size", "Размер пула соединений с БД", callback=_pool_stat("size"))
+registry.gauge("db_pool_checked_out", "Соединения, выданные из пула", callback=_pool_stat("checkedout"))
+registry.gauge("db_pool_checked_in", "Свободные соединения в пуле", callback=_pool_stat("checkedin"))
+registry.gauge("db_pool_overflow", "Соединения сверх размера пула", callback=_pool_stat("overflow"))
+
+
+class MetricsMiddleware:
+    '''ASGI middleware, собирающее латентность, статусы и число запросов в обработке.'''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_PROGRESS.dec()
+            route = scope.get("route")
+            # шаблон маршрута, а не фактический путь — иначе кардинальность не ограничена
+            route_path = getattr(route, "path", "unmatched")
+            HTTP_LATENCY.observe(time.perf_counter() - start, method=scope["method"], route=route_path)
+            HTTP_REQUESTS.inc(method=scope["method"], route=route_path, status=status_code)
+
+
+async def flush_metrics_periodically() -> None:
+    '''Фоновая задача: периодически пишет снимок метрик воркера в хранилище.'''
+    while True:
+        await asyncio.sleep(settings.METRICS_FLUSH_INTERVAL)
+        # dump() — в потоке loop (метрики меняются только в нём), запись файла — в потоке
+        await asyncio.to_thread(registry.write_snapshot, settings.METRICS_MULTIPROC_DIR, registry.dump())
+
+
+router = APIRouter(tags=["Мониторинг"])
+
+
+@router.get("/metrics", summary="Метрики в формате Prometheus", include_in_schema=False)
+async def metrics() -> Response:
+    # чтение файлов воркеров блокирующее — в потоке, чтобы не держать event loop
+    content = await asyncio.to_thread(registry.render, registry.dump())
+    return Response(
+        content=content,
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
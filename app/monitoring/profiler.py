@@ -0,0 +1,211 @@
+import hashlib
+import hmac
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from urllib.parse import unquote
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+
+from app.config import settings
+from app.users.dependencies import is_admin_token, require_admin
+
+
+PROFILE_HEADER = "x-debug-profile"
+PROFILE_QUERY_FLAG = "__profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+# Последние профили воркера: id -> collapsed stacks
+_profiles: OrderedDict[str, str] = OrderedDict()
+_armed_requests = 0
+
+
+def _profile_signature(path: str, expires: int) -> str:
+    message = f"profile:{path}:{expires}".encode()
+    return hmac.new(settings.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()[:32]
+
+
+def sign_profile_request(path: str, ttl: float | None = None) -> str:
+    '''
+    Значение флага ?__profile=<срок>.<подпись>: подпись привязана к пути
+    запроса и сроку действия (по умолчанию PROFILER_SIGNATURE_TTL секунд).
+    '''
+    if ttl is None:
+        ttl = settings.PROFILER_SIGNATURE_TTL
+    expires = int(time.time() + ttl)
+    return f"{expires}.{_profile_signature(path, expires)}"
+
+
+def verify_profile_flag(path: str, value: str) -> bool:
+    '''Проверяет подпись флага ?__profile= и что его срок не истёк.'''
+    expires, _, signature = value.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature.encode(), _profile_signature(path, int(expires)).encode())
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class SamplingProfiler:
+    '''
+    Семплирующий профайлер: отдельный поток раз в interval секунд снимает
+    стек потока event loop через sys._current_frames() и считает
+    одинаковые стеки. Результат — collapsed stacks (формат flamegraph.pl
+    и speedscope): "корень;...;лист количество".
+
+    Так как все корутины воркера выполняются в одном потоке, в профиль
+    попадают и параллельные запросы, и ожидание в селекторе event loop.
+    '''
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self) -> "SamplingProfiler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> str:
+        self._stop.set()
+        self._thread.join()
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+_profiler_lock = threading.Lock()
+
+
+def _store_profile(profile_id: str, method: str, path: str, collapsed: str) -> None:
+    _profiles[profile_id] = collapsed
+    while len(_profiles) > settings.PROFILER_KEEP_LAST:
+        _profiles.popitem(last=False)
+    if settings.PROFILER_OUTPUT_DIR:
+        name = f"{profile_id}-{method}{path.replace('/', '_')}.collapsed"
+        with open(os.path.join(settings.PROFILER_OUTPUT_DIR, name), "w") as f:
+            f.write(collapsed)
+
+
+def _profile_requested(scope) -> str | None:
+    '''
+    Причина профилировать запрос: "header", "flag", "armed" или None.
+    Счётчик взведённых запросов здесь не уменьшается — только когда профиль
+    действительно начат.
+    '''
+    headers = dict(scope["headers"])
+    if headers.get(PROFILE_HEADER.encode()) and is_admin_token(
+        headers.get(b"x-admin-token", b"").decode("latin-1")
+    ):
+        return "header"
+
+    query = scope.get("query_string", b"").decode("latin-1")
+    if f"{PROFILE_QUERY_FLAG}=" in query:
+        for part in query.split("&"):
+            name, _, value = part.partition("=")
+            if name == PROFILE_QUERY_FLAG and verify_profile_flag(scope["path"], unquote(value)):
+                return "flag"
+
+    if _armed_requests > 0:
+        return "armed"
+    return None
+
+
+class ProfilerMiddleware:
+    '''
+    ASGI middleware, запускающее семплирующий профайлер для одного запроса.
+
+    Запрос профилируется, если передан заголовок X-Debug-Profile вместе
+    с X-Admin-Token, подписанный флаг ?__profile=<срок>.<подпись> или воркер
+    «взведён» на N следующих запросов через POST /debug/profile/arm.
+    Идентификатор профиля возвращается в заголовке X-Profile-Id.
+    При PROFILER_ENABLED=false middleware ничего не делает.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _armed_requests
+        reason = None
+        if scope["type"] == "http" and settings.PROFILER_ENABLED:
+            reason = _profile_requested(scope)
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+
+        # одновременно профилируется только один запрос на воркер
+        if not _profiler_lock.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+        if reason == "armed":
+            _armed_requests -= 1
+
+        profile_id = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+        profiler = SamplingProfiler(
+            threading.get_ident(), settings.PROFILER_INTERVAL_MS / 1000,
+        ).start()
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (PROFILE_ID_HEADER.lower().encode(), profile_id.encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            collapsed = profiler.stop()
+            _profiler_lock.release()
+            _store_profile(profile_id, scope["method"], scope["path"], collapsed)
+
+
+def _ensure_enabled():
+    if not settings.PROFILER_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+
+
+router = APIRouter(
+    prefix="/debug",
+    tags=["Мониторинг"],
+    dependencies=[Depends(_ensure_enabled), Depends(require_admin)],
+    include_in_schema=False,
+)
+
+
+@router.post("/profile/arm", summary="Профилировать N следующих запросов воркера")
+async def arm_profiler(count: int = Query(1, ge=1, le=100)):
+    global _armed_requests
+    _armed_requests = count
+    return {"armed": count, "pid": os.getpid()}
+
+
+@router.get("/profiles", summary="Список сохранённых профилей воркера")
+async def list_profiles():
+    return {"pid": os.getpid(), "profiles": list(_profiles)}
+
+
+@router.get("/profiles/{profile_id}", summary="Профиль в формате collapsed stacks")
+async def get_profile(profile_id: str) -> Response:
+    collapsed = _profiles.get(profile_id)
+    if collapsed is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Профиль не найден")
+    return Response(content=collapsed, media_type="text/plain; charset=utf-8")
@@ -0,0 +1,163 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from app.config import settings
+
+
+logger = logging.getLogger("app.sql")
+
+_WHITESPACE = re.compile(r"\s+")
+# Раскрытые списки IN (?, ?, ?) / ($1, $2) сводим к одной форме
+_IN_LIST = re.compile(r"IN \((?:[^()]*?(?:\?|%s|\$\d+|:\w+)[^()]*?)\)", re.IGNORECASE)
+_NUMBER = re.compile(r"\b\d+\b")
+
+
+def statement_shape(statement: str) -> str:
+    '''
+    Нормализует SQL-выражение до "формы": схлопывает пробелы,
+    списки IN и числовые литералы, чтобы одинаковые по структуре
+    запросы с разными параметрами совпадали.
+    '''
+    shape = _WHITESPACE.sub(" ", statement).strip()
+    shape = _IN_LIST.sub("IN (?)", shape)
+    return _NUMBER.sub("N", shape)
+
+
+def redact_parameters(parameters) -> str:
+    '''Заменяет значения параметров их типами, чтобы не писать данные в лог.'''
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{k}: <{type(v).__name__}>" for k, v in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (list, tuple, dict)):
+            return f"<{len(parameters)} parameter sets>"
+        return "(" + ", ".join(f"<{type(v).__name__}>" for v in parameters) + ")"
+    return "<redacted>"
+
+
+class QueryStats:
+    '''Счётчики SQL-выражений в рамках одного запроса или блока кода.'''
+
+    __slots__ = ("count", "total_time", "shapes")
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.shapes: Counter[str] = Counter()
+
+    def record(self, shape: str, elapsed: float) -> None:
+        self.count += 1
+        self.total_time += elapsed
+        self.shapes[shape] += 1
+
+    def merge(self, other: "QueryStats") -> None:
+        self.count += other.count
+        self.total_time += other.total_time
+        self.shapes.update(other.shapes)
+
+    def repeated_shapes(self, threshold: int) -> list[tuple[str, int]]:
+        '''Формы запросов, выполненные не менее threshold раз — вероятный N+1.'''
+        return [(shape, n) for shape, n in self.shapes.most_common() if n >= threshold]
+
+
+# Активные сборщики статистики; запрос и тестовый хелпер могут быть вложены
+_collectors: ContextVar[tuple[QueryStats, ...]] = ContextVar("sql_query_collectors", default=())
+
+
+@contextmanager
+def collect_queries():
+    '''Считает все SQL-выражения, выполненные внутри блока.'''
+    stats = QueryStats()
+    token = _collectors.set((*_collectors.get(), stats))
+    try:
+        yield stats
+    finally:
+        _collectors.reset(token)
+
+
+def attribute_queries(stats: QueryStats) -> None:
+    '''
+    Добавляет выражения, выполненные вне контекста запроса (общая пачка
+    BatchLoader), к сборщикам текущего контекста.
+    '''
+    for collector in _collectors.get():
+        collector.merge(stats)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+
+    slow_ms = settings.SQL_SLOW_QUERY_MS
+    if slow_ms and elapsed * 1000 >= slow_ms:
+        logger.warning(
+            "Медленный запрос %.1f мс: %s; параметры: %s",
+            elapsed * 1000,
+            _WHITESPACE.sub(" ", statement).strip(),
+            redact_parameters(parameters),
+        )
+
+    collectors = _collectors.get()
+    if collectors:
+        shape = statement_shape(statement)
+        for stats in collectors:
+            stats.record(shape, elapsed)
+
+
+def _handle_error(exception_context):
+    # при ошибке выражения after_cursor_execute не вызывается: снимаем отметку
+    # времени, иначе она останется в info соединения, вернувшегося в пул
+    conn = exception_context.connection
+    if conn is not None and exception_context.execution_context is not None:
+        starts = conn.info.get("query_start_time")
+        if starts:
+            starts.pop()
+
+
+def install_query_instrumentation(engine) -> None:
+    '''
+    Подключает обработчики before/after_cursor_execute и handle_error к движку
+    (синхронному или асинхронному). Повторный вызов безопасен.
+    '''
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if not event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(sync_engine, "handle_error", _handle_error)
+
+
+class QueryStatsMiddleware:
+    '''
+    ASGI middleware, которое считает SQL-выражения и время в БД на запрос
+    и предупреждает о повторяющихся запросах одной формы (вероятный N+1).
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.SQL_STATS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        with collect_queries() as stats:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                for shape, n in stats.repeated_shapes(settings.SQL_N_PLUS_ONE_THRESHOLD):
+                    logger.warning(
+                        "Вероятный N+1 в %s %s: %d повторов запроса %s",
+                        scope["method"], scope["path"], n, shape,
+                    )
+                logger.debug(
+                    "%s %s: %d SQL-запросов, %.1f мс в БД",
+                    scope["method"], scope["path"], stats.count, stats.total_time * 1000,
+                )
@@ -0,0 +1,100 @@
+import json
+import logging
+import time
+from contextvars import ContextVar
+
+from app.config import settings
+
+
+access_logger = logging.getLogger("app.access")
+
+# Накопитель длительностей фаз текущего запроса; None — замер выключен
+_phases: ContextVar[dict[str, float] | None] = ContextVar("server_timing_phases", default=None)
+
+
+class timed_phase:
+    '''
+    Контекстный менеджер, добавляющий время выполнения блока к фазе запроса
+    (auth, db, hash, serialize и т.д.).
+
+    Если Server-Timing выключен, в контексте нет накопителя и замер
+    сводится к одному чтению ContextVar.
+    '''
+
+    __slots__ = ("name", "_acc", "_start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self._acc = _phases.get()
+        if self._acc is not None:
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        acc = self._acc
+        if acc is not None:
+            acc[self.name] = acc.get(self.name, 0.0) + (time.perf_counter() - self._start)
+        return False
+
+
+def current_phases() -> dict[str, float] | None:
+    '''Возвращает накопленные фазы текущего запроса (в секундах) или None.'''
+    return _phases.get()
+
+
+def format_server_timing(phases: dict[str, float], total: float) -> str:
+    '''Формирует значение заголовка Server-Timing, длительности в миллисекундах.'''
+    parts = [f"{name};dur={duration * 1000:.2f}" for name, duration in phases.items()]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+class ServerTimingMiddleware:
+    '''
+    ASGI middleware, которое собирает фазы запроса и отдаёт их
+    в заголовке Server-Timing, а при ACCESS_LOG_ENABLED пишет
+    структурированную строку access-лога.
+
+    Фазы, завершившиеся после отправки заголовков (например, отложенные
+    задачи), в заголовок не попадают, но учитываются в access-логе.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (settings.SERVER_TIMING_ENABLED or settings.ACCESS_LOG_ENABLED):
+            await self.app(scope, receive, send)
+            return
+
+        phases: dict[str, float] = {}
+        token = _phases.set(phases)
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if settings.SERVER_TIMING_ENABLED:
+                    header = format_server_timing(phases, time.perf_counter() - start)
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (b"server-timing", header.encode("latin-1")),
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _phases.reset(token)
+            if settings.ACCESS_LOG_ENABLED:
+                access_logger.info(json.dumps({
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status_code,
+                    "total_ms": round((time.perf_counter() - start) * 1000, 2),
+                    "phases_ms": {name: round(value * 1000, 2) for name, value in phases.items()},
+                }))
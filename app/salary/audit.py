@@ -0,0 +1,185 @@
+'''
+Аудит просмотров зарплаты с отложенной записью (write-behind).
+
+Эндпоинт только кладёт событие в очередь процесса; фоновая задача
+записывает накопленные события одной многострочной вставкой (на Postgres —
+COPY) раз в SALARY_AUDIT_FLUSH_INTERVAL_MS миллисекунд или как только
+набралось SALARY_AUDIT_BATCH_SIZE событий. Остаток очереди записывается
+при остановке приложения.
+'''
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone
+
+from sqlalchemy import insert
+
+from app.config import settings
+from app.database import async_session_maker
+from app.monitoring.metrics import registry
+from app.salary.models import SalaryView
+
+
+logger = logging.getLogger("app.salary.audit")
+
+AUDIT_QUEUE_DEPTH = registry.gauge(
+    "salary_audit_queue_depth", "События аудита, ожидающие записи в БД",
+)
+AUDIT_WRITTEN = registry.counter(
+    "salary_audit_written", "События аудита, записанные в БД",
+)
+AUDIT_DROPPED = registry.counter(
+    "salary_audit_dropped", "События аудита, отброшенные при переполнении очереди",
+)
+
+COLUMNS = ("viewer_id", "subject_id", "viewed_at")
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class AuditQueue:
+    '''
+    Ограниченная очередь событий аудита в памяти процесса.
+
+    При заполненной очереди (SALARY_AUDIT_QUEUE_SIZE событий) политика
+    SALARY_AUDIT_OVERFLOW решает, что делать с новым событием:
+    - "drop" — событие отбрасывается и учитывается в salary_audit_dropped_total,
+      запрос не замедляется;
+    - "block" — запрос ждёт, пока запись освободит место (обратное давление).
+
+    Если запись в БД не удалась, пачка возвращается в начало очереди
+    и повторяется на следующем тике; при переполнении отбрасываются
+    самые старые события.
+
+    Не привязана к event loop: futures ожидания создаются в loop вызывающего.
+    '''
+
+    def __init__(self):
+        self._events: deque[tuple[int, int, datetime]] = deque()
+        self._wakeup: asyncio.Future | None = None
+        self._space_waiters: deque[asyncio.Future] = deque()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def clear(self) -> None:
+        self._events.clear()
+        self._wake_writers()
+        AUDIT_QUEUE_DEPTH.set(0)
+
+    def _full(self) -> bool:
+        return len(self._events) >= settings.SALARY_AUDIT_QUEUE_SIZE
+
+    def _wake_flusher(self) -> None:
+        if self._wakeup is not None and not self._wakeup.done():
+            self._wakeup.set_result(None)
+
+    def _wake_writers(self) -> None:
+        while self._space_waiters and not self._full():
+            waiter = self._space_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _append(self, event: tuple[int, int, datetime]) -> None:
+        self._events.append(event)
+        AUDIT_QUEUE_DEPTH.set(len(self._events))
+        if len(self._events) >= settings.SALARY_AUDIT_BATCH_SIZE:
+            self._wake_flusher()
+
+    async def record(self, viewer_id: int, subject_id: int) -> None:
+        '''Ставит в очередь событие просмотра; в БД не обращается.'''
+        event = (viewer_id, subject_id, _utcnow())
+        if not self._full():
+            self._append(event)
+            return
+        if settings.SALARY_AUDIT_OVERFLOW == "drop":
+            AUDIT_DROPPED.inc()
+            return
+        while self._full():
+            waiter = asyncio.get_running_loop().create_future()
+            self._space_waiters.append(waiter)
+            self._wake_flusher()
+            try:
+                await waiter
+            finally:
+                if waiter in self._space_waiters:
+                    self._space_waiters.remove(waiter)
+        self._append(event)
+
+    async def flush(self) -> int:
+        '''Записывает в БД одну пачку событий; возвращает число записанных.'''
+        # пачка забирается до первого await: параллельные flush пишут разные события
+        batch = [self._events.popleft() for _ in range(min(len(self._events), settings.SALARY_AUDIT_BATCH_SIZE))]
+        if not batch:
+            return 0
+        try:
+            await self._write(batch)
+        except BaseException:
+            self._requeue(batch)
+            raise
+        finally:
+            AUDIT_QUEUE_DEPTH.set(len(self._events))
+            self._wake_writers()
+        AUDIT_WRITTEN.inc(len(batch))
+        return len(batch)
+
+    def _requeue(self, batch: list) -> None:
+        self._events.extendleft(reversed(batch))
+        overflow = len(self._events) - settings.SALARY_AUDIT_QUEUE_SIZE
+        if overflow > 0:
+            for _ in range(overflow):
+                self._events.popleft()
+            AUDIT_DROPPED.inc(overflow)
+
+    async def _write(self, batch: list) -> None:
+        async with async_session_maker() as session:
+            if session.get_bind().dialect.name == "postgresql":
+                connection = await session.connection()
+                raw = await connection.get_raw_connection()
+                await raw.driver_connection.copy_records_to_table(
+                    SalaryView.__tablename__, records=batch, columns=COLUMNS,
+                )
+            else:
+                # executemany ORM сворачивается в многострочный INSERT (insertmanyvalues)
+                await session.execute(insert(SalaryView), [dict(zip(COLUMNS, event)) for event in batch])
+            await session.commit()
+
+    async def drain(self) -> int:
+        '''Записывает всю очередь; вызывается при остановке приложения.'''
+        written = 0
+        while self._events:
+            written += await self.flush()
+        return written
+
+    async def run(self) -> None:
+        '''
+        Фоновая задача записи. При отмене (остановка приложения) дописывает
+        остаток очереди; ошибки БД не останавливают цикл.
+        '''
+        try:
+            while True:
+                if len(self._events) < settings.SALARY_AUDIT_BATCH_SIZE and not self._space_waiters:
+                    self._wakeup = asyncio.get_running_loop().create_future()
+                    try:
+                        await asyncio.wait_for(self._wakeup, settings.SALARY_AUDIT_FLUSH_INTERVAL_MS / 1000)
+                    except asyncio.TimeoutError:
+                        pass
+                    finally:
+                        self._wakeup = None
+                try:
+                    while await self.flush() >= settings.SALARY_AUDIT_BATCH_SIZE:
+                        pass
+                except Exception:
+                    logger.exception("Не удалось записать аудит просмотров зарплаты")
+                    await asyncio.sleep(settings.SALARY_AUDIT_FLUSH_INTERVAL_MS / 1000)
+        except asyncio.CancelledError:
+            try:
+                await self.drain()
+            except Exception:
+                logger.exception("Не удалось записать аудит при остановке, потеряно %d событий", len(self))
+            raise
+
+
+salary_audit = AuditQueue()
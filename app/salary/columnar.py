@@ -0,0 +1,352 @@
+'''
+Колоночные снимки ведомости для офлайн-аналитики.
+
+Команда записывает пользователей (кроме удалённых) с зарплатами в один
+файл, который читатель отображает в память (mmap) и отдаёт колонки как
+массивы NumPy без копирования: аналитика сканирует миллионы строк
+за миллисекунды и не нагружает рабочую БД.
+
+Формат файла (little-endian, секции выровнены по 64 байта):
+- заголовок HEADER: сигнатура, версия формата, число колонок, число строк,
+  версия данных (max(updated_at) таблиц users и salary, микросекунды
+  от эпохи) и размер словаря строк;
+- каталог колонок: по записи COLUMN_ENTRY (имя, dtype NumPy, смещение,
+  число элементов) на колонку;
+- колонки фиксированной ширины: user_id, salary_id, amount (int64),
+  next_raise_date (datetime64[D], NaT — нет даты);
+- строковые колонки email, first_name, last_name — коды int32 в общий
+  словарь (-1 — NULL); словарь отсортирован, хранится как смещения
+  __str_offsets (int64) и байты UTF-8 __str_data.
+
+Строки упорядочены по user_id. Файл называется по версии данных
+(DataVersion: max(updated_at) и отпечаток таблиц), поэтому неизменившиеся
+таблицы не перезаписываются:
+
+    python -m app.salary.columnar write [--dir snapshots]
+    python -m app.salary.columnar info snapshots/salary-20261019T120000000000-0123456789ab.col
+'''
+import argparse
+import asyncio
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+from array import array
+from contextlib import AsyncExitStack, asynccontextmanager
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.future import select
+
+from app.config import settings
+from app.dao.sharding import shard_router
+from app.database import engine
+from app.salary.models import Salary
+from app.users.models import User
+
+
+MAGIC = b"SALCOL\x00\x00"
+FORMAT_VERSION = 1
+ALIGN = 64
+HEADER = struct.Struct("<8sIIqqq")
+COLUMN_ENTRY = struct.Struct("<16s8sqq")
+
+EPOCH = datetime(1970, 1, 1)
+EPOCH_DAY = date(1970, 1, 1).toordinal()
+NAT = np.iinfo(np.int64).min
+
+FIXED_COLUMNS = {
+    "user_id": np.dtype("<i8"),
+    "salary_id": np.dtype("<i8"),
+    "amount": np.dtype("<i8"),
+    "next_raise_date": np.dtype("<M8[D]"),
+}
+STRING_COLUMNS = ("email", "first_name", "last_name")
+CODE_DTYPE = np.dtype("<i4")
+
+
+def _to_us(value: datetime | None) -> int:
+    return (value - EPOCH) // timedelta(microseconds=1) if value is not None else 0
+
+
+def _from_us(value: int) -> datetime:
+    return EPOCH + timedelta(microseconds=value)
+
+
+class DataVersion(NamedTuple):
+    '''
+    Версия данных снимка.
+
+    updated_at — max(updated_at) таблиц users и salary всех шардов (None —
+    таблицы пусты); по нему сортируются файлы и он пишется в заголовок.
+    Одного максимума мало: updated_at — время начала транзакции, и строка,
+    закоммиченная позже, может получить меньшее значение и не сдвинуть
+    максимум. Поэтому digest — отпечаток числа строк, сумм id и сумм
+    version (растёт при каждом обновлении, см. Versioned) по каждой
+    таблице каждого шарда: он меняется с каждым коммитом, затронувшим
+    ведомость.
+    '''
+
+    updated_at: datetime | None
+    digest: str
+
+
+def snapshot_path(directory: str | Path, version: DataVersion) -> Path:
+    return Path(directory) / f"salary-{_from_us(_to_us(version.updated_at)):%Y%m%dT%H%M%S%f}-{version.digest}.col"
+
+
+@asynccontextmanager
+async def _consistent_sessions():
+    '''
+    Сессии всех шардов, каждая в своей транзакции. На Postgres — REPEATABLE
+    READ: версия данных и строки ведомости читаются из одного снимка БД,
+    и коммиты между ними не попадают в файл с чужой версией.
+    '''
+    async with AsyncExitStack() as stack:
+        sessions = []
+        for maker in shard_router.all_makers():
+            session = await stack.enter_async_context(maker())
+            if session.get_bind().dialect.name == "postgresql":
+                await session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+            sessions.append(session)
+        yield sessions
+
+
+async def _data_version(sessions) -> DataVersion:
+    latest = None
+    parts = []
+    for session in sessions:
+        for model in (User, Salary):
+            count, id_sum, version_sum, value = (await session.execute(
+                select(func.count(), func.sum(model.id), func.sum(model.version), func.max(model.updated_at))
+            )).one()
+            parts.append((count, id_sum or 0, version_sum or 0))
+            if value is not None and (latest is None or value > latest):
+                latest = value
+    return DataVersion(latest, hashlib.sha256(repr(parts).encode()).hexdigest()[:12])
+
+
+async def data_version() -> DataVersion:
+    '''Текущая версия данных users и salary всех шардов.'''
+    async with _consistent_sessions() as sessions:
+        return await _data_version(sessions)
+
+
+async def _read_rows(sessions) -> tuple[dict, list[list]]:
+    '''Читает ведомость пачками в компактные массивы; строки — списками по колонкам.'''
+    fixed = {name: array("q") for name in FIXED_COLUMNS}
+    strings = [[] for _ in STRING_COLUMNS]
+    query = (
+        select(
+            User.id, Salary.id, Salary.amount, Salary.next_raise_date,
+            User.email, User.first_name, User.last_name,
+        )
+        .join(Salary, Salary.user_id == User.id)
+        .where(User.deleted_at.is_(None))
+    )
+    for session in sessions:
+        result = await session.stream(query.execution_options(yield_per=settings.EXPORT_BATCH_SIZE))
+        async for rows in result.partitions():
+            for user_id, salary_id, amount, next_raise_date, *names in rows:
+                fixed["user_id"].append(user_id)
+                fixed["salary_id"].append(salary_id)
+                fixed["amount"].append(amount)
+                fixed["next_raise_date"].append(
+                    next_raise_date.toordinal() - EPOCH_DAY if next_raise_date else NAT
+                )
+                for values, name in zip(strings, names):
+                    values.append(name)
+    return fixed, strings
+
+
+def _encode_strings(columns: list[list], order: np.ndarray) -> tuple[dict, np.ndarray, bytes]:
+    '''Общий отсортированный словарь строк и коды колонок в порядке order.'''
+    dictionary = sorted({value for values in columns for value in values if value is not None})
+    index = {value: code for code, value in enumerate(dictionary)}
+    codes = {}
+    for name, values in zip(STRING_COLUMNS, columns):
+        encoded = np.fromiter((index.get(value, -1) for value in values), dtype=CODE_DTYPE, count=len(values))
+        codes[name] = encoded[order]
+    encoded_values = [value.encode() for value in dictionary]
+    offsets = np.zeros(len(dictionary) + 1, dtype="<i8")
+    np.cumsum([len(value) for value in encoded_values], out=offsets[1:])
+    return codes, offsets, b"".join(encoded_values)
+
+
+def write_file(path: Path, version: datetime | None, fixed: dict, strings: list[list]) -> int:
+    '''
+    Записывает снимок в path через временный файл и os.replace, так что
+    читатели никогда не видят недописанный файл. Возвращает число строк.
+    '''
+    user_ids = np.frombuffer(fixed["user_id"], dtype="<i8")
+    order = np.argsort(user_ids, kind="stable")
+    columns = {
+        name: np.frombuffer(fixed[name], dtype="<i8")[order].view(dtype)
+        for name, dtype in FIXED_COLUMNS.items()
+    }
+    codes, offsets, data = _encode_strings(strings, order)
+    columns.update(codes)
+    columns["__str_offsets"] = offsets
+    columns["__str_data"] = np.frombuffer(data, dtype="u1")
+
+    position = HEADER.size + COLUMN_ENTRY.size * len(columns)
+    entries = []
+    for name, values in columns.items():
+        position = -(-position // ALIGN) * ALIGN
+        entries.append((name, values, position))
+        position += values.nbytes
+
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as out:
+        out.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(columns), len(user_ids), _to_us(version), len(offsets) - 1))
+        for name, values, offset in entries:
+            out.write(COLUMN_ENTRY.pack(name.encode(), values.dtype.str.encode(), offset, len(values)))
+        for name, values, offset in entries:
+            out.write(bytes(offset - out.tell()))
+            out.write(values.tobytes())
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp, path)
+    return len(user_ids)
+
+
+async def write_snapshot(directory: str | Path | None = None) -> tuple[Path, bool]:
+    '''
+    Записывает снимок текущей версии данных в directory (по умолчанию
+    SALARY_COLUMNAR_DIR). Если файл этой версии уже есть, БД не читается
+    и файл не перезаписывается. Возвращает (путь, был ли файл записан).
+    '''
+    directory = Path(directory or settings.SALARY_COLUMNAR_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    async with _consistent_sessions() as sessions:
+        version = await _data_version(sessions)
+        path = snapshot_path(directory, version)
+        if path.exists():
+            return path, False
+        fixed, strings = await _read_rows(sessions)
+    # запись в файл — синхронный CPU и диск, не держим ими event loop
+    await asyncio.to_thread(write_file, path, version.updated_at, fixed, strings)
+    return path, True
+
+
+def latest_snapshot(directory: str | Path | None = None) -> Path | None:
+    '''
+    Самый свежий снимок в каталоге: по max(updated_at) из имени, при равных
+    (коммит с более ранним updated_at) — по времени записи файла.
+    '''
+    paths = Path(directory or settings.SALARY_COLUMNAR_DIR).glob("salary-*.col")
+    return max(paths, key=lambda path: (path.name.split("-")[1], path.stat().st_mtime_ns), default=None)
+
+
+class ColumnarSnapshot:
+    '''
+    Снимок, отображённый в память. Колонки — массивы NumPy только для
+    чтения поверх mmap: открытие не читает данные, страницы подгружает ОС
+    по мере обращения.
+
+        with ColumnarSnapshot.open(latest_snapshot()) as snap:
+            snap["amount"][snap["first_name"] == snap.code("Иван")].sum()
+
+    Коды строк упорядочены так же, как сами строки (сравнение байтов UTF-8),
+    поэтому диапазоны кодов соответствуют диапазонам строк.
+    '''
+
+    def __init__(self, path: Path, file, buffer: mmap.mmap):
+        self.path = path
+        self._file = file
+        self._mmap = buffer
+        magic, fmt, column_count, self.rows, version, self.dictionary_size = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or fmt != FORMAT_VERSION:
+            raise ValueError(f"{path}: не колоночный снимок версии {FORMAT_VERSION}")
+        self.version = _from_us(version)
+        self.columns: dict[str, np.ndarray] = {}
+        for i in range(column_count):
+            name, dtype, offset, count = COLUMN_ENTRY.unpack_from(buffer, HEADER.size + i * COLUMN_ENTRY.size)
+            self.columns[name.rstrip(b"\x00").decode()] = np.frombuffer(
+                buffer, dtype=np.dtype(dtype.rstrip(b"\x00").decode()), count=count, offset=offset,
+            )
+        self._offsets = self.columns.pop("__str_offsets")
+        self._data = self.columns.pop("__str_data")
+
+    @classmethod
+    def open(cls, path: str | Path) -> "ColumnarSnapshot":
+        file = open(path, "rb")
+        try:
+            return cls(Path(path), file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+        except Exception:
+            file.close()
+            raise
+
+    def close(self) -> None:
+        # массивы-представления держат буфер: mmap закроется, когда их соберёт GC
+        self.columns.clear()
+        self._offsets = self._data = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+    def __enter__(self) -> "ColumnarSnapshot":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def string(self, code: int) -> str | None:
+        '''Строка словаря по коду; -1 — NULL.'''
+        if code < 0:
+            return None
+        return self._data[self._offsets[code]:self._offsets[code + 1]].tobytes().decode()
+
+    def code(self, value: str) -> int:
+        '''Код строки в словаре (бинарный поиск); -2, если такой строки нет.'''
+        target = value.encode()
+        key = lambda code: self._data[self._offsets[code]:self._offsets[code + 1]].tobytes()
+        code = bisect.bisect_left(range(self.dictionary_size), target, key=key)
+        return code if code < self.dictionary_size and key(code) == target else -2
+
+    def decode(self, name: str) -> list[str | None]:
+        '''Значения строковой колонки списком Python (копирует данные).'''
+        return [self.string(code) for code in self.columns[name].tolist()]
+
+
+async def _write_cli(directory: str | None) -> None:
+    try:
+        path, written = await write_snapshot(directory)
+        print(f"{path}: {'записан' if written else 'не изменился'}")
+    finally:
+        await shard_router.dispose()
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Колоночные снимки ведомости для аналитики")
+    commands = parser.add_subparsers(dest="command", required=True)
+    write_parser = commands.add_parser("write", help="записать снимок, если данные изменились")
+    write_parser.add_argument("--dir", help="каталог снимков (по умолчанию SALARY_COLUMNAR_DIR)")
+    info_parser = commands.add_parser("info", help="показать заголовок и колонки снимка")
+    info_parser.add_argument("path")
+    args = parser.parse_args()
+    if args.command == "write":
+        asyncio.run(_write_cli(args.dir))
+    elif args.command == "info":
+        with ColumnarSnapshot.open(args.path) as snap:
+            print(f"{snap.path}: {snap.rows} строк, версия данных {snap.version.isoformat()}, "
+                  f"словарь {snap.dictionary_size} строк")
+            for name, values in snap.columns.items():
+                print(f"  {name}: {values.dtype}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,19 @@
+from sqlalchemy.engine import Row
 from sqlalchemy.future import select
 
 from app.dao.base import BaseDAO
-from app.database import async_session_maker
+from app.dao.loader import BatchLoader
+from app.monitoring.timing import timed_phase
 from app.salary.models import Salary
 
 
 class SalaryDAO(BaseDAO):
     model = Salary
+    # кэши зарплат (снимок, загрузчики) индексируются по пользователю
+    invalidation_key = "user_id"
+    # зарплата лежит на шарде своего пользователя
+    shard_key = "user_id"
+    read_columns = ("id", "user_id", "amount", "next_raise_date", "version")
     
     @classmethod
     async def find_salary_by_user_id(cls, user_id: int):
@@ -16,8 +23,22 @@ class SalaryDAO(BaseDAO):
         Возвращает объект Salary или None, если запись не найдена.
         '''
         
-        async with async_session_maker() as session:
-            query = select(cls.model).filter_by(user_id=user_id)
-            result = await session.execute(query)
-            return result.scalar_one_or_none()
-        
\ No newline at end of file
+        for maker in await cls._session_makers({"user_id": user_id}):
+            async with maker() as session:
+                query = select(cls.model).filter_by(user_id=user_id)
+                with timed_phase("db"):
+                    result = await session.execute(query)
+                return result.scalar_one_or_none()
+        return None
+
+    @classmethod
+    async def load_by_user_id(cls, user_id: int) -> Row | None:
+        '''
+        Ищет зарплату по ID пользователя, склеивая параллельные вызовы
+        в один запрос WHERE user_id IN (...) (см. BatchLoader).
+        Возвращает строку с read_columns, без объекта ORM (см. read_one).
+        '''
+        return await _salaries_by_user_id.load(user_id)
+
+
+_salaries_by_user_id = BatchLoader(lambda user_ids: SalaryDAO.read_many_by("user_id", user_ids))
@@ -0,0 +1,147 @@
+'''
+Потоковая выгрузка ведомости (пользователи и зарплаты) в NDJSON или CSV.
+
+Строки читаются серверным курсором пачками по EXPORT_BATCH_SIZE и сразу
+кодируются, поэтому память не зависит от размера таблицы. Используется
+эндпоинтом GET /admin/export/payroll и из командной строки:
+
+    python -m app.salary.export --format csv --gzip -o payroll.csv.gz
+'''
+import argparse
+import asyncio
+import csv
+import io
+import json
+import sys
+import zlib
+from datetime import date
+from typing import AsyncIterator, Literal
+
+from sqlalchemy.future import select
+
+from app.config import settings
+from app.dao.sharding import shard_router
+from app.database import engine
+from app.salary.models import Salary
+from app.users.models import User
+
+
+ExportFormat = Literal["ndjson", "csv"]
+
+COLUMNS = (
+    User.id,
+    User.email,
+    User.first_name,
+    User.last_name,
+    User.phone_number,
+    Salary.amount,
+    Salary.next_raise_date,
+)
+FIELD_NAMES = ("user_id", "email", "first_name", "last_name", "phone_number", "amount", "next_raise_date")
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+def payroll_query():
+    '''Пользователи (кроме удалённых) с зарплатой по возрастанию id.'''
+    return (
+        select(*COLUMNS)
+        .join(Salary, Salary.user_id == User.id)
+        .where(User.deleted_at.is_(None))
+        .order_by(User.id)
+    )
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, date) else value
+
+
+def encode_ndjson(rows) -> bytes:
+    return "".join(
+        json.dumps(dict(zip(FIELD_NAMES, map(_plain, row))), ensure_ascii=False) + "\n"
+        for row in rows
+    ).encode()
+
+
+def encode_csv(rows, header: bool = False) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(FIELD_NAMES)
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+
+async def export_payroll(
+    fmt: ExportFormat = "ndjson",
+    compress: bool = False,
+    batch_size: int | None = None,
+) -> AsyncIterator[bytes]:
+    '''
+    Асинхронный генератор кусков выгрузки, по одному на пачку строк.
+
+    Следующая пачка читается из курсора только после того, как потребитель
+    забрал предыдущий кусок: медленный клиент StreamingResponse притормаживает
+    чтение из БД, а не копит данные в памяти. При compress=True поток сжимается
+    gzip на лету. При шардировании шарды читаются по очереди.
+    '''
+    gzip = zlib.compressobj(wbits=31) if compress else None  # 31 — заголовок gzip
+    header = fmt == "csv"
+    for maker in shard_router.all_makers():
+        async with maker() as session:
+            result = await session.stream(
+                payroll_query().execution_options(yield_per=batch_size or settings.EXPORT_BATCH_SIZE)
+            )
+            async for rows in result.partitions():
+                if fmt == "csv":
+                    chunk = encode_csv(rows, header=header)
+                    header = False
+                else:
+                    chunk = encode_ndjson(rows)
+                if gzip is not None:
+                    chunk = gzip.compress(chunk)
+                if chunk:
+                    yield chunk
+
+    if header:
+        # пустая выгрузка в CSV — только заголовок
+        chunk = encode_csv((), header=True)
+        yield gzip.compress(chunk) if gzip is not None else chunk
+    if gzip is not None:
+        yield gzip.flush()
+
+
+async def write_export(out, fmt: ExportFormat, compress: bool) -> int:
+    '''Пишет выгрузку в бинарный файл out; возвращает число байт.'''
+    written = 0
+    async for chunk in export_payroll(fmt, compress):
+        out.write(chunk)
+        written += len(chunk)
+    out.flush()
+    return written
+
+
+async def _export_to(path: str | None, fmt: ExportFormat, compress: bool) -> None:
+    try:
+        if path is None:
+            await write_export(sys.stdout.buffer, fmt, compress)
+            return
+        with open(path, "wb") as out:
+            written = await write_export(out, fmt, compress)
+        print(f"{path}: {written} байт", file=sys.stderr)
+    finally:
+        await shard_router.dispose()
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Выгрузка ведомости зарплат")
+    parser.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    parser.add_argument("--gzip", action="store_true", help="сжимать выгрузку gzip")
+    parser.add_argument("-o", "--output", help="файл выгрузки (по умолчанию stdout)")
+    args = parser.parse_args()
+    asyncio.run(_export_to(args.output, args.format, args.gzip))
+
+
+if __name__ == "__main__":
+    main()
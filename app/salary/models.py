@@ -1,21 +1,25 @@
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 
 from sqlalchemy import ForeignKey
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
-from app.dao.base import Base, int_pk
+from app.dao.base import Base, Versioned, int_pk
 from app.users.models import User
 
 
+# Период между повышениями зарплаты
+RAISE_INTERVAL_DAYS = 180
+
+
 def default_next_raise_date():
     '''
     Функция по умолчанию для поля next_raise_date:
-    возвращает дату через 180 дней от текущей.
+    возвращает дату через RAISE_INTERVAL_DAYS (180) дней от текущей.
     '''
-    return date.today() + timedelta(days=180)
+    return date.today() + timedelta(days=RAISE_INTERVAL_DAYS)
 
 
-class Salary(Base):
+class Salary(Versioned, Base):
     '''
     Модель зарплаты, связанная с пользователем.
 
@@ -37,7 +41,8 @@ class Salary(Base):
 
     user_id: Mapped[int] = mapped_column(
     ForeignKey("users.id", ondelete="CASCADE"),
-    nullable=False
+    nullable=False,
+    index=True
     )
 
     user: Mapped["User"] = relationship("User", back_populates="salary")
@@ -48,4 +53,23 @@ class Salary(Base):
 
     def __repr__(self):
         return str(self)
-    
\ No newline at end of file
+    
+
+class SalaryView(Base):
+    '''
+    Запись аудита: кто и когда просматривал данные о зарплате.
+
+    Атрибуты:
+    - viewer_id: пользователь, который смотрел данные
+    - subject_id: пользователь, чья зарплата была показана
+    - viewed_at: время просмотра (не время записи в таблицу)
+
+    Внешних ключей нет: аудит переживает удаление пользователей
+    и хранится в основной БД при шардировании.
+    '''
+
+    __tablename__ = "salary_views"
+    id: Mapped[int_pk]
+    viewer_id: Mapped[int] = mapped_column(index=True)
+    subject_id: Mapped[int] = mapped_column(index=True)
+    viewed_at: Mapped[datetime] = mapped_column(index=True)
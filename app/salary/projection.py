@@ -0,0 +1,253 @@
+'''
+Прогноз фонда оплаты труда при политике повышений.
+
+Вопрос планирования: сколько будет стоить ведомость в ближайшие N месяцев,
+если каждое повышение из next_raise_date прибавляет X% и повторяется
+каждые RAISE_INTERVAL_DAYS дней (как default_next_raise_date)?
+
+Суммы и даты повышений загружаются в массивы NumPy один раз (из колоночного
+снимка app.salary.columnar без копирования или из БД), дальше прогноз
+считается векторно: для пачки сотрудников строится матрица «сотрудник ×
+месяц» числа применённых повышений, суммы получаются умножением на таблицу
+степеней (1 + X%). Память ограничена размером пачки, а не числом сотрудников.
+
+Сумма месяца — зарплата, действующая на первое число месяца: повышение
+в середине месяца учитывается со следующего. Промежуточные суммы
+не округляются.
+
+    python -m app.salary.projection --percent 5 --months 36 [--snapshot файл | --source auto|snapshot|db] [--user-id 1 --user-id 2]
+'''
+import argparse
+import asyncio
+import time
+from array import array
+from datetime import date
+from pathlib import Path
+from typing import Literal
+
+import numpy as np
+from sqlalchemy.future import select
+
+from app.config import settings
+from app.dao.sharding import shard_router
+from app.database import engine
+from app.salary.columnar import EPOCH_DAY, ColumnarSnapshot, data_version, latest_snapshot, snapshot_path
+from app.salary.models import RAISE_INTERVAL_DAYS, Salary
+from app.users.models import User
+
+
+# Сотрудников в одной пачке: матрица пачки × 36 месяцев — около 20 МБ
+CHUNK = 1 << 16
+# Дата «никогда»: сотрудники без next_raise_date не получают повышений
+NEVER = np.iinfo(np.int64).max
+
+
+class ProjectionOverflow(ValueError):
+    '''Сложные проценты за горизонт не помещаются в float64.'''
+
+
+class RaisePolicy:
+    '''
+    Политика повышений: percent процентов каждые interval_days дней начиная
+    с next_raise_date; cap — потолок суммы (зарплаты выше потолка не растут).
+    '''
+
+    __slots__ = ("percent", "interval_days", "cap")
+
+    def __init__(self, percent: float, interval_days: int = RAISE_INTERVAL_DAYS, cap: int | None = None):
+        if interval_days <= 0:
+            raise ValueError("interval_days должен быть положительным")
+        self.percent = percent
+        self.interval_days = interval_days
+        self.cap = cap
+
+
+def month_starts(months: int, start: date | None = None) -> np.ndarray:
+    '''Первые числа months месяцев, следующих за месяцем start (datetime64[D]).'''
+    first = np.datetime64(start or date.today(), "M")
+    return (first + np.arange(1, months + 1)).astype("datetime64[D]")
+
+
+class Payroll:
+    '''
+    Ведомость в массивах NumPy, упорядоченных по user_id:
+    - user_id, amount: int64;
+    - raise_day: дни от 1970-01-01 (int64), NEVER — без повышения.
+    '''
+
+    def __init__(self, user_id: np.ndarray, amount: np.ndarray, raise_day: np.ndarray, source: str):
+        self.user_id = user_id
+        self.amount = amount
+        self.raise_day = raise_day
+        self.source = source
+
+    def __len__(self) -> int:
+        return len(self.user_id)
+
+    @classmethod
+    def from_columnar(cls, snap: ColumnarSnapshot) -> "Payroll":
+        '''Из колоночного снимка: user_id и amount — представления mmap без копирования.'''
+        raise_day = snap["next_raise_date"]
+        days = raise_day.view("<i8").copy()
+        days[np.isnat(raise_day)] = NEVER
+        return cls(snap["user_id"], snap["amount"], days, f"snapshot:{snap.path.name}")
+
+    @classmethod
+    async def from_db(cls) -> "Payroll":
+        '''Из БД (все шарды); читаются только user_id, amount и next_raise_date.'''
+        user_id, amount, raise_day = array("q"), array("q"), array("q")
+        query = (
+            select(Salary.user_id, Salary.amount, Salary.next_raise_date)
+            .join(User, User.id == Salary.user_id)
+            .where(User.deleted_at.is_(None))
+        )
+        for maker in shard_router.all_makers():
+            async with maker() as session:
+                result = await session.stream(query.execution_options(yield_per=10000))
+                async for rows in result.partitions():
+                    for row_user_id, row_amount, next_raise_date in rows:
+                        user_id.append(row_user_id)
+                        amount.append(row_amount)
+                        raise_day.append(next_raise_date.toordinal() - EPOCH_DAY if next_raise_date else NEVER)
+        order = np.argsort(np.frombuffer(user_id, dtype=np.int64), kind="stable")
+        return cls(
+            *(np.frombuffer(values, dtype=np.int64)[order] for values in (user_id, amount, raise_day)),
+            source="db",
+        )
+
+    @staticmethod
+    def _amounts(amount: np.ndarray, raise_day: np.ndarray, points: np.ndarray, policy: RaisePolicy) -> np.ndarray:
+        '''Матрица сумм «сотрудник × месяц» для пачки сотрудников.'''
+        elapsed = points.view("<i8")[None, :] - raise_day[:, None]
+        # число повышений к дате: 0 до next_raise_date, дальше +1 каждые interval_days
+        raises = np.where(elapsed >= 0, elapsed // policy.interval_days + 1, 0)
+        # при частых крупных повышениях степени уходят в inf: это ловят project и trajectories
+        with np.errstate(over="ignore", invalid="ignore"):
+            factors = (1 + policy.percent / 100) ** np.arange(raises.max(initial=0) + 1)
+            amounts = amount[:, None] * factors[raises]
+        if policy.cap is not None:
+            np.minimum(amounts, np.maximum(amount, policy.cap)[:, None], out=amounts)
+        return amounts
+
+    def project(self, policy: RaisePolicy, months: int = 36, start: date | None = None) -> dict:
+        '''Фонд оплаты труда по месяцам и за весь горизонт; ProjectionOverflow, если он бесконечен.'''
+        points = month_starts(months, start)
+        totals = np.zeros(months)
+        for begin in range(0, len(self), CHUNK):
+            chunk = slice(begin, begin + CHUNK)
+            with np.errstate(over="ignore", invalid="ignore"):
+                totals += self._amounts(self.amount[chunk], self.raise_day[chunk], points, policy).sum(axis=0)
+        with np.errstate(over="ignore"):
+            total = totals.sum()
+        if not np.isfinite(total):
+            raise ProjectionOverflow(
+                "Фонд за горизонт не помещается в float64: уменьшите percent или months либо увеличьте interval_days"
+            )
+        return {
+            "employees": len(self),
+            "current": int(self.amount.sum()),
+            "months": [
+                {"month": str(month)[:7], "total": round(float(total))}
+                for month, total in zip(points, totals)
+            ],
+            "total": round(float(total)),
+            "source": self.source,
+        }
+
+    def trajectories(
+        self, user_ids: list[int], policy: RaisePolicy, months: int = 36, start: date | None = None,
+    ) -> dict[int, list[float]]:
+        '''Зарплата каждого из user_ids по месяцам; отсутствующие пропускаются.'''
+        wanted = np.asarray(user_ids, dtype=np.int64)
+        index = np.searchsorted(self.user_id, wanted)
+        found = index < len(self)
+        found[found] &= self.user_id[index[found]] == wanted[found]
+        index = index[found]
+        amounts = self._amounts(self.amount[index], self.raise_day[index], month_starts(months, start), policy)
+        if not np.isfinite(amounts).all():
+            raise ProjectionOverflow("Зарплата за горизонт не помещается в float64")
+        # round(2) умножает на 100: у сумм на границе float64 дробной части нет, их оставляем как есть
+        with np.errstate(over="ignore", invalid="ignore"):
+            rounded = amounts.round(2)
+        rounded = np.where(np.isfinite(rounded), rounded, amounts)
+        return {int(user_id): row.tolist() for user_id, row in zip(self.user_id[index], rounded)}
+
+
+# Ведомость колоночного снимка: открывается заново, только когда выбран другой файл
+_snapshot_payroll: tuple[ColumnarSnapshot, Payroll] | None = None
+
+PayrollSource = Literal["auto", "snapshot", "db"]
+
+
+def _open_snapshot(path: Path) -> Payroll:
+    global _snapshot_payroll
+    if _snapshot_payroll is None or _snapshot_payroll[0].path != path:
+        snap = ColumnarSnapshot.open(path)
+        previous, _snapshot_payroll = _snapshot_payroll, (snap, Payroll.from_columnar(snap))
+        if previous is not None:
+            # массивы у выполняющихся расчётов остаются валидны: mmap держат их буферы
+            previous[0].close()
+    return _snapshot_payroll[1]
+
+
+async def load_payroll(source: PayrollSource = "auto") -> Payroll:
+    '''
+    Ведомость для прогноза:
+    - "auto" — колоночный снимок текущей версии данных (data_version совпадает
+      с версией файла), а если данные изменились после записи снимка — БД;
+    - "snapshot" — последний снимок, каким бы старым он ни был
+      (FileNotFoundError, если снимков нет);
+    - "db" — всегда БД.
+    '''
+    if source == "db":
+        return await Payroll.from_db()
+    if source == "snapshot":
+        path = latest_snapshot()
+        if path is None:
+            raise FileNotFoundError(f"Нет колоночных снимков в {settings.SALARY_COLUMNAR_DIR}")
+        return _open_snapshot(path)
+    # файл снимка называется по версии данных: совпадение имени — снимок актуален
+    path = snapshot_path(settings.SALARY_COLUMNAR_DIR, await data_version())
+    if not path.exists():
+        return await Payroll.from_db()
+    return _open_snapshot(path)
+
+
+async def _projection_cli(args) -> None:
+    try:
+        started = time.perf_counter()
+        payroll = Payroll.from_columnar(ColumnarSnapshot.open(args.snapshot)) if args.snapshot else await load_payroll(args.source)
+        loaded = time.perf_counter()
+        policy = RaisePolicy(args.percent, args.interval_days, args.cap)
+        result = payroll.project(policy, args.months)
+        projected = time.perf_counter()
+    finally:
+        await shard_router.dispose()
+        await engine.dispose()
+
+    print(f"Сотрудников: {result['employees']} ({result['source']}), фонд сейчас: {result['current']}")
+    for month in result["months"]:
+        print(f"{month['month']}\t{month['total']}")
+    print(f"Итого за {args.months} мес.: {result['total']}")
+    for user_id, amounts in payroll.trajectories(args.user_id, policy, args.months).items():
+        print(f"user_id={user_id}: {' '.join(f'{amount:.0f}' for amount in amounts)}")
+    print(f"Загрузка {loaded - started:.3f} с, расчёт {projected - loaded:.3f} с")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Прогноз фонда оплаты труда при политике повышений")
+    parser.add_argument("--percent", type=float, required=True, help="размер каждого повышения, %%")
+    parser.add_argument("--months", type=int, default=36, help="горизонт прогноза в месяцах")
+    parser.add_argument("--interval-days", type=int, default=RAISE_INTERVAL_DAYS, help="период повышений, дней")
+    parser.add_argument("--cap", type=int, help="потолок зарплаты")
+    parser.add_argument("--snapshot", help="колоночный снимок (по умолчанию выбирается по --source)")
+    parser.add_argument(
+        "--source", choices=["auto", "snapshot", "db"], default="auto",
+        help="auto — снимок текущей версии данных или БД, snapshot — последний снимок, db — БД",
+    )
+    parser.add_argument("--user-id", type=int, action="append", default=[], help="показать траекторию сотрудника")
+    asyncio.run(_projection_cli(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
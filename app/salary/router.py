@@ -1,8 +1,20 @@
-from fastapi import APIRouter, Body, Depends, HTTPException, Path, status
+import asyncio
+import time
 
+from fastapi import APIRouter, Body, Depends, HTTPException, Path, Query, status
+from fastapi.responses import StreamingResponse
+
+from app.config import settings
+from app.fields import fields_param, fields_response, model_response
+from app.monitoring.timing import timed_phase
+from app.salary.audit import salary_audit
 from app.salary.dao import SalaryDAO
-from app.salary.schemas import SSalary
-from app.users.dependencies import get_current_user
+from app.salary.export import MEDIA_TYPES, ExportFormat, export_payroll
+from app.salary.models import RAISE_INTERVAL_DAYS
+from app.salary.projection import PayrollSource, ProjectionOverflow, RaisePolicy, load_payroll
+from app.salary.schemas import SSalary, SSalaryProjection, SSalaryStats
+from app.salary.snapshot import salary_snapshot
+from app.users.dependencies import get_current_user, require_admin
 from app.users.models import User
 
 
@@ -11,17 +23,152 @@ router = APIRouter(
     tags=["Работа с зарплатой"]
 )
 
+admin_router = APIRouter(
+    prefix='/admin',
+    tags=["Работа с зарплатой"],
+    dependencies=[Depends(require_admin)],
+)
+
 @router.get(
     '/me/',
     summary="Получить данные зарплаты пользователя",
     response_model=SSalary,
     status_code=status.HTTP_200_OK,
 )
-async def get_salary_by_user(User = Depends(get_current_user)) -> SSalary:
-    salary = await SalaryDAO.find_salary_by_user_id(User.id)
+async def get_salary_by_user(
+    # поля проверяются до загрузки пользователя: неизвестные отклоняются без запросов к БД
+    fields: tuple[str, ...] | None = Depends(fields_param(SSalary)),
+    User = Depends(get_current_user),
+) -> SSalary:
+    '''
+    Зарплата текущего пользователя. С ?fields=amount из БД читаются только
+    эти колонки, ответ содержит только их.
+    '''
+    # свежий снимок в памяти отвечает без запроса к БД
+    salary = salary_snapshot.get(User.id)
+    if salary is None:
+        if fields is None:
+            salary = await SalaryDAO.load_by_user_id(User.id)
+        else:
+            salary = await SalaryDAO.read_one(fields, user_id=User.id)
     if not salary:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Данные о зарплате пользователя с ID {User.id} не найдены",
         )
-    return SSalary.model_validate(salary)  # важно: нужен from_attributes=True в SSalary
+    if settings.SALARY_AUDIT_ENABLED:
+        # только постановка в очередь: запись в БД делает фоновая задача
+        await salary_audit.record(User.id, User.id)
+    with timed_phase("serialize"):
+        if fields is not None:
+            return fields_response(SSalary, fields, salary)
+        return model_response(SSalary, salary)  # важно: нужен from_attributes=True в SSalary
+
+
+@admin_router.get(
+    '/export/payroll',
+    summary="Потоковая выгрузка ведомости зарплат",
+    response_class=StreamingResponse,
+)
+async def export_payroll_file(
+    format: ExportFormat = Query("ndjson", description="Формат выгрузки: ndjson или csv"),
+    gzip: bool = Query(False, description="Сжимать выгрузку gzip"),
+) -> StreamingResponse:
+    '''
+    Выгружает всех пользователей с зарплатами (требуется X-Admin-Token).
+    Строки читаются серверным курсором и отдаются по мере чтения,
+    память сервера не зависит от размера ведомости.
+    '''
+    filename = f"payroll.{format}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        export_payroll(format, gzip),
+        media_type="application/gzip" if gzip else MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def _stats_response() -> SSalaryStats:
+    if salary_snapshot.refreshed_at is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Статистика недоступна: снимок зарплат не загружен",
+        )
+    return SSalaryStats(
+        **salary_snapshot.stats.summary(),
+        age_seconds=time.monotonic() - salary_snapshot.refreshed_at,
+    )
+
+
+@admin_router.get(
+    '/salary/stats',
+    summary="Распределение зарплат и предстоящие повышения",
+    response_model=SSalaryStats,
+)
+async def get_salary_stats() -> SSalaryStats:
+    '''
+    Перцентили, среднее и гистограмма зарплат, повышения по месяцам
+    (требуется X-Admin-Token). Отдаётся из агрегатов снимка зарплат
+    без запросов к БД; нужен SALARY_SNAPSHOT_ENABLED.
+    '''
+    return _stats_response()
+
+
+@admin_router.post(
+    '/salary/stats/rebuild',
+    summary="Пересобрать статистику зарплат из БД",
+    response_model=SSalaryStats,
+)
+async def rebuild_salary_stats() -> SSalaryStats:
+    '''
+    Полностью перечитывает снимок зарплат этого воркера и его агрегаты,
+    устраняя расхождения с БД. Остальные воркеры пересобираются сами
+    раз в SALARY_STATS_RECONCILE_INTERVAL секунд. Без SALARY_SNAPSHOT_ENABLED
+    отвечает 503: снимок, который никто не опрашивает, отдавал бы
+    /salary/me/ устаревшие данные.
+    '''
+    if not settings.SALARY_SNAPSHOT_ENABLED:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Снимок зарплат выключен (SALARY_SNAPSHOT_ENABLED)",
+        )
+    await salary_snapshot.rebuild()
+    return _stats_response()
+
+
+@admin_router.get(
+    '/salary/projection',
+    summary="Прогноз фонда оплаты труда при политике повышений",
+    response_model=SSalaryProjection,
+)
+async def get_salary_projection(
+    percent: float = Query(..., ge=0, le=100, description="Размер каждого повышения, %"),
+    months: int = Query(36, ge=1, le=120, description="Горизонт прогноза в месяцах"),
+    interval_days: int = Query(RAISE_INTERVAL_DAYS, ge=1, description="Период повышений, дней"),
+    cap: int | None = Query(None, ge=0, description="Потолок зарплаты"),
+    user_id: list[int] = Query([], max_length=100, description="Сотрудники, чьи траектории вернуть"),
+    source: PayrollSource = Query("auto", description="Откуда брать ведомость: auto, snapshot или db"),
+) -> SSalaryProjection:
+    '''
+    Фонд оплаты труда по месяцам, если каждое повышение из next_raise_date
+    прибавляет percent процентов и повторяется каждые interval_days дней
+    (требуется X-Admin-Token). source=auto (по умолчанию) берёт колоночный
+    снимок (python -m app.salary.columnar write), только если он записан
+    для текущей версии данных, иначе читает БД; source=snapshot — последний
+    снимок независимо от возраста (404, если снимков нет); source=db — БД.
+    Откуда взяты данные, показывает поле source ответа. Если сложные
+    проценты за горизонт переполняют float64 (например, percent=100
+    каждый день 120 месяцев), возвращается 422.
+    '''
+    try:
+        payroll = await load_payroll(source)
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Колоночных снимков нет")
+    policy = RaisePolicy(percent, interval_days, cap)
+    try:
+        # векторный расчёт отпускает GIL: считаем в потоке, не блокируя event loop
+        result = await asyncio.to_thread(payroll.project, policy, months)
+        if user_id:
+            result["trajectories"] = await asyncio.to_thread(payroll.trajectories, user_id, policy, months)
+    except ProjectionOverflow as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    return SSalaryProjection(**result)
@@ -55,3 +55,61 @@ class SSalary(BaseModel):
         if value <= datetime.now().date():
             raise ValueError("Дата следующего повышения должна быть в будущем")
         return value
+
+
+class SSalaryHistogramBucket(BaseModel):
+    lower: int
+    upper: int
+    count: int
+
+
+class SSalaryRaisesMonth(BaseModel):
+    month: str = Field(description="Месяц в формате ГГГГ-ММ")
+    count: int
+
+
+class SSalaryStats(BaseModel):
+    '''
+    Сводка по зарплатам для руководства.
+
+    Поля:
+    - count: число сотрудников с зарплатой
+    - mean: средняя зарплата
+    - percentiles: оценки перцентилей (p10 … p99), погрешность — шаг гистограммы
+    - histogram: число зарплат по корзинам [lower, upper)
+    - raises_by_month: число предстоящих повышений по месяцам
+    - age_seconds: сколько секунд назад данные сверялись с БД
+    '''
+
+    count: int
+    mean: Optional[float]
+    percentiles: dict[str, Optional[float]]
+    histogram: list[SSalaryHistogramBucket]
+    raises_by_month: list[SSalaryRaisesMonth]
+    age_seconds: float
+
+
+class SSalaryProjectionMonth(BaseModel):
+    month: str = Field(description="Месяц в формате ГГГГ-ММ")
+    total: int = Field(description="Фонд оплаты труда за месяц")
+
+
+class SSalaryProjection(BaseModel):
+    '''
+    Прогноз фонда оплаты труда при политике повышений.
+
+    Поля:
+    - employees: число сотрудников с зарплатой
+    - current: текущий месячный фонд
+    - months: фонд по месяцам (зарплаты на первое число месяца)
+    - total: фонд за весь горизонт
+    - source: откуда взяты данные — колоночный снимок или БД
+    - trajectories: зарплаты запрошенных сотрудников по месяцам
+    '''
+
+    employees: int
+    current: int
+    months: list[SSalaryProjectionMonth]
+    total: int
+    source: str
+    trajectories: dict[int, list[float]] = {}
@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import time
+from array import array
+from datetime import date, datetime, timedelta
+
+from sqlalchemy.future import select
+
+from app.config import settings
+from app.dao.sharding import shard_router
+from app.salary.models import Salary
+from app.salary.stats import SalaryStats
+from app.users.models import User
+
+
+logger = logging.getLogger("app.salary.snapshot")
+
+
+class SalarySnapshot:
+    '''
+    Компактный снимок таблицы salary в памяти процесса для /salary/me/.
+
+    Данные лежат в трёх массивах, индексированных user_id, а не в ORM-объектах:
+    - salary_id: array('i'), 0 — нет данных (спрашиваем БД);
+    - amount: array('q');
+    - raise_day: array('i'), date.toordinal() даты повышения, 0 — None.
+    Итого 16 байт на user_id: ~16 МБ на миллион пользователей
+    (до ~32 МБ с запасом при росте массивов) против ~1–2 КБ на ORM-объект.
+
+    Снимок загружается целиком при старте и дочитывается опросом
+    salary.updated_at >= last_seen - SALARY_SNAPSHOT_OVERLAP. Перекрытие
+    нужно, потому что now() в Postgres — время начала транзакции:
+    строка, закоммиченная позже уже прочитанных, может иметь меньший
+    updated_at. Ответ отдаётся из снимка, только если последний опрос
+    был не позже SALARY_SNAPSHOT_MAX_STALENESS секунд назад; иначе
+    и для неизвестных user_id используется запрос к БД.
+
+    Удаления опрос не видит — записи вытесняются событиями шины
+    инвалидации (см. subscribe_to_invalidation). Сброс или подмена снимка
+    увеличивают generation: чтение, начатое до них, не пишет в новые
+    массивы и не помечает снимок свежим.
+
+    Вместе с массивами поддерживаются агрегаты stats (SalaryStats): каждая
+    запись снимка учтена в них ровно один раз. Расхождения, накопленные
+    из-за потерянных событий, устраняет полная пересборка (rebuild).
+    '''
+
+    def __init__(self):
+        # растёт при каждом сбросе и подмене данных: чтение, начатое раньше, отбрасывается
+        self.generation = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        '''Пустой снимок: ответы идут из БД до следующей загрузки.'''
+        self.generation += 1
+        self.salary_id = array("i")
+        self.amount = array("q")
+        self.raise_day = array("i")
+        self.last_seen: datetime | None = None
+        self.refreshed_at: float | None = None
+        self.stats = SalaryStats()
+
+    def _swap(self, other: "SalarySnapshot") -> None:
+        '''Подменяет данные снимка данными other (без await — атомарно для event loop).'''
+        self.generation += 1
+        self.salary_id = other.salary_id
+        self.amount = other.amount
+        self.raise_day = other.raise_day
+        self.last_seen = other.last_seen
+        self.refreshed_at = other.refreshed_at
+        self.stats = other.stats
+
+    def entries(self) -> int:
+        '''Число пользователей с данными в снимке (полный проход, только для логов и отчётов).'''
+        return sum(1 for salary_id in self.salary_id if salary_id)
+
+    def is_fresh(self) -> bool:
+        return (
+            self.refreshed_at is not None
+            and time.monotonic() - self.refreshed_at <= settings.SALARY_SNAPSHOT_MAX_STALENESS
+        )
+
+    def get(self, user_id: int) -> dict | None:
+        '''Данные зарплаты из снимка или None, если снимок устарел или записи нет.'''
+        if not self.is_fresh() or user_id >= len(self.salary_id):
+            return None
+        salary_id = self.salary_id[user_id]
+        if not salary_id:
+            return None
+        raise_day = self.raise_day[user_id]
+        return {
+            "id": salary_id,
+            "amount": self.amount[user_id],
+            "next_raise_date": date.fromordinal(raise_day) if raise_day else None,
+        }
+
+    def _grow(self, size: int) -> None:
+        missing = size - len(self.salary_id)
+        if missing > 0:
+            # растим с запасом, чтобы не копировать массивы на каждом новом пользователе
+            missing = max(missing, len(self.salary_id) // 4)
+            zeros = bytes(missing * 8)
+            self.salary_id.frombytes(zeros[: missing * self.salary_id.itemsize])
+            self.amount.frombytes(zeros[: missing * self.amount.itemsize])
+            self.raise_day.frombytes(zeros[: missing * self.raise_day.itemsize])
+
+    def upsert(self, user_id: int, salary_id: int, amount: int, next_raise_date: date | None) -> None:
+        self._grow(user_id + 1)
+        if self.salary_id[user_id]:
+            self.stats.remove(self.amount[user_id], self.raise_day[user_id])
+        raise_day = next_raise_date.toordinal() if next_raise_date else 0
+        self.salary_id[user_id] = salary_id
+        self.amount[user_id] = amount
+        self.raise_day[user_id] = raise_day
+        self.stats.add(amount, raise_day)
+
+    def evict(self, user_id: int) -> None:
+        '''Убирает запись из снимка: следующий запрос пойдёт в БД.'''
+        if user_id < len(self.salary_id) and self.salary_id[user_id]:
+            self.salary_id[user_id] = 0
+            self.stats.remove(self.amount[user_id], self.raise_day[user_id])
+
+    async def _read(self, since: datetime | None) -> bool:
+        '''
+        Читает строки в снимок. Если во время чтения снимок сброшен или
+        подменён, дочитанное не записывается и не помечается свежим;
+        возвращает False.
+        '''
+        query = (
+            select(Salary.user_id, Salary.id, Salary.amount, Salary.next_raise_date, Salary.updated_at)
+            .join(User, User.id == Salary.user_id)
+            .where(User.deleted_at.is_(None))
+        )
+        if since is not None:
+            query = query.where(Salary.updated_at >= since)
+        started_at = time.monotonic()
+        generation = self.generation
+        last_seen = self.last_seen
+        for maker in shard_router.all_makers():
+            async with maker() as session:
+                result = await session.stream(query.execution_options(yield_per=10000))
+                async for rows in result.partitions():
+                    if self.generation != generation:
+                        return False
+                    for user_id, salary_id, amount, next_raise_date, updated_at in rows:
+                        self.upsert(user_id, salary_id, amount, next_raise_date)
+                        if last_seen is None or updated_at > last_seen:
+                            last_seen = updated_at
+        if self.generation != generation:
+            return False
+        self.last_seen = last_seen
+        self.refreshed_at = started_at
+        return True
+
+    async def load(self) -> None:
+        '''Полная загрузка снимка.'''
+        if await self._read(since=None):
+            logger.info("Снимок зарплат загружен: %d записей", self.entries())
+        else:
+            logger.info("Снимок зарплат сброшен во время загрузки, загрузка отброшена")
+
+    async def refresh(self) -> None:
+        '''Дочитывает изменённые с прошлого опроса строки.'''
+        if self.last_seen is None:
+            await self._read(since=None)
+        else:
+            await self._read(since=self.last_seen - timedelta(seconds=settings.SALARY_SNAPSHOT_OVERLAP))
+
+    def subscribe_to_invalidation(self, bus) -> None:
+        '''
+        Вытесняет записи по событиям таблицы salary (ключ — user_id).
+        Изменённая строка получает новый updated_at и вернётся в снимок при
+        следующем опросе, удалённая — нет. Мягкое удаление пользователя
+        публикует событие salary с тем же user_id; события users (правка
+        профиля) зарплату не меняют и запись не вытесняют — иначе она
+        пропала бы из снимка и агрегатов до полной пересборки.
+        При возможной потере событий снимок перечитывается целиком.
+        '''
+        bus.subscribe("salary", lambda user_id, updated_at: self.evict(user_id))
+        bus.subscribe_reset(self.mark_stale)
+
+    async def rebuild(self) -> None:
+        '''
+        Перечитывает снимок в новый экземпляр и подменяет им текущий:
+        до окончания загрузки ответы идут из старых данных. Если снимок
+        сброшен во время загрузки (возможна потеря событий), прочитанное
+        отбрасывается.
+        '''
+        generation = self.generation
+        fresh = SalarySnapshot()
+        await fresh.load()
+        if self.generation == generation:
+            self._swap(fresh)
+
+    def mark_stale(self) -> None:
+        '''Сбрасывает снимок: ответы идут из БД до следующей полной загрузки.'''
+        self._reset()
+
+    async def refresh_periodically(self) -> None:
+        '''Фоновая задача опроса; ошибки БД не останавливают цикл.'''
+        while True:
+            await asyncio.sleep(settings.SALARY_SNAPSHOT_REFRESH_INTERVAL)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Не удалось обновить снимок зарплат")
+
+    async def rebuild_periodically(self) -> None:
+        '''Фоновая полная пересборка, сверяющая снимок и агрегаты с БД.'''
+        while True:
+            await asyncio.sleep(settings.SALARY_STATS_RECONCILE_INTERVAL)
+            try:
+                await self.rebuild()
+            except Exception:
+                logger.exception("Не удалось пересобрать снимок зарплат")
+
+
+salary_snapshot = SalarySnapshot()
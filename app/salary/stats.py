@@ -0,0 +1,83 @@
+from collections import Counter
+from datetime import date
+
+from app.config import settings
+
+
+PERCENTILES = (10, 25, 50, 75, 90, 99)
+
+
+class SalaryStats:
+    '''
+    Агрегаты по salary.amount и next_raise_date, обновляемые инкрементально.
+
+    Хранятся только счётчики: число записей, сумма, гистограмма сумм
+    с шагом SALARY_STATS_BUCKET и число повышений по дням. Добавление
+    и удаление записи — O(1), ответ строится за время, пропорциональное
+    числу непустых корзин, а не строк. Перцентили оцениваются линейной
+    интерполяцией внутри корзины, погрешность — не больше шага корзины.
+
+    Заполняется снимком зарплат (SalarySnapshot.upsert/evict), поэтому
+    работает только при SALARY_SNAPSHOT_ENABLED.
+    '''
+
+    def __init__(self, bucket: int | None = None):
+        self.bucket = bucket or settings.SALARY_STATS_BUCKET
+        self.count = 0
+        self.total = 0
+        self.buckets: Counter[int] = Counter()
+        self.raise_days: Counter[int] = Counter()
+
+    def add(self, amount: int, raise_day: int) -> None:
+        '''raise_day — date.toordinal() даты повышения, 0 — без даты.'''
+        self.count += 1
+        self.total += amount
+        self.buckets[amount // self.bucket] += 1
+        if raise_day:
+            self.raise_days[raise_day] += 1
+
+    def remove(self, amount: int, raise_day: int) -> None:
+        self.count -= 1
+        self.total -= amount
+        self.buckets[amount // self.bucket] -= 1
+        if raise_day:
+            self.raise_days[raise_day] -= 1
+
+    def percentile(self, q: float) -> float | None:
+        if self.count <= 0:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            count = self.buckets[index]
+            if count <= 0:
+                continue
+            if seen + count >= rank:
+                return (index + (rank - seen) / count) * self.bucket
+            seen += count
+        return None
+
+    def histogram(self) -> list[dict]:
+        return [
+            {"lower": index * self.bucket, "upper": (index + 1) * self.bucket, "count": count}
+            for index, count in sorted(self.buckets.items())
+            if count > 0
+        ]
+
+    def raises_by_month(self, since: date | None = None) -> list[dict]:
+        '''Число повышений по месяцам, начиная с месяца since (по умолчанию — текущего).'''
+        since = (since or date.today()).replace(day=1).toordinal()
+        months: Counter[str] = Counter()
+        for day, count in self.raise_days.items():
+            if day >= since and count > 0:
+                months[date.fromordinal(day).strftime("%Y-%m")] += count
+        return [{"month": month, "count": count} for month, count in sorted(months.items())]
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count > 0 else None,
+            "percentiles": {f"p{q}": self.percentile(q) for q in PERCENTILES},
+            "histogram": self.histogram(),
+            "raises_by_month": self.raises_by_month(),
+        }
@@ -0,0 +1,215 @@
+'''
+Генератор синтетических пользователей и зарплат для нагрузочных стендов.
+
+Регистрация через /auth/register/ хеширует пароль bcrypt на каждого
+пользователя, поэтому миллион пользователей создаётся днями. Генератор
+хеширует пароль один раз и переиспользует хеш, а строки users и salary
+загружает пачками: на Postgres — COPY, на SQLite — executemany драйвера.
+
+    python -m app.seed --users 1000000 [--seed 42] [--password loadtest123]
+
+Строки проходят ограничения SUserCreate и SSalary: email уникален,
+телефон в формате +79…, имена от 2 символов, возраст от 18 лет,
+дата повышения в будущем. Генерация детерминирована: тот же --seed
+на той же начальной БД даёт те же строки. Новые id начинаются после
+максимального существующего; при шардировании пользователи пишутся
+на назначенные кольцом шарды, а в каталог user_shards — их email.
+Все пользователи входят с паролем --password.
+'''
+import argparse
+import asyncio
+import logging
+import random
+import time
+from datetime import date
+
+from sqlalchemy import func, text
+from sqlalchemy.future import select
+
+from app.dao.sharding import shard_router, user_shards
+from app.salary.models import RAISE_INTERVAL_DAYS, Salary
+from app.users.auth import get_password_hash_async
+from app.users.models import User
+
+
+logger = logging.getLogger("app.seed")
+
+DEFAULT_PASSWORD = "loadtest123"
+
+# Имена в паре с транслитерацией для email
+FIRST_NAMES = (
+    ("Александр", "alexander"), ("Дмитрий", "dmitry"), ("Максим", "maxim"), ("Сергей", "sergey"),
+    ("Андрей", "andrey"), ("Алексей", "alexey"), ("Иван", "ivan"), ("Михаил", "mikhail"),
+    ("Анна", "anna"), ("Мария", "maria"), ("Елена", "elena"), ("Ольга", "olga"),
+    ("Наталья", "natalia"), ("Екатерина", "ekaterina"), ("Татьяна", "tatiana"), ("Ирина", "irina"),
+)
+LAST_NAMES = (
+    ("Иванов", "ivanov"), ("Смирнов", "smirnov"), ("Кузнецов", "kuznetsov"), ("Попов", "popov"),
+    ("Васильев", "vasiliev"), ("Петров", "petrov"), ("Соколов", "sokolov"), ("Михайлов", "mikhailov"),
+    ("Новиков", "novikov"), ("Фёдоров", "fedorov"), ("Морозов", "morozov"), ("Волков", "volkov"),
+)
+DOMAINS = ("example.com", "example.org", "example.net")
+
+USER_COLUMNS = ("id", "email", "phone_number", "first_name", "last_name", "date_of_birth", "password")
+# id зарплаты выдаёт БД (на шардах id локальны)
+SALARY_COLUMNS = ("user_id", "amount", "next_raise_date")
+DIRECTORY_COLUMNS = ("user_id", "email", "shard")
+
+
+class RowGenerator:
+    '''Детерминированный генератор строк users и salary для диапазона id.'''
+
+    def __init__(self, seed: int, password_hash: str, today: date | None = None):
+        self.rnd = random.Random(seed)
+        self.password_hash = password_hash
+        today = today or date.today()
+        self.today = today.toordinal()
+        # возраст 18–65 лет: граница 18 лет с запасом в день
+        self.oldest_birth = today.replace(year=today.year - 65).toordinal()
+        self.youngest_birth = today.replace(year=today.year - 18).toordinal() - 1
+
+    def rows(self, first_id: int, count: int) -> tuple[list[tuple], list[tuple]]:
+        rnd = self.rnd
+        random_value = rnd.random
+        birth_span = self.youngest_birth - self.oldest_birth
+        users, salaries = [], []
+        for user_id in range(first_id, first_id + count):
+            first_name, first_latin = FIRST_NAMES[int(random_value() * len(FIRST_NAMES))]
+            last_name, last_latin = LAST_NAMES[int(random_value() * len(LAST_NAMES))]
+            if first_name[-1] == "а" or first_name[-1] == "я":
+                last_name += "а"
+            domain = DOMAINS[int(random_value() * len(DOMAINS))]
+            # id в адресе и телефоне делает их уникальными без проверок
+            phone = f"+79{user_id:09d}" if random_value() < 0.7 else None
+            users.append((
+                user_id,
+                f"{first_latin}.{last_latin}.{user_id}@{domain}",
+                phone,
+                first_name,
+                last_name,
+                date.fromordinal(self.oldest_birth + int(random_value() * birth_span)),
+                self.password_hash,
+            ))
+            # логнормальное распределение: медиана ~100 тыс., длинный правый хвост
+            amount = int(rnd.lognormvariate(11.5, 0.45)) // 1000 * 1000
+            raise_date = (
+                date.fromordinal(self.today + 1 + int(random_value() * RAISE_INTERVAL_DAYS))
+                if random_value() < 0.97 else None
+            )
+            salaries.append((user_id, amount, raise_date))
+        return users, salaries
+
+
+async def _copy(session, table, columns: tuple[str, ...], rows: list[tuple]) -> None:
+    '''Пачка строк в table: COPY на Postgres, executemany драйвера на остальных БД.'''
+    if not rows:
+        return
+    connection = await session.connection()
+    if connection.dialect.name == "postgresql":
+        raw = await connection.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(table.name, records=rows, columns=columns)
+    else:
+        placeholders = ", ".join("?" for _ in columns)
+        await connection.exec_driver_sql(
+            f"INSERT INTO {table.name} ({', '.join(columns)}) VALUES ({placeholders})", rows,
+        )
+
+
+async def _next_id() -> int:
+    from app import database
+
+    async with database.async_session_maker() as session:
+        if shard_router.enabled:
+            return (await session.scalar(select(func.max(user_shards.c.user_id))) or 0) + 1
+        return (await session.scalar(select(func.max(User.id))) or 0) + 1
+
+
+async def _sync_sequences() -> None:
+    '''Сдвигает последовательности Postgres за вставленные явно id.'''
+    from app import database
+
+    async with database.async_session_maker() as session:
+        if session.get_bind().dialect.name != "postgresql":
+            return
+        table, column = ("user_shards", "user_id") if shard_router.enabled else ("users", "id")
+        await session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), (SELECT max({column}) FROM {table}))"
+        ))
+        await session.commit()
+
+
+async def seed(users: int, seed: int = 42, password: str = DEFAULT_PASSWORD, batch_size: int = 50_000) -> int:
+    '''
+    Создаёт users пользователей с зарплатами пачками по batch_size,
+    каждая пачка — отдельная транзакция. Возвращает первый созданный id.
+    '''
+    from app import database
+
+    # один хеш bcrypt на всех: хеширование на каждого и есть то, что делает регистрацию медленной
+    generator = RowGenerator(seed, await get_password_hash_async(password))
+    first_id = next_id = await _next_id()
+    users_table, salary_table = User.__table__, Salary.__table__
+    while next_id < first_id + users:
+        count = min(batch_size, first_id + users - next_id)
+        user_rows, salary_rows = generator.rows(next_id, count)
+        if shard_router.enabled:
+            shards = [shard_router.ring.shard_for(row[0]) for row in user_rows]
+            async with database.async_session_maker() as session:
+                await _copy(
+                    session, user_shards, DIRECTORY_COLUMNS,
+                    [(row[0], row[1], shard) for row, shard in zip(user_rows, shards)],
+                )
+                await session.commit()
+            targets = [
+                (
+                    shard_router.makers[name],
+                    [row for row, shard in zip(user_rows, shards) if shard == name],
+                    [row for row, shard in zip(salary_rows, shards) if shard == name],
+                )
+                for name in shard_router.makers
+            ]
+        else:
+            targets = [(database.async_session_maker, user_rows, salary_rows)]
+        for maker, shard_users, shard_salaries in targets:
+            async with maker() as session:
+                await _copy(session, users_table, USER_COLUMNS, shard_users)
+                await _copy(session, salary_table, SALARY_COLUMNS, shard_salaries)
+                await session.commit()
+        next_id += count
+        logger.info("Создано %d из %d пользователей", next_id - first_id, users)
+    await _sync_sequences()
+    return first_id
+
+
+async def _seed_cli(args) -> None:
+    from app.database import engine
+
+    try:
+        started = time.perf_counter()
+        first_id = await seed(args.users, args.seed, args.password, args.batch_size)
+        elapsed = time.perf_counter() - started
+        print(
+            f"Создано {args.users} пользователей (id {first_id}–{first_id + args.users - 1}) "
+            f"за {elapsed:.1f} с: {2 * args.users / elapsed:,.0f} строк users и salary в секунду; "
+            f"пароль: {args.password}"
+        )
+    finally:
+        await shard_router.dispose()
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Синтетические пользователи и зарплаты для нагрузочных тестов")
+    parser.add_argument("--users", type=int, required=True, help="число пользователей")
+    parser.add_argument("--seed", type=int, default=42, help="зерно генератора")
+    parser.add_argument("--password", default=DEFAULT_PASSWORD, help="пароль всех пользователей (8–24 символа)")
+    parser.add_argument("--batch-size", type=int, default=50_000, help="строк в одной транзакции")
+    args = parser.parse_args()
+    if not 8 <= len(args.password) <= 24:
+        parser.error("пароль должен быть от 8 до 24 символов")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_seed_cli(args))
+
+
+if __name__ == "__main__":
+    main()
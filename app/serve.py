@@ -0,0 +1,255 @@
+'''
+Продакшн-запуск сервиса: несколько воркеров uvicorn поверх одного
+слушающего сокета с предзагрузкой приложения до fork.
+
+    python -m app.serve --host 0.0.0.0 --port 8000
+
+- число воркеров по умолчанию равно числу доступных CPU с учётом
+  affinity и квоты cgroup (WEB_CONCURRENCY переопределяет);
+- приложение импортируется в мастере до fork, поэтому код и данные
+  модулей разделяются воркерами (copy-on-write);
+- бюджет соединений Postgres (DB_MAX_CONNECTIONS - DB_RESERVED_CONNECTIONS)
+  делится между воркерами и их движками (основная БД и шарды), так что
+  в сумме пулы и LISTEN-соединения его не превышают;
+- воркер плавно перезапускается после WORKER_MAX_REQUESTS запросов
+  или при превышении WORKER_MAX_MEMORY_MB резидентной памяти.
+'''
+import argparse
+import gc
+import glob
+import logging
+import math
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+
+from app.config import settings
+
+
+logger = logging.getLogger("app.serve")
+
+
+def cgroup_cpu_limit() -> float | None:
+    '''Квота CPU контейнера из cgroup v2 (cpu.max) или v1 (cfs_quota/period).'''
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_cpus() -> int:
+    '''Число CPU, реально доступных процессу.'''
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, math.ceil(limit))
+    return max(1, cpus)
+
+
+def default_workers() -> int:
+    if settings.WEB_CONCURRENCY:
+        return settings.WEB_CONCURRENCY
+    # воркер асинхронный, bcrypt уходит в пул потоков — одного процесса на CPU достаточно
+    return available_cpus()
+
+
+def split_pool_budget(workers: int, databases: int | None = None) -> tuple[int, int]:
+    '''
+    Делит бюджет соединений Postgres между воркерами и их движками.
+    Возвращает (pool_size, max_overflow) для одного движка одного воркера.
+
+    databases — число БД, к которым подключается воркер: основная и каждый
+    шард SHARD_URLS (по умолчанию 1 + len(SHARD_URLS)). У каждой БД свой
+    движок с пулом и выделенное LISTEN-соединение шины инвалидации. Шарды
+    могут жить на одном сервере с основной БД (шард "default" — она сама),
+    поэтому бюджет считается общим для всех БД.
+    '''
+    if databases is None:
+        databases = 1 + len(settings.SHARD_URLS)
+    budget = settings.DB_MAX_CONNECTIONS - settings.DB_RESERVED_CONNECTIONS
+    # LISTEN-соединения держатся постоянно и в пул не входят
+    per_engine = (budget // workers - databases) // databases
+    if per_engine < 1:
+        raise SystemExit(
+            f"Бюджет соединений {budget} не вмещает {workers} воркеров по {databases} БД "
+            "(пул и LISTEN-соединение на каждую): уменьшите --workers или увеличьте DB_MAX_CONNECTIONS"
+        )
+    # небольшой постоянный пул и overflow на пики в пределах доли движка
+    pool_size = max(1, per_engine // 2)
+    return pool_size, per_engine - pool_size
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _watch_memory(server, limit_mb: int, interval: float = 5.0) -> None:
+    while not server.should_exit:
+        time.sleep(interval)
+        if _rss_mb() > limit_mb:
+            logger.warning("Воркер %d превысил %d МБ, плавный перезапуск", os.getpid(), limit_mb)
+            server.should_exit = True
+            return
+
+
+def run_worker(app, sock: socket.socket, args) -> None:
+    '''Код дочернего процесса: свой event loop и uvicorn на общем сокете.'''
+    import uvicorn
+
+    from app import database
+    from app.dao.sharding import shard_router
+
+    # соединения, открытые до fork, нельзя делить между процессами
+    database.engine.sync_engine.dispose(close=False)
+    for engine in shard_router.engines.values():
+        engine.sync_engine.dispose(close=False)
+
+    max_requests = None
+    if args.max_requests:
+        max_requests = args.max_requests + random.randint(0, args.max_requests_jitter)
+
+    config = uvicorn.Config(
+        app,
+        log_level=args.log_level,
+        limit_max_requests=max_requests,
+        timeout_graceful_shutdown=args.graceful_timeout,
+    )
+    server = uvicorn.Server(config)
+    if args.max_memory_mb:
+        threading.Thread(
+            target=_watch_memory, args=(server, args.max_memory_mb), daemon=True,
+        ).start()
+    server.run(sockets=[sock])
+
+
+def _clear_metrics_dir() -> None:
+    if settings.METRICS_MULTIPROC_DIR:
+        os.makedirs(settings.METRICS_MULTIPROC_DIR, exist_ok=True)
+        for path in glob.glob(os.path.join(settings.METRICS_MULTIPROC_DIR, "*.json")):
+            os.remove(path)
+
+
+class Arbiter:
+    '''Мастер-процесс: держит сокет, запускает и перезапускает воркеров.'''
+
+    def __init__(self, app, sock: socket.socket, args):
+        self.app = app
+        self.sock = sock
+        self.args = args
+        self.children: set[int] = set()
+        self.stopping = False
+
+    def spawn(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                run_worker(self.app, self.sock, self.args)
+            except BaseException:
+                logger.exception("Воркер %d завершился с ошибкой", os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+        self.children.add(pid)
+
+    def stop(self, signum, frame) -> None:
+        self.stopping = True
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.args.workers):
+            self.spawn()
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            self.children.discard(pid)
+            if not self.stopping:
+                logger.info("Воркер %d завершился (код %d), запускаем замену", pid, os.waitstatus_to_exitcode(status))
+                # защита от быстрого цикла перезапусков при ошибке на старте
+                if os.waitstatus_to_exitcode(status) != 0:
+                    time.sleep(1)
+                self.spawn()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Мульти-воркерный запуск salary-service")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--max-requests", type=int, default=settings.WORKER_MAX_REQUESTS)
+    parser.add_argument("--max-requests-jitter", type=int, default=settings.WORKER_MAX_REQUESTS_JITTER)
+    parser.add_argument("--max-memory-mb", type=int, default=settings.WORKER_MAX_MEMORY_MB)
+    parser.add_argument("--graceful-timeout", type=int, default=30)
+    parser.add_argument("--log-level", default="info")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format="%(levelname)s [%(name)s] %(message)s")
+
+    settings.DB_POOL_SIZE, settings.DB_MAX_OVERFLOW = split_pool_budget(args.workers)
+    _clear_metrics_dir()
+
+    # предзагрузка: приложение импортируется до fork
+    from app.main import app
+
+    # объекты, созданные при импорте, больше не трогаются сборщиком мусора,
+    # и их страницы памяти остаются общими для воркеров
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET6 if ":" in args.host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    logger.info(
+        "Запуск %d воркеров на %s:%d, пул каждой БД на воркер: %d + %d overflow",
+        args.workers, args.host, args.port, settings.DB_POOL_SIZE, settings.DB_MAX_OVERFLOW,
+    )
+    Arbiter(app, sock, args).run()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,14 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
 from passlib.context import CryptContext
 from pydantic import EmailStr
 from jose import jwt
 from datetime import datetime, timedelta, timezone
 
 from app.config import settings
+from app.monitoring.metrics import registry
+from app.monitoring.timing import timed_phase
 from app.users.dao import UserDAO
 
 
@@ -13,11 +18,43 @@ ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt отпускает GIL, поэтому хеширование в пуле потоков не блокирует event loop
+_hash_executor = ThreadPoolExecutor(
+    max_workers=settings.BCRYPT_WORKERS,
+    thread_name_prefix="bcrypt",
+)
+_hash_tasks_pending = 0
+
+registry.gauge(
+    "bcrypt_executor_queue_depth",
+    "Задачи bcrypt, ожидающие свободного потока",
+    callback=lambda: max(0, _hash_tasks_pending - settings.BCRYPT_WORKERS),
+)
+
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    with timed_phase("hash"):
+        return pwd_context.hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    with timed_phase("hash"):
+        return pwd_context.verify(plain_password, hashed_password)
+
+async def _run_in_hash_executor(func, *args):
+    global _hash_tasks_pending
+    _hash_tasks_pending += 1
+    try:
+        with timed_phase("hash"):
+            return await asyncio.get_running_loop().run_in_executor(_hash_executor, func, *args)
+    finally:
+        _hash_tasks_pending -= 1
+
+async def get_password_hash_async(password: str) -> str:
+    '''Хеширует пароль в пуле потоков bcrypt, не блокируя event loop.'''
+    return await _run_in_hash_executor(pwd_context.hash, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    '''Проверяет пароль в пуле потоков bcrypt, не блокируя event loop.'''
+    return await _run_in_hash_executor(pwd_context.verify, plain_password, hashed_password)
 
 def create_access_token(data: dict) -> str:
     '''
@@ -33,12 +70,13 @@ def create_access_token(data: dict) -> str:
 
 async def authenticate_user(email: EmailStr, password: str):
     '''
-    Проверяет наличие пользователя с данным email и совпадение пароля.
-    Возвращает пользователя, если аутентификация успешна, иначе None.
+    Проверяет наличие пользователя с данным email (без учёта регистра)
+    и совпадение пароля. Возвращает строку (id, password), если
+    аутентификация успешна, иначе None.
     '''
     
-    user = await UserDAO.find_one_or_none(email=email)
-    if not user or verify_password(plain_password=password, hashed_password=user.password) is False:
+    user = await UserDAO.find_for_login(email)
+    if not user or await verify_password_async(plain_password=password, hashed_password=user.password) is False:
         return None
     return user
-    
\ No newline at end of file
+    
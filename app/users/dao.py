@@ -1,46 +1,283 @@
 from datetime import date, timedelta
 
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import delete
+from sqlalchemy import delete, func, insert, update
+from sqlalchemy.engine import Row
 from sqlalchemy.future import select
 
 from app.database import async_session_maker
 from app.dao.base import BaseDAO
+from app.dao.invalidation import invalidation_bus
+from app.dao.loader import BatchLoader
+from app.dao.sharding import shard_router, user_shards
+from app.monitoring.timing import timed_phase
 from app.salary.models import Salary
 from app.users.models import User
 
 
 class UserDAO(BaseDAO):
     model = User
+    invalidation_key = "id"
+    soft_delete_column = "deleted_at"
+    shard_key = "id"
+    # поля SUserRead: хеш пароля быстрым чтением не загружается
+    read_columns = ("id", "email", "phone_number", "first_name", "last_name", "date_of_birth", "version")
+
+    # Размер пачки для проверок IN (...) при массовой регистрации
+    BULK_LOOKUP_CHUNK = 1000
 
     @classmethod
-    async def register_with_salary(cls, user_data: dict) -> User:
-        '''Регистрирует нового пользователя и одновременно создает связанную запись зарплаты'''
-        async with async_session_maker() as session:
+    async def load_by_id(cls, user_id: int) -> Row | None:
+        '''
+        Ищет пользователя по id, склеивая параллельные вызовы
+        в один запрос WHERE id IN (...) (см. BatchLoader).
+        Возвращает строку с read_columns, без объекта ORM (см. read_one).
+        '''
+        return await _users_by_id.load(user_id)
+
+    @classmethod
+    async def find_for_login(cls, email: str) -> Row | None:
+        '''
+        Строка (id, password) для входа по email без учёта регистра.
+        Читает только покрывающий индекс ix_users_login (на Postgres —
+        index-only scan), остальные колонки пользователя не загружаются.
+        '''
+        return await cls.read_one(("id", "password"), email=email.lower())
+
+    @classmethod
+    async def _session_makers(cls, filter_by: dict) -> list:
+        # вход ищет пользователя по email: шард подсказывает глобальный каталог
+        if shard_router.enabled and "email" in filter_by and "id" not in filter_by:
+            located = await shard_router.locate_email(filter_by["email"])
+            return [shard_router.makers[located[1]]] if located is not None else []
+        return await super()._session_makers(filter_by)
+
+    @classmethod
+    async def update(cls, filter_by, **values):
+        '''
+        При шардировании новый email сначала занимается в каталоге
+        (занятый — IntegrityError), и возвращается обратно, если
+        обновление на шарде не удалось.
+        '''
+        if not shard_router.enabled or "email" not in values or "id" not in filter_by:
+            return await super().update(filter_by, **values)
+
+        user_id = filter_by["id"]
+        old_email = await shard_router.email_of(user_id)
+        await shard_router.rename(user_id, values["email"])
+        try:
+            return await super().update(filter_by, **values)
+        except Exception:
+            if old_email is not None:
+                await shard_router.rename(user_id, old_email)
+            raise
+
+    @classmethod
+    async def register_with_salary(cls, user_data: dict) -> Row:
+        '''
+        Регистрирует нового пользователя и одновременно создает связанную запись зарплаты.
+
+        На Postgres это один запрос: INSERT пользователя в CTE с RETURNING
+        и INSERT зарплаты из этого CTE. На остальных СУБД (SQLite в тестах) —
+        два INSERT ... RETURNING в одной транзакции, без flush и unit of work ORM.
+        При шардировании id и шард выдаёт каталог (занятый email —
+        IntegrityError из каталога), строки пишутся на шард пользователя.
+        Возвращает строку со всеми колонками users.
+        '''
+        users = User.__table__
+        maker = async_session_maker
+        user_id = None
+        if shard_router.enabled:
+            [(user_id, shard)] = await shard_router.allocate([user_data["email"]])
+            user_data = {**user_data, "id": user_id}
+            maker = shard_router.makers[shard]
+
+        async with maker() as session:
             try:
-                async with session.begin():
-                    # 1. Создаем пользователя
-                    user = User(**user_data)
-                    session.add(user)
-                    await session.flush()  # получаем user.id
+                with timed_phase("db"):
+                    async with session.begin():
+                        if session.get_bind().dialect.name == "postgresql":
+                            new_user = (
+                                insert(users).values(**user_data).returning(*users.c).cte("new_user")
+                            )
+                            # значения по умолчанию amount/next_raise_date подставляются из модели
+                            new_salary = (
+                                insert(Salary.__table__)
+                                .from_select(["user_id"], select(new_user.c.id))
+                                .cte("new_salary")
+                            )
+                            result = await session.execute(select(new_user).add_cte(new_salary))
+                            return result.one()
 
-                    # 2. Создаем зарплату
-                    salary = Salary(user_id=user.id)
-                    session.add(salary)
+                        result = await session.execute(
+                            insert(users).values(**user_data).returning(*users.c)
+                        )
+                        user = result.one()
+                        await session.execute(insert(Salary.__table__).values(user_id=user.id))
+                        return user
 
-                return user
+            except BaseException:
+                # любая ошибка или отмена (дедлайн запроса) не должна оставлять строку каталога
+                if user_id is not None:
+                    await shard_router.release([user_id])
+                raise
 
-            except IntegrityError as e:
-                raise e
+    @classmethod
+    async def find_existing_contacts(cls, emails: list[str], phones: list[str]) -> tuple[set[str], set[str]]:
+        '''
+        Возвращает уже занятые email и номера телефонов из переданных списков.
+        Контакты удалённых, но ещё не очищенных пользователей тоже заняты:
+        их держат уникальные индексы.
+        '''
+        taken_emails: set[str] = set()
+        taken_phones: set[str] = set()
+        if shard_router.enabled:
+            # email уникален глобально и есть в каталоге, телефон — только на шардах
+            lookups = [(async_session_maker, user_shards.c.email, emails, taken_emails)]
+            lookups += [(maker, User.phone_number, phones, taken_phones) for maker in shard_router.all_makers()]
+        else:
+            lookups = [
+                (async_session_maker, User.email, emails, taken_emails),
+                (async_session_maker, User.phone_number, phones, taken_phones),
+            ]
+        for maker, column, values, taken in lookups:
+            async with maker() as session:
+                for i in range(0, len(values), cls.BULK_LOOKUP_CHUNK):
+                    chunk = values[i:i + cls.BULK_LOOKUP_CHUNK]
+                    with timed_phase("db"):
+                        result = await session.execute(select(column).where(column.in_(chunk)))
+                    taken.update(result.scalars())
+        return taken_emails, taken_phones
 
     @classmethod
-    async def delete_user_by_id(cls, user_id: int):
-        '''Удаляет пользователя по ID, если он существует.'''
+    async def bulk_register_with_salary(cls, users_data: list[dict]) -> list[int]:
+        '''
+        Массово регистрирует пользователей с зарплатами в одной транзакции.
+
+        Использует executemany-путь ORM (insertmanyvalues): строки уходят
+        пачками в многострочных INSERT ... RETURNING, без unit of work.
+        Возвращает id созданных пользователей в порядке входного списка.
+        '''
+        if shard_router.enabled:
+            return await cls._bulk_register_sharded(users_data)
+
         async with async_session_maker() as session:
-            result = await session.execute(select(cls.model).filter_by(id=user_id))
-            user = result.scalar_one_or_none()
-            if not user:
-                return False
-            await session.delete(user)
-            await session.commit()
+            with timed_phase("db"):
+                async with session.begin():
+                    result = await session.scalars(
+                        insert(User).returning(User.id, sort_by_parameter_order=True),
+                        users_data,
+                    )
+                    user_ids = list(result)
+                    await session.execute(
+                        insert(Salary),
+                        [{"user_id": user_id} for user_id in user_ids],
+                    )
+        return user_ids
+
+    @classmethod
+    async def _bulk_register_sharded(cls, users_data: list[dict]) -> list[int]:
+        '''
+        Массовая регистрация при шардировании: id и шарды выдаются каталогом
+        одной транзакцией, затем строки пишутся по транзакции на шард.
+        Атомарности между шардами нет: при ошибке уже записанные шарды
+        и каталог откатываются удалением.
+        '''
+        placement = await shard_router.allocate([row["email"] for row in users_data])
+        by_shard: dict[str, list[dict]] = {}
+        for row, (user_id, shard) in zip(users_data, placement):
+            by_shard.setdefault(shard, []).append({**row, "id": user_id})
+
+        written: list[tuple[str, list[int]]] = []
+        try:
+            for shard, rows in by_shard.items():
+                async with shard_router.makers[shard]() as session:
+                    with timed_phase("db"):
+                        async with session.begin():
+                            await session.execute(insert(User), rows)
+                            await session.execute(insert(Salary), [{"user_id": row["id"]} for row in rows])
+                written.append((shard, [row["id"] for row in rows]))
+        except BaseException:
+            for shard, user_ids in written:
+                async with shard_router.makers[shard]() as session:
+                    await session.execute(delete(Salary).where(Salary.user_id.in_(user_ids)))
+                    await session.execute(delete(User).where(User.id.in_(user_ids)))
+                    await session.commit()
+            await shard_router.release([user_id for user_id, _ in placement])
+            raise
+        return [user_id for user_id, _ in placement]
+
+    @classmethod
+    async def delete_user_by_id(cls, user_id: int):
+        '''
+        Мягко удаляет пользователя по ID одним UPDATE: строка помечается
+        deleted_at и сразу перестаёт быть видна приложению. Сами строки
+        users и salary удаляет фоновая очистка (purge_deleted).
+        Возвращает False, если пользователя нет или он уже удалён.
+        '''
+        makers = await cls._session_makers({"id": user_id})
+        if not makers:
+            return False
+        async with makers[0]() as session:
+            with timed_phase("db"):
+                result = await session.execute(
+                    update(User)
+                    .where(User.id == user_id, User.deleted_at.is_(None))
+                    .values(deleted_at=func.now(), version=User.version + 1)
+                    .returning(User.id)
+                )
+                if result.scalar_one_or_none() is None:
+                    return False
+                # кэши зарплаты ключуются тем же user_id
+                await invalidation_bus.publish(session, "users", [user_id])
+                await invalidation_bus.publish(session, "salary", [user_id])
+                await session.commit()
+            invalidation_bus.dispatch("users", [user_id])
+            invalidation_bus.dispatch("salary", [user_id])
             return True
+
+    @classmethod
+    async def purge_deleted(cls, batch_size: int, grace_seconds: float = 0) -> int:
+        '''
+        Окончательно удаляет пачку мягко удалённых пользователей старше
+        grace_seconds. Зарплаты удаляет СУБД по ON DELETE CASCADE, ORM
+        связанные строки не загружает. На Postgres строки берутся с
+        FOR UPDATE SKIP LOCKED, чтобы очистки разных воркеров не ждали
+        друг друга. При шардировании пачка удаляется на каждом шарде,
+        затем освобождаются строки каталога. Возвращает число удалённых
+        пользователей.
+        '''
+        purged = 0
+        for maker in await cls._session_makers({}):
+            async with maker() as session:
+                with timed_phase("db"):
+                    is_postgres = session.get_bind().dialect.name == "postgresql"
+                    # граница считается часами СУБД, как и deleted_at = now(),
+                    # иначе сдвиг часов или часового пояса меняет срок хранения
+                    if is_postgres:
+                        cutoff = func.now() - timedelta(seconds=grace_seconds)
+                    else:
+                        cutoff = func.datetime("now", f"-{grace_seconds} seconds")
+                    batch = (
+                        select(User.id)
+                        .where(User.deleted_at.is_not(None), User.deleted_at <= cutoff)
+                        .order_by(User.id)
+                        .limit(batch_size)
+                    )
+                    if is_postgres:
+                        batch = batch.with_for_update(skip_locked=True)
+                    else:
+                        # SQLite без PRAGMA foreign_keys каскад не выполняет
+                        await session.execute(delete(Salary).where(Salary.user_id.in_(batch.scalar_subquery())))
+                    result = await session.execute(
+                        delete(User).where(User.id.in_(batch.scalar_subquery())).returning(User.id)
+                    )
+                    user_ids = result.scalars().all()
+                    await session.commit()
+            if user_ids and shard_router.enabled:
+                # email освобождается только после удаления строки с шарда
+                await shard_router.release(user_ids)
+            purged += len(user_ids)
+        return purged
+
+_users_by_id = BatchLoader(lambda ids: UserDAO.read_many_by("id", ids))
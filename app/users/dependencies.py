@@ -1,14 +1,18 @@
+import hmac
+
 from fastapi import Request, HTTPException, status, Depends
 from jose import jwt, JWTError
 from datetime import datetime, timezone
 
 from app.config import settings
+from app.monitoring.timing import timed_phase
 from app.users.dao import UserDAO
 
 
 SECRET_KEY = settings.SECRET_KEY
 ALGORITHM = settings.ALGORITHM
 COOKIE_NAME = "users_access_token"
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
 
 
 def get_token(request: Request):
@@ -23,21 +27,22 @@ def get_token(request: Request):
     return token
 
   
-async def get_current_user(token: str = Depends(get_token)):
+async def get_current_user_id(token: str = Depends(get_token)) -> int:
     '''
-    Извлекает и проверяет текущего пользователя по JWT токену.
+    Извлекает id текущего пользователя из JWT токена без обращения к БД.
 
     проверка:
     - валидность токена
     - срок действия токена (exp)
     - наличие user_id в поле "sub" токена
-    - существование пользователя в базе данных
 
-    Возвращает объект пользователя или - HTTP 401.
+    Возвращает id пользователя или - HTTP 401. Существование пользователя
+    проверяет вызывающий (см. get_current_user).
     '''
 
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with timed_phase("auth"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Токен не валидный!')
 
@@ -49,9 +54,35 @@ async def get_current_user(token: str = Depends(get_token)):
     user_id = payload.get('sub')
     if not user_id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Не найден ID пользователя')
+    return int(user_id)
 
-    user = await UserDAO.find_one_or_none_by_id(int(user_id))
+
+async def get_current_user(user_id: int = Depends(get_current_user_id)):
+    '''
+    Текущий пользователь по JWT токену: проверки get_current_user_id
+    и существование пользователя в базе данных.
+
+    Возвращает объект пользователя или - HTTP 401.
+    '''
+    user = await UserDAO.load_by_id(user_id)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='User not found')
 
     return user
+
+
+def is_admin_token(token: str | None) -> bool:
+    '''Сравнивает токен с ADMIN_TOKEN за постоянное время; без ADMIN_TOKEN доступа нет.'''
+    if not settings.ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode(), settings.ADMIN_TOKEN.encode())
+
+
+def require_admin(request: Request):
+    '''
+    Разрешает доступ к служебным эндпоинтам только с валидным
+    заголовком X-Admin-Token, иначе — HTTP 403.
+    '''
+
+    if not is_admin_token(request.headers.get(ADMIN_TOKEN_HEADER)):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Недостаточно прав')
@@ -1,12 +1,12 @@
-from datetime import date
+from datetime import date, datetime
 
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import text
+from sqlalchemy import Index, text
 
-from app.dao.base import Base, str_uniq, int_pk, str_null_true, str_uniq_null_true
+from app.dao.base import Base, Versioned, str_uniq, int_pk, str_null_true, str_uniq_null_true
 
 
-class User(Base):
+class User(Versioned, Base):
     '''
     Модель пользователя.
     Поля:
@@ -17,10 +17,29 @@ class User(Base):
     - last_name: фамилия пользователя, опционально
     - date_of_birth: дата рождения, опционально
     - password: хешированный пароль
+    - deleted_at: время мягкого удаления; такие пользователи не видны приложению
+      и удаляются окончательно фоновой очисткой (app/users/purge.py)
     - salary: один к одному с моделью Salary, при удалении пользователя удаляется и зарплата
     '''
     
     __tablename__ = "users"
+    __table_args__ = (
+        # частичный индекс: очистке нужны только помеченные строки, а их единицы
+        Index(
+            "ix_users_deleted_at",
+            "deleted_at",
+            postgresql_where=text("deleted_at IS NOT NULL"),
+            sqlite_where=text("deleted_at IS NOT NULL"),
+        ),
+        # покрывающий индекс входа: (id, password) читаются index-only scan без обращения к таблице
+        Index(
+            "ix_users_login",
+            "email",
+            postgresql_include=["id", "password"],
+            postgresql_where=text("deleted_at IS NULL"),
+            sqlite_where=text("deleted_at IS NULL"),
+        ),
+    )
     id: Mapped[int_pk]
     email: Mapped[str_uniq]
     phone_number: Mapped[str_uniq_null_true]
@@ -28,6 +47,7 @@ class User(Base):
     last_name: Mapped[str_null_true]
     date_of_birth: Mapped[date] = mapped_column(nullable=True)
     password: Mapped[str]
+    deleted_at: Mapped[datetime] = mapped_column(nullable=True)
 
     salary: Mapped["Salary"] = relationship(
         "Salary",
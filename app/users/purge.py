@@ -0,0 +1,36 @@
+import asyncio
+import logging
+
+from app.config import settings
+from app.users.dao import UserDAO
+
+
+logger = logging.getLogger("app.users.purge")
+
+
+async def purge_deleted_users() -> int:
+    '''
+    Удаляет всех мягко удалённых пользователей пачками по USER_PURGE_BATCH_SIZE.
+    Каждая пачка — отдельная короткая транзакция, между пачками управление
+    возвращается event loop. Возвращает общее число удалённых.
+    '''
+    total = 0
+    while True:
+        purged = await UserDAO.purge_deleted(settings.USER_PURGE_BATCH_SIZE, settings.USER_PURGE_GRACE)
+        total += purged
+        if purged < settings.USER_PURGE_BATCH_SIZE:
+            break
+        await asyncio.sleep(0)
+    if total:
+        logger.info("Очищено удалённых пользователей: %d", total)
+    return total
+
+
+async def purge_periodically() -> None:
+    '''Фоновая задача очистки; ошибки БД не останавливают цикл.'''
+    while True:
+        await asyncio.sleep(settings.USER_PURGE_INTERVAL)
+        try:
+            await purge_deleted_users()
+        except Exception:
+            logger.exception("Не удалось очистить удалённых пользователей")
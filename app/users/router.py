@@ -1,13 +1,19 @@
-from fastapi import APIRouter, Body, Depends, HTTPException, Path, Request, Response, status
+import asyncio
+
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Path, Request, Response, status
 
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.exc import StaleDataError
 
-from app.users.auth import authenticate_user, create_access_token, get_password_hash
+from app.dao.idempotency import IDEMPOTENCY_KEY_HEADER, idempotency_store
+from app.fields import fields_param, fields_response, model_response
+from app.monitoring.timing import timed_phase
+from app.users.auth import authenticate_user, create_access_token, get_password_hash_async
 from app.users.dao import UserDAO
-from app.users.dependencies import get_current_user
+from app.users.dependencies import get_current_user, get_current_user_id, require_admin
 from app.users.models import User
-from app.users.schemas import SUserAuth, SUserCreate, SUserRead, SUserUpdate
+from app.users.schemas import SUserAuth, SUserBulkCreate, SUserBulkResult, SUserCreate, SUserRead, SUserUpdate
 
 
 router = APIRouter(
@@ -21,31 +27,41 @@ router = APIRouter(
     response_model=SUserRead,
     status_code=status.HTTP_201_CREATED,
 )
-async def register_user(user_data: SUserCreate) -> SUserRead:
+async def register_user(
+    user_data: SUserCreate,
+    idempotency_key: str | None = Header(None, alias=IDEMPOTENCY_KEY_HEADER, max_length=255),
+) -> SUserRead:
     '''
     Регистрирует нового пользователя.
     - Хеширует пароль.
     - Создаёт пользователя с зарплатой.
     - Обрабатывает ошибки уникальности email и телефона.
+    - Повтор с тем же Idempotency-Key возвращает сохранённый ответ.
     '''
+    return await idempotency_store.run(
+        "POST /auth/register/", idempotency_key, user_data,
+        lambda: _register_user(user_data), status_code=status.HTTP_201_CREATED,
+    )
+
 
+async def _register_user(user_data: SUserCreate) -> Response:
     data = user_data.model_dump(exclude={"password"})
-    data["password"] = get_password_hash(user_data.password)
+    data["password"] = await get_password_hash_async(user_data.password)
 
     try:
         user = await UserDAO.register_with_salary(data)
     except IntegrityError as e:
-        msg = str(e.orig)
-        # поддерживаем и Postgres, и SQLite
-        if "users_email_key" in msg or "users.email" in msg:
+        field = conflicting_field(e)
+        if field == "email":
             detail = "Такой адрес электронной почты уже используется"
-        elif "users_phone_number_key" in msg or "users.phone_number" in msg:
+        elif field == "phone_number":
             detail = "Такой номер телефона уже используется"
         else:
             detail = "Нарушение уникальности при создании пользователя"
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=detail)
 
-    return SUserRead.model_validate(user)
+    with timed_phase("serialize"):
+        return model_response(SUserRead, user, status_code=status.HTTP_201_CREATED)
 
 @router.post(
         "/auth/login/", 
@@ -84,8 +100,25 @@ async def logout_user(request: Request, response: Response):
         "/users/me/", 
         summary="Получить данные пользователя",
         response_model=SUserRead)
-async def get_me(user_data: User = Depends(get_current_user)) -> SUserRead:
-    return user_data
+async def get_me(
+    user_id: int = Depends(get_current_user_id),
+    fields: tuple[str, ...] | None = Depends(fields_param(SUserRead)),
+) -> SUserRead:
+    '''
+    Данные текущего пользователя. С ?fields=email,first_name из БД читаются
+    только эти колонки (хеш пароля не загружается), ответ содержит только их.
+    Полный ответ содержит ETag с версией строки для If-Match в PATCH.
+    '''
+    if fields is None:
+        user_data = await get_current_user(user_id)
+        with timed_phase("serialize"):
+            return model_response(SUserRead, user_data, headers={"ETag": etag(user_data.version)})
+
+    row = await UserDAO.read_one(fields, id=user_id)
+    if row is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='User not found')
+    with timed_phase("serialize"):
+        return fields_response(SUserRead, fields, row)
     
 @router.patch(
     "/users/update/me",
@@ -95,12 +128,64 @@ async def get_me(user_data: User = Depends(get_current_user)) -> SUserRead:
 )
 async def update_user(
     payload: SUserUpdate = Body(...),
-    User = Depends(get_current_user)  # опционально
+    User = Depends(get_current_user),  # опционально
+    idempotency_key: str | None = Header(None, alias=IDEMPOTENCY_KEY_HEADER, max_length=255),
+    if_match: str | None = Header(None, alias="If-Match"),
 ) -> SUserRead:
+    '''
+    Частично обновляет профиль. С заголовком If-Match (ETag из GET /users/me/)
+    обновление применяется, только если профиль не изменился с момента чтения,
+    иначе 409; без него последний писатель побеждает.
+    '''
+    expected_version = parse_if_match(if_match)
+    # ключи разных пользователей не пересекаются
+    return await idempotency_store.run(
+        f"PATCH /users/update/me:{User.id}", idempotency_key, payload,
+        lambda: _update_user(payload, User, expected_version),
+    )
+
+
+def etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def parse_if_match(value: str | None) -> int | None:
+    '''Версия из If-Match; None — заголовка нет или "*" (любая версия).'''
+    if value is None or value.strip() == "*":
+        return None
+    tag = value.strip().removeprefix("W/").strip('"')
+    if not tag.isdigit():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Некорректный If-Match: ожидается ETag из GET /users/me/",
+        )
+    return int(tag)
+
+
+VERSION_CONFLICT = "Профиль изменён другим запросом, перечитайте его и повторите"
+
+
+def conflicting_field(e: IntegrityError) -> str | None:
+    '''
+    Поле, нарушившее уникальность: "email", "phone_number" или None.
+    Поддерживаем и Postgres, и SQLite; при шардировании занятый email
+    обнаруживает каталог user_shards.
+    '''
+    msg = str(e.orig)
+    if any(name in msg for name in ("users_email_key", "users.email", "user_shards_email_key", "user_shards.email")):
+        return "email"
+    if "users_phone_number_key" in msg or "users.phone_number" in msg:
+        return "phone_number"
+    return None
+
+
+async def _update_user(payload: SUserUpdate, User, expected_version: int | None) -> Response:
     # 1. Проверка, существует ли пользователь
-    existing = await UserDAO.find_one_or_none_by_id(User.id)
+    existing = await UserDAO.read_one(id=User.id)
     if not existing:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
+    if expected_version is not None and existing.version != expected_version:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=VERSION_CONFLICT)
 
     # 2. Получаем словарь обновляемых значений (только те, что не None)
     update_data = payload.model_dump(exclude_none=True)
@@ -125,8 +210,23 @@ async def update_user(
     try:
         updated_count = await UserDAO.update(
             filter_by={"id": User.id},
+            expected_version=expected_version,
             **update_data
         )
+    except StaleDataError:
+        # строку изменили между проверкой и UPDATE
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=VERSION_CONFLICT)
+    except IntegrityError as e:
+        # значение занято строкой, которую проверки выше не видят (мягко удалённый
+        # пользователь до очистки) или записанной параллельно
+        field = conflicting_field(e)
+        if field == "email":
+            detail = "Такой email уже используется другим пользователем"
+        elif field == "phone_number":
+            detail = "Такой номер телефона уже используется другим пользователем"
+        else:
+            detail = "Нарушение уникальности при обновлении пользователя"
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=detail)
     except SQLAlchemyError:
         raise HTTPException(status_code=500, detail="Не удалось обновить данные пользователя")
 
@@ -134,8 +234,9 @@ async def update_user(
         raise HTTPException(status_code=404, detail="Пользователь не найден при обновлении")
 
     # 6. Возврат обновлённого пользователя
-    updated = await UserDAO.find_one_or_none_by_id(User.id)
-    return SUserRead.model_validate(updated)
+    updated = await UserDAO.read_one(id=User.id)
+    with timed_phase("serialize"):
+        return model_response(SUserRead, updated, headers={"ETag": etag(updated.version)})
 
 @router.delete(
         "/users/delete/me", 
@@ -144,11 +245,61 @@ async def update_user(
 )
 async def delete_user(response: Response, User = Depends(get_current_user)):
     '''
-    Удаляет текущего пользователя из базы данных и очищает куки с токеном.
+    Помечает текущего пользователя удалённым и очищает куки с токеном.
+    Строки пользователя и зарплаты удаляет фоновая очистка.
     Возвращает 404, если пользователь не найден.
     '''
     deleted = await UserDAO.delete_user_by_id(User.id)
     response.delete_cookie(key="users_access_token")
     if not deleted:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
-    
\ No newline at end of file
+    
+
+@router.post(
+    "/admin/users/bulk",
+    summary="Массовая регистрация сотрудников",
+    response_model=SUserBulkResult,
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(require_admin)],
+)
+async def bulk_register_users(payload: SUserBulkCreate) -> SUserBulkResult:
+    '''
+    Регистрирует до 10 000 сотрудников за вызов (требуется X-Admin-Token).
+    - Пропускает пользователей с уже занятыми email или телефоном
+      (в том числе повторы внутри запроса).
+    - Хеширует пароли параллельно в пуле потоков bcrypt.
+    - Создаёт пользователей и зарплаты пачками в одной транзакции.
+    '''
+
+    taken_emails, taken_phones = await UserDAO.find_existing_contacts(
+        [user.email for user in payload.users],
+        [user.phone_number for user in payload.users if user.phone_number],
+    )
+
+    accepted, skipped = [], []
+    for user in payload.users:
+        if user.email in taken_emails or (user.phone_number and user.phone_number in taken_phones):
+            skipped.append(user.email)
+            continue
+        taken_emails.add(user.email)
+        if user.phone_number:
+            taken_phones.add(user.phone_number)
+        accepted.append(user)
+
+    hashes = await asyncio.gather(*(get_password_hash_async(user.password) for user in accepted))
+    rows = [
+        {**user.model_dump(exclude={"password"}), "password": password_hash}
+        for user, password_hash in zip(accepted, hashes)
+    ]
+
+    if rows:
+        try:
+            await UserDAO.bulk_register_with_salary(rows)
+        except IntegrityError:
+            # гонка с параллельной регистрацией: пачка откатывается целиком
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Нарушение уникальности при массовой регистрации, повторите запрос",
+            )
+
+    return SUserBulkResult(created=len(rows), skipped=skipped)
@@ -6,6 +6,14 @@ from typing_extensions import Annotated
 from typing import Optional
 
 
+def normalize_email(value: Optional[str]) -> Optional[str]:
+    '''
+    Email хранится и ищется в нижнем регистре: вход не зависит от регистра,
+    а уникальность проверяется без учёта регистра.
+    '''
+    return value.lower() if value is not None else value
+
+
 class SUserBase(BaseModel):
     '''
     Базовая схема пользователя с необязательными полями.
@@ -41,6 +49,8 @@ class SUserBase(BaseModel):
         description="Дата рождения пользователя в формате ГГГГ-ММ-ДД"
     )
 
+    _normalize_email = field_validator("email")(normalize_email)
+
     @field_validator("phone_number")
     @classmethod
     def validate_phone_number(cls, value: Optional[str]) -> Optional[str]:
@@ -133,3 +143,27 @@ class SUserAuth(BaseModel):
             description="Пароль пользователя от 8 до 24 символов"
         )
     ]
+
+    _normalize_email = field_validator("email")(normalize_email)
+
+
+class SUserBulkCreate(BaseModel):
+    '''
+    Схема массовой регистрации сотрудников (онбординг компании).
+    Содержит от 1 до 10 000 пользователей.
+    '''
+    users: list[SUserCreate] = Field(
+        min_length=1,
+        max_length=10000,
+        description="Список регистрируемых пользователей"
+    )
+
+
+class SUserBulkResult(BaseModel):
+    '''
+    Результат массовой регистрации.
+    - created: число созданных пользователей
+    - skipped: email пользователей, пропущенных из-за занятого email или телефона
+    '''
+    created: int
+    skipped: list[EmailStr]
@@ -0,0 +1,102 @@
+'''
+Стоимость гидрации ORM против быстрого чтения Core (BaseDAO.read_one).
+
+    python benchmarks/bench_hydration.py --rows 100000
+
+Данные кладутся в файл SQLite. Сравниваются:
+- запрос на вызов, как в /salary/me/: find_one_or_none (объект ORM,
+  identity map) против read_one (строка Row), оба с SSalary.model_validate;
+- пачка из 10 000 строк: select(Salary) с объектами ORM против Core select
+  колонок read_columns, с валидацией каждой строки схемой ответа.
+'''
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.future import select
+
+import app.dao.base as base_dao
+from app.dao.base import Base
+from app.salary.dao import SalaryDAO
+from app.salary.models import Salary
+from app.salary.schemas import SSalary
+from app.users.models import User
+
+
+async def bench_per_request(rows: int, lookups: int) -> None:
+    ids = [random.randint(1, rows) for _ in range(lookups)]
+    for name, read in (
+        ("ORM ", lambda user_id: SalaryDAO.find_one_or_none(user_id=user_id)),
+        ("Core", lambda user_id: SalaryDAO.read_one(user_id=user_id)),
+    ):
+        start = time.perf_counter()
+        for user_id in ids:
+            SSalary.model_validate(await read(user_id))
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {elapsed / lookups * 1e6:.0f} мкс на запрос")
+
+
+async def bench_batch(session_maker, batch: int, repeat: int) -> None:
+    table = Salary.__table__
+    orm_query = select(Salary).limit(batch)
+    core_query = select(*(table.c[name] for name in SalaryDAO.read_columns)).limit(batch)
+    async with session_maker() as session:
+        for name, fetch in (
+            ("ORM ", lambda: session.execute(orm_query)),
+            ("Core", lambda: session.execute(core_query)),
+        ):
+            fetch_time = validate_time = 0.0
+            for _ in range(repeat):
+                session.expunge_all()  # объекты ORM гидрируются заново, как в новом запросе
+                start = time.perf_counter()
+                result = await fetch()
+                items = result.scalars().all() if name == "ORM " else result.all()
+                fetch_time += time.perf_counter() - start
+                start = time.perf_counter()
+                for item in items:
+                    SSalary.model_validate(item)
+                validate_time += time.perf_counter() - start
+            print(f"{name}: {batch} строк — выборка {fetch_time / repeat * 1e3:.1f} мс, "
+                  f"валидация {validate_time / repeat * 1e3:.1f} мс")
+
+
+async def main_async(rows: int, lookups: int, batch: int, repeat: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp}/bench.db")
+        session_maker = async_sessionmaker(engine, expire_on_commit=False)
+        base_dao.async_session_maker = session_maker
+
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(insert(User), [
+                {"id": i, "email": f"u{i}@example.com", "password": "x"} for i in range(1, rows + 1)
+            ])
+            await conn.execute(insert(Salary), [{"user_id": i, "amount": 80000} for i in range(1, rows + 1)])
+
+        print(f"Запрос на вызов ({lookups} вызовов):")
+        await bench_per_request(rows, lookups)
+        print(f"Пачка строк ({repeat} повторов):")
+        await bench_batch(session_maker, min(batch, rows), repeat)
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--lookups", type=int, default=5_000)
+    parser.add_argument("--batch", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(main_async(args.rows, args.lookups, args.batch, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+'''
+Прогноз фонда оплаты труда: векторный расчёт против построчного цикла Python.
+
+    python benchmarks/bench_projection.py --employees 1000000 --months 36
+
+Синтетическая ведомость (суммы 50–300 тыс., повышения в ближайшие 180 дней,
+5% без даты повышения) записывается колоночным снимком во временный каталог.
+Сравниваются:
+- открытие снимка (mmap) и подготовка массивов Payroll;
+- Payroll.project на всех сотрудниках;
+- построчный цикл по сотрудникам и месяцам, как без NumPy; он меряется
+  на --loop-employees сотрудниках и пересчитывается на всю ведомость.
+'''
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from array import array
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.salary.columnar import EPOCH_DAY, FIXED_COLUMNS, NAT, ColumnarSnapshot, write_file
+from app.salary.projection import Payroll, RaisePolicy, month_starts
+
+
+def build_snapshot(path: Path, employees: int) -> None:
+    rnd = random.Random(42)
+    today = date.today().toordinal() - EPOCH_DAY
+    fixed = {name: array("q") for name in FIXED_COLUMNS}
+    for user_id in range(1, employees + 1):
+        fixed["user_id"].append(user_id)
+        fixed["salary_id"].append(user_id)
+        fixed["amount"].append(rnd.randint(50_000, 300_000))
+        fixed["next_raise_date"].append(today + rnd.randint(1, 180) if rnd.random() > 0.05 else NAT)
+    strings = [[f"u{i}@example.com" for i in range(1, employees + 1)], [None] * employees, [None] * employees]
+    write_file(path, None, fixed, strings)
+
+
+def project_row_by_row(payroll: Payroll, policy: RaisePolicy, points: list[date], employees: int) -> list[float]:
+    totals = [0.0] * len(points)
+    factor = 1 + policy.percent / 100
+    for amount, raise_day in zip(payroll.amount[:employees].tolist(), payroll.raise_day[:employees].tolist()):
+        due = date.fromordinal(raise_day + EPOCH_DAY) if raise_day < 10**9 else None
+        for i, point in enumerate(points):
+            while due is not None and due <= point:
+                amount *= factor
+                due += timedelta(days=policy.interval_days)
+            totals[i] += amount
+    return totals
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--employees", type=int, default=1_000_000)
+    parser.add_argument("--months", type=int, default=36)
+    parser.add_argument("--percent", type=float, default=5.0)
+    parser.add_argument("--loop-employees", type=int, default=50_000)
+    args = parser.parse_args()
+
+    policy = RaisePolicy(args.percent)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "salary.col"
+        start = time.perf_counter()
+        build_snapshot(path, args.employees)
+        print(f"снимок {args.employees} сотрудников: {path.stat().st_size / 2**20:.1f} МБ, "
+              f"запись {time.perf_counter() - start:.1f} с")
+
+        with ColumnarSnapshot.open(path) as snap:
+            start = time.perf_counter()
+            payroll = Payroll.from_columnar(snap)
+            print(f"открытие и подготовка массивов: {(time.perf_counter() - start) * 1e3:.1f} мс")
+
+            start = time.perf_counter()
+            result = payroll.project(policy, args.months)
+            vectorized = time.perf_counter() - start
+            print(f"NumPy: {vectorized * 1e3:.0f} мс на {args.months} мес., итого {result['total']}")
+
+            points = [point.astype(date) for point in month_starts(args.months)]
+            sample = min(args.loop_employees, args.employees)
+            start = time.perf_counter()
+            project_row_by_row(payroll, policy, points, sample)
+            looped = (time.perf_counter() - start) * args.employees / sample
+            print(f"цикл Python: ~{looped:.1f} с (по {sample} сотрудникам), в {looped / vectorized:.0f} раз медленнее")
+            del payroll
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+'''
+Сравнение однопроцессного uvicorn и мульти-воркерного app.serve.
+
+    python benchmarks/bench_serve.py --duration 10 --concurrency 64 --path /
+
+Оба варианта запускаются по очереди как подпроцессы с текущим окружением
+(.env / переменные DB_*), нагрузка подаётся из этого же процесса через
+httpx. Для эндпоинтов с БД нужен поднятый Postgres с применёнными миграциями.
+'''
+import argparse
+import asyncio
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+LAYOUTS = {
+    "uvicorn (1 процесс)": ["uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", "{port}", "--log-level", "warning"],
+    "app.serve": [sys.executable, "-m", "app.serve", "--host", "127.0.0.1", "--port", "{port}", "--log-level", "warning"],
+}
+
+
+async def _wait_ready(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"Сервер {url} не поднялся за {timeout} с")
+
+
+async def _load(base_url: str, args) -> list[float]:
+    latencies: list[float] = []
+    deadline = time.monotonic() + args.duration
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        async def worker():
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                await client.request(args.method, args.path, content=args.body)
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return latencies
+
+
+def run_layout(name: str, command: list[str], args) -> dict:
+    port = str(args.port)
+    proc = subprocess.Popen([part.replace("{port}", port) for part in command], env=os.environ.copy())
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        asyncio.run(_wait_ready(base_url + "/"))
+        latencies = sorted(asyncio.run(_load(base_url, args)))
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=30)
+    return {
+        "layout": name,
+        "rps": len(latencies) / args.duration,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--method", default="GET")
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--body", default=None)
+    args = parser.parse_args()
+
+    print(f"{'вариант':<22}{'RPS':>10}{'p50, мс':>10}{'p99, мс':>10}")
+    for name, command in LAYOUTS.items():
+        result = run_layout(name, command, args)
+        print(f"{result['layout']:<22}{result['rps']:>10.0f}{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
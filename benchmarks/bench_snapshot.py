@@ -0,0 +1,93 @@
+'''
+Память и латентность снимка зарплат против запроса к БД на каждый вызов.
+
+    python benchmarks/bench_snapshot.py --users 1000000
+
+Снимок заполняется синтетическими строками; для сравнения те же данные
+кладутся в файл SQLite и читаются через SalaryDAO.find_salary_by_user_id,
+как это делает /salary/me/ без снимка (на Postgres добавится сетевой RTT).
+'''
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import app.dao.base as base_dao
+import app.salary.dao as salary_dao
+from app.dao.base import Base
+from app.salary.models import Salary
+from app.salary.snapshot import SalarySnapshot
+from app.users.models import User
+
+
+def bench_snapshot_memory(users: int) -> SalarySnapshot:
+    rnd = random.Random(42)
+    today = date.today()
+    tracemalloc.start()
+    snapshot = SalarySnapshot()
+    for user_id in range(1, users + 1):
+        snapshot.upsert(user_id, user_id, rnd.randint(50_000, 300_000), today + timedelta(days=rnd.randint(1, 180)))
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"снимок: {users} пользователей, {current / 2**20:.1f} МБ "
+          f"({current / users:.1f} байт на пользователя)")
+    return snapshot
+
+
+def bench_snapshot_lookup(snapshot: SalarySnapshot, users: int, lookups: int) -> None:
+    snapshot.refreshed_at = time.monotonic()
+    ids = [random.randint(1, users) for _ in range(lookups)]
+    start = time.perf_counter()
+    for user_id in ids:
+        snapshot.get(user_id)
+    elapsed = time.perf_counter() - start
+    print(f"снимок: {elapsed / lookups * 1e6:.2f} мкс на чтение")
+
+
+async def bench_db_lookup(users: int, lookups: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp}/bench.db")
+        session_maker = async_sessionmaker(engine, expire_on_commit=False)
+        base_dao.async_session_maker = session_maker
+        salary_dao.async_session_maker = session_maker
+
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(insert(User), [
+                {"id": i, "email": f"u{i}@example.com", "password": "x"} for i in range(1, users + 1)
+            ])
+            await conn.execute(insert(Salary), [{"user_id": i, "amount": 80000} for i in range(1, users + 1)])
+
+        ids = [random.randint(1, users) for _ in range(lookups)]
+        start = time.perf_counter()
+        for user_id in ids:
+            await salary_dao.SalaryDAO.find_salary_by_user_id(user_id)
+        elapsed = time.perf_counter() - start
+        print(f"SQLite, запрос на вызов: {elapsed / lookups * 1e6:.0f} мкс на чтение")
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--db-users", type=int, default=100_000)
+    parser.add_argument("--lookups", type=int, default=5_000)
+    args = parser.parse_args()
+
+    snapshot = bench_snapshot_memory(args.users)
+    bench_snapshot_lookup(snapshot, args.users, args.lookups * 100)
+    asyncio.run(bench_db_lookup(args.db_users, args.lookups))
+
+
+if __name__ == "__main__":
+    main()
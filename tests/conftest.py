@@ -1,3 +1,5 @@
+from contextlib import asynccontextmanager, contextmanager
+
 import pytest
 
 from httpx import AsyncClient
@@ -15,18 +17,50 @@ engine = create_async_engine(
 )
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
+from app.monitoring.loop import detect_blocking
+from app.monitoring.sql import collect_queries, install_query_instrumentation
+
+install_query_instrumentation(engine)
+
 # Патчим модули, которые используют старые sessionmaker
 import app.database as database
 import app.dao.base as base_dao
+import app.dao.invalidation as invalidation
 
 database.engine = engine
 database.async_session_maker = async_session_maker
 base_dao.async_session_maker = async_session_maker
+invalidation.engine = engine
+invalidation.async_session_maker = async_session_maker
 
 # Импортируем только после патчинга
 from app.main import app
 from app.dao.base import Base
 
+def pytest_addoption(parser):
+    parser.addoption(
+        "--loop-block-ms", type=float, default=0,
+        help="падать, если шаг корутины или callback блокирует event loop дольше N мс (0 — выключено)",
+    )
+
+
+@pytest.fixture(autouse=True)
+async def fail_on_loop_block(request):
+    """
+    С --loop-block-ms=N тест падает, если код приложения держал event loop
+    дольше N мс (отладочный режим asyncio, см. app.monitoring.loop).
+    Тесты, блокирующие loop намеренно, помечаются @pytest.mark.blocks_loop.
+    """
+    limit = request.config.getoption("--loop-block-ms")
+    if not limit or request.node.get_closest_marker("blocks_loop"):
+        yield
+        return
+    async with detect_blocking(limit) as blocks:
+        yield
+    if blocks:
+        pytest.fail(f"Event loop заблокирован дольше {limit:g} мс:\n" + "\n".join(blocks), pytrace=False)
+
+
 @pytest.fixture(scope="session")
 def anyio_backend():
     return 'asyncio'
@@ -75,3 +109,38 @@ async def user_token() -> str:
 
         token = resp.cookies.get("users_access_token")
     return token
+
+
+@pytest.fixture
+def assert_max_queries():
+    """
+    Хелпер для ограничения числа SQL-запросов в блоке:
+
+        with assert_max_queries(2):
+            await client.get("/salary/me/")
+    """
+    @contextmanager
+    def _assert_max_queries(limit: int):
+        with collect_queries() as stats:
+            yield stats
+        assert stats.count <= limit, (
+            f"Выполнено {stats.count} SQL-запросов, допустимо {limit}: "
+            + "; ".join(stats.shapes)
+        )
+    return _assert_max_queries
+
+
+@pytest.fixture
+def assert_no_loop_blocks():
+    """
+    Хелпер: блок не должен держать event loop дольше limit_ms мс
+
+        async with assert_no_loop_blocks(50):
+            await client.post("/auth/login/", json=...)
+    """
+    @asynccontextmanager
+    async def _assert_no_loop_blocks(limit_ms: float):
+        async with detect_blocking(limit_ms) as blocks:
+            yield blocks
+        assert not blocks, f"Event loop заблокирован дольше {limit_ms:g} мс: " + "; ".join(blocks)
+    return _assert_no_loop_blocks
@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+from httpx import AsyncClient
+
+from app import admission
+from app.admission import ConcurrencyLimiter, route_class
+from app.config import settings
+from app.salary.dao import SalaryDAO
+
+
+class TestConcurrencyLimiter:
+    async def test_bounded_queue(self):
+        '''Сверх лимита запросы ждут в очереди, при полной очереди — сразу отказ.'''
+        limiter = ConcurrencyLimiter("test", limit=1, queue_size=1)
+        assert await limiter.acquire(1.0) is None
+
+        waiting = asyncio.create_task(limiter.acquire(1.0))
+        await asyncio.sleep(0)
+        assert await limiter.acquire(1.0) == "queue_full"
+
+        limiter.release()
+        assert await waiting is None
+        assert limiter.active == 1
+
+    async def test_wait_timeout(self):
+        '''Не дождавшийся слота запрос получает отказ, слот не теряется.'''
+        limiter = ConcurrencyLimiter("test", limit=1, queue_size=10)
+        await limiter.acquire(1.0)
+        assert await limiter.acquire(0.01) == "timeout"
+        limiter.release()
+        assert limiter.active == 0
+        assert await limiter.acquire(0.01) is None
+
+
+class TestAdmissionMiddleware:
+    async def test_shed_with_retry_after(self, client: AsyncClient, user_token: str, monkeypatch):
+        '''Без свободных слотов запрос быстро получает 503 с Retry-After.'''
+        monkeypatch.setattr(route_class("/salary/me/").limiter, "limit", 0)
+        monkeypatch.setattr(settings, "ADMISSION_QUEUE_TIMEOUT", 0.01)
+        resp = await client.get("/salary/me/", headers={"Cookie": f"users_access_token={user_token}"})
+        assert resp.status_code == 503
+        assert resp.headers["retry-after"] == str(settings.ADMISSION_RETRY_AFTER)
+
+    async def test_deadline_cancels_request(self, client: AsyncClient, user_token: str, monkeypatch):
+        '''Запрос, не уложившийся в дедлайн, отменяется и отвечает 503, не дожидаясь БД.'''
+        cancelled = asyncio.Event()
+
+        async def slow_load(user_id):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        monkeypatch.setattr(SalaryDAO, "load_by_user_id", slow_load)
+        monkeypatch.setattr(route_class("/salary/me/"), "deadline", 0.1)
+        started = time.monotonic()
+        resp = await client.get("/salary/me/", headers={"Cookie": f"users_access_token={user_token}"})
+        assert resp.status_code == 503
+        assert time.monotonic() - started < 2
+        assert cancelled.is_set()
+
+    def test_statement_timeout_from_deadline(self):
+        '''На Postgres транзакция получает statement_timeout по остатку дедлайна.'''
+        executed = []
+
+        class Connection:
+            class dialect:
+                name = "postgresql"
+
+            def exec_driver_sql(self, sql):
+                executed.append(sql)
+
+        admission._set_statement_timeout(None, None, Connection())
+        assert executed == []  # вне запроса дедлайна нет
+
+        token = admission._deadline.set(time.monotonic() + 2)
+        try:
+            admission._set_statement_timeout(None, None, Connection())
+        finally:
+            admission._deadline.reset(token)
+        timeout_ms = int(executed[0].rsplit(" ", 1)[1])
+        assert executed[0].startswith("SET LOCAL statement_timeout") and 1500 < timeout_ms <= 2000
+
+    def test_monitoring_exempt(self):
+        '''Мониторинг не ограничивается, выгрузки не получают дедлайна.'''
+        assert route_class("/metrics") is None
+        assert route_class("/admin/export/payroll").deadline == 0
+        assert route_class("/auth/login/").name == "auth"
+
+    def test_writes_are_classified_by_method(self):
+        '''Изменяющие запросы вне auth/batch попадают в класс write, а не read.'''
+        assert route_class("/users/me/", "GET").name == "read"
+        write = route_class("/users/update/me", "PATCH")
+        assert write.name == "write"
+        assert write.deadline == settings.REQUEST_WRITE_DEADLINE
+        assert route_class("/users/delete/me", "DELETE").name == "write"
+        assert route_class("/auth/register/", "POST").name == "auth"
+        assert route_class("/admin/users/bulk", "POST").name == "batch"
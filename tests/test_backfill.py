@@ -0,0 +1,142 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+from alembic.operations import Operations
+from alembic.runtime.migration import MigrationContext
+from sqlalchemy import create_engine, func, insert, inspect, select
+
+from app.dao.base import Base
+from app.dao.sharding import directory_metadata, user_shards
+from app.migration.backfill import Backfill, backfill_checkpoints
+from app.salary.models import Salary
+from app.users.models import User
+
+VERSIONS = Path(__file__).parent.parent / "app/migration/versions"
+
+
+def load_migration(filename: str = "bb6a89e2d747_backfill_salary.py"):
+    spec = importlib.util.spec_from_file_location(filename.removesuffix(".py"), VERSIONS / filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def sync_engine(tmp_path):
+    '''Синхронный engine на файле SQLite: пачки переноса идут на отдельных соединениях.'''
+    engine = create_engine(f"sqlite:///{tmp_path}/backfill.db")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {"id": i, "email": f"u{i}@example.com", "password": "x"} for i in range(1, 11)
+        ])
+        conn.execute(insert(Salary), [{"user_id": 3, "amount": 150000}])
+    yield engine
+    engine.dispose()
+
+
+def run_migration(engine, upgrade):
+    '''Выполняет upgrade так же, как env.py: в транзакции на ревизию.'''
+    with engine.connect() as conn:
+        migration_context = MigrationContext.configure(conn, opts={"transaction_per_migration": True})
+        with Operations.context(migration_context), migration_context.begin_transaction(_per_migration=True):
+            return upgrade()
+
+
+class TestBackfill:
+    def test_batches_and_checkpoint(self, sync_engine):
+        '''Строки обходятся пачками по ключу, прогресс записывается в контрольную точку.'''
+        batches = []
+
+        def process_batch(conn, after_key, last_key):
+            batches.append((after_key, last_key))
+            return last_key - after_key
+
+        backfill = Backfill("test", "users", batch_size=4, pause=0)
+        assert run_migration(sync_engine, lambda: backfill.run(process_batch)) == 10
+        assert batches == [(0, 4), (4, 8), (8, 10)]
+
+        with sync_engine.connect() as conn:
+            checkpoint = conn.execute(select(backfill_checkpoints)).one()
+        assert (checkpoint.last_key, checkpoint.rows_done, checkpoint.finished) == (10, 10, True)
+
+        # завершённый перенос повторно не выполняется
+        assert run_migration(sync_engine, lambda: backfill.run(process_batch)) == 10
+        assert len(batches) == 3
+
+    def test_resume_after_failure(self, sync_engine):
+        '''После падения перенос продолжается с последней закоммиченной пачки.'''
+        batches = []
+
+        def failing(conn, after_key, last_key):
+            if after_key >= 4:
+                raise RuntimeError("обрыв соединения")
+            batches.append(after_key)
+            return last_key - after_key
+
+        backfill = Backfill("resume", "users", batch_size=4, pause=0)
+        with pytest.raises(RuntimeError):
+            run_migration(sync_engine, lambda: backfill.run(failing))
+
+        def process_batch(conn, after_key, last_key):
+            batches.append(after_key)
+            return last_key - after_key
+
+        assert run_migration(sync_engine, lambda: backfill.run(process_batch)) == 10
+        assert batches == [0, 4, 8]
+
+    def test_salary_migration(self, sync_engine):
+        '''Ревизия bb6a89e2d747 создаёт зарплату только пользователям без неё.'''
+        run_migration(sync_engine, load_migration().upgrade)
+
+        with sync_engine.connect() as conn:
+            rows = dict(conn.execute(select(Salary.user_id, Salary.amount)).all())
+            assert conn.scalar(select(func.count()).select_from(Salary)) == 10
+        assert rows[3] == 150000
+        assert rows[1] == 80000
+        assert "ix_salary_user_id" in {ix["name"] for ix in inspect(sync_engine).get_indexes("salary")}
+
+    def test_lower_email_migration(self, sync_engine):
+        '''
+        Ревизия f1a7c3e9b5d2 приводит email к нижнему регистру в users и каталоге
+        шардов, а адреса, совпадающие без учёта регистра с существующим или друг
+        с другом (в одной пачке), не трогает.
+        '''
+        directory_metadata.create_all(sync_engine)
+        with sync_engine.begin() as conn:
+            conn.execute(insert(User), [
+                {"id": 11, "email": "Mixed@Example.com", "password": "x"},
+                {"id": 12, "email": "U1@example.com", "password": "x"},
+                {"id": 13, "email": "Twin@Example.com", "password": "x"},
+                {"id": 14, "email": "twin@EXAMPLE.com", "password": "x"},
+            ])
+
+        run_migration(sync_engine, load_migration("f1a7c3e9b5d2_users_login_index.py").upgrade)
+
+        with sync_engine.connect() as conn:
+            emails = dict(conn.execute(select(User.id, User.email)).all())
+        assert emails[11] == "mixed@example.com"
+        assert emails[12] == "U1@example.com"
+        assert emails[1] == "u1@example.com"
+        assert (emails[13], emails[14]) == ("Twin@Example.com", "twin@EXAMPLE.com")
+
+    def test_lower_email_migration_sharded_directory(self, sync_engine):
+        '''
+        На основной БД при шардировании users пуст: каталог приводится
+        к нижнему регистру по своему диапазону ключей.
+        '''
+        directory_metadata.create_all(sync_engine)
+        with sync_engine.begin() as conn:
+            conn.execute(User.__table__.delete())
+            conn.execute(insert(user_shards), [
+                {"user_id": 101, "email": "Mixed@Example.com", "shard": "a"},
+                {"user_id": 102, "email": "Twin@Example.com", "shard": "a"},
+                {"user_id": 103, "email": "TWIN@example.com", "shard": "b"},
+            ])
+
+        run_migration(sync_engine, load_migration("f1a7c3e9b5d2_users_login_index.py").upgrade)
+
+        with sync_engine.connect() as conn:
+            emails = dict(conn.execute(select(user_shards.c.user_id, user_shards.c.email)).all())
+        assert emails == {101: "mixed@example.com", 102: "Twin@Example.com", 103: "TWIN@example.com"}
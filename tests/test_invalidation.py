@@ -0,0 +1,74 @@
+from app.config import settings
+from app.dao.invalidation import InvalidationBus, invalidation_bus, log_metadata
+from app.salary.dao import SalaryDAO
+from app.salary.snapshot import salary_snapshot
+from app.users.dao import UserDAO
+
+from app import database
+
+
+class TestInvalidationBus:
+    async def test_local_dispatch_after_update(self, user_token: str):
+        '''Изменение через DAO сразу вытесняет ключ у подписчиков процесса.'''
+        user = await UserDAO.find_one_or_none(email="test@example.com")
+        events = []
+        invalidation_bus.subscribe("salary", lambda key, updated_at: events.append(key))
+        try:
+            await SalaryDAO.update({"user_id": user.id}, amount=90000)
+        finally:
+            invalidation_bus.clear()
+        assert events == [user.id]
+
+    async def test_polling_fallback_delivers_events(self, user_token: str, monkeypatch):
+        '''В SQLite события другого воркера приходят через журнал.'''
+        monkeypatch.setattr(settings, "INVALIDATION_BUS_ENABLED", True)
+        async with database.engine.begin() as conn:
+            await conn.run_sync(log_metadata.drop_all)
+            await conn.run_sync(log_metadata.create_all)
+
+        other_worker = InvalidationBus()
+        events = []
+        other_worker.subscribe("users", lambda key, updated_at: events.append(("users", key)))
+        other_worker.subscribe("salary", lambda key, updated_at: events.append(("salary", key)))
+
+        user = await UserDAO.find_one_or_none(email="test@example.com")
+        await UserDAO.delete_user_by_id(user.id)
+        await other_worker.poll_once()
+        assert events == [("users", user.id), ("salary", user.id)]
+
+        # повторный опрос не доставляет те же события снова
+        await other_worker.poll_once()
+        assert len(events) == 2
+
+    async def test_snapshot_evicted_on_salary_change(self, user_token: str):
+        '''Снимок зарплат не отдаёт запись, изменённую после загрузки.'''
+        salary_snapshot.subscribe_to_invalidation(invalidation_bus)
+        try:
+            await salary_snapshot.load()
+            user = await UserDAO.find_one_or_none(email="test@example.com")
+            assert salary_snapshot.get(user.id) is not None
+            await SalaryDAO.update({"user_id": user.id}, amount=95000)
+            assert salary_snapshot.get(user.id) is None
+        finally:
+            invalidation_bus.clear()
+            salary_snapshot._reset()
+
+    async def test_snapshot_kept_on_profile_change(self, user_token: str):
+        '''
+        Правка профиля не вытесняет зарплату: строка salary не менялась
+        и опросом в снимок не вернулась бы. Мягкое удаление — вытесняет.
+        '''
+        salary_snapshot.subscribe_to_invalidation(invalidation_bus)
+        try:
+            await salary_snapshot.load()
+            user = await UserDAO.find_one_or_none(email="test@example.com")
+            await UserDAO.update({"id": user.id}, first_name="Новое")
+            assert salary_snapshot.get(user.id) is not None
+            assert salary_snapshot.stats.count == 1
+
+            await UserDAO.delete_user_by_id(user.id)
+            assert salary_snapshot.get(user.id) is None
+            assert salary_snapshot.stats.count == 0
+        finally:
+            invalidation_bus.clear()
+            salary_snapshot._reset()
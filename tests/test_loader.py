@@ -0,0 +1,164 @@
+import asyncio
+import contextvars
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+
+from app import admission
+from app.dao.loader import BatchLoader
+from app.salary.dao import SalaryDAO
+from app.users.dao import UserDAO
+from app.users.schemas import SUserRead
+
+
+class TestBatchLoader:
+    async def test_concurrent_loads_are_batched_and_deduplicated(self):
+        '''Ключи одного тика уходят одной пачкой, повторяющиеся — один раз.'''
+        calls = []
+
+        async def batch_fn(keys):
+            calls.append(keys)
+            return {key: key * 10 for key in keys if key != 3}
+
+        loader = BatchLoader(batch_fn)
+        results = await asyncio.gather(*(loader.load(key) for key in [1, 2, 2, 3, 1]))
+        assert results == [10, 20, 20, None, 10]
+        assert calls == [[1, 2, 3]]
+
+    async def test_max_batch_size_splits_batches(self):
+        '''Пачка отправляется сразу по достижении максимального размера.'''
+        calls = []
+
+        async def batch_fn(keys):
+            calls.append(keys)
+            return {key: key for key in keys}
+
+        loader = BatchLoader(batch_fn, max_batch_size=2)
+        await asyncio.gather(*(loader.load(key) for key in range(5)))
+        assert [len(keys) for keys in calls] == [2, 2, 1]
+
+    async def test_error_propagates_to_all_waiters(self):
+        '''Ошибка загрузки пачки получает каждый ожидающий.'''
+        async def batch_fn(keys):
+            raise RuntimeError("db down")
+
+        loader = BatchLoader(batch_fn)
+        results = await asyncio.gather(loader.load(1), loader.load(2), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+    async def test_batch_runs_outside_caller_context(self):
+        '''
+        Пачка не видит contextvars запроса, который её запланировал:
+        его счётчики SQL, фазы и дедлайн не распространяются на чужие загрузки.
+        '''
+        marker = contextvars.ContextVar("marker", default=None)
+        seen = []
+
+        async def batch_fn(keys):
+            seen.append(marker.get())
+            return {key: key for key in keys}
+
+        async def load_as(request, key):
+            marker.set(request)
+            return await loader.load(key)
+
+        loader = BatchLoader(batch_fn)
+        assert await asyncio.gather(load_as("first", 1), load_as("second", 2)) == [1, 2]
+        assert seen == [None]
+
+    async def test_batch_gets_latest_deadline_of_waiters(self):
+        '''Пачка выполняется под самым поздним дедлайном ожидающих; без дедлайна у кого-то — без него.'''
+        seen = []
+
+        async def batch_fn(keys):
+            seen.append(admission.current_deadline())
+            return {key: key for key in keys}
+
+        async def load_by(deadline, key):
+            admission.set_deadline(deadline)
+            return await loader.load(key)
+
+        loader = BatchLoader(batch_fn)
+        now = time.monotonic()
+        assert await asyncio.gather(load_by(now + 1, 1), load_by(now + 5, 2), load_by(now + 3, 1)) == [1, 2, 1]
+        assert await asyncio.gather(load_by(now + 1, 1), load_by(None, 2)) == [1, 2]
+        assert seen == [now + 5, None]
+
+    async def test_batched_query_gets_statement_timeout(self, user_token: str):
+        '''Транзакция пакетного UserDAO.load_by_id получает statement_timeout по дедлайну запросов.'''
+        user = await UserDAO.find_one_or_none(email="test@example.com")
+        executed = []
+
+        class Connection:
+            class dialect:
+                name = "postgresql"
+
+            def exec_driver_sql(self, sql):
+                executed.append(sql)
+
+        def as_postgres(session, transaction, connection):
+            admission._set_statement_timeout(session, transaction, Connection())
+
+        async def load_within(seconds):
+            admission.set_deadline(time.monotonic() + seconds)
+            return await UserDAO.load_by_id(user.id)
+
+        event.listen(Session, "after_begin", as_postgres)
+        try:
+            await asyncio.gather(load_within(1), load_within(2))
+        finally:
+            event.remove(Session, "after_begin", as_postgres)
+        timeout_ms = int(executed[0].rsplit(" ", 1)[1])
+        assert executed[0].startswith("SET LOCAL statement_timeout") and 1500 < timeout_ms <= 2000
+
+    async def test_dao_loaders_share_one_query(self, user_token: str, monkeypatch):
+        '''Параллельные выборки пользователя и зарплаты — по одному запросу на таблицу.'''
+        user = await UserDAO.find_one_or_none(email="test@example.com")
+        calls = []
+
+        def counting(dao):
+            read_many_by = dao.read_many_by
+
+            async def wrapper(*args, **kwargs):
+                calls.append(dao.__name__)
+                return await read_many_by(*args, **kwargs)
+            return wrapper
+
+        monkeypatch.setattr(UserDAO, "read_many_by", counting(UserDAO))
+        monkeypatch.setattr(SalaryDAO, "read_many_by", counting(SalaryDAO))
+        users = await asyncio.gather(*(UserDAO.load_by_id(user.id) for _ in range(10)))
+        salaries = await asyncio.gather(
+            *(SalaryDAO.load_by_user_id(user.id) for _ in range(10)),
+            SalaryDAO.load_by_user_id(user.id + 1000),
+        )
+        assert calls == ["UserDAO", "SalaryDAO"]
+        assert all(u.email == "test@example.com" for u in users)
+        assert all(s.user_id == user.id for s in salaries[:-1])
+        assert salaries[-1] is None
+
+
+class TestCoreReads:
+    async def test_read_one_returns_rows_without_orm(self, user_token: str):
+        '''
+        Быстрое чтение возвращает строки Row с read_columns (без хеша пароля),
+        которые валидируются схемой ответа так же, как объекты ORM.
+        '''
+        user = await UserDAO.find_one_or_none(email="test@example.com")
+        row = await UserDAO.read_one(id=user.id)
+        assert isinstance(row, Row)
+        assert row.email == "test@example.com"
+        assert "password" not in row._fields
+        assert SUserRead.model_validate(row) == SUserRead.model_validate(user)
+
+        salaries = await SalaryDAO.read_many_by("user_id", [user.id, user.id + 1000], fields=("amount",))
+        assert list(salaries) == [user.id]
+        assert salaries[user.id]._fields == ("amount", "user_id")
+
+    async def test_read_one_hides_soft_deleted(self, user_token: str):
+        '''Мягко удалённые записи не видны и быстрому чтению.'''
+        user = await UserDAO.find_one_or_none(email="test@example.com")
+        await UserDAO.delete_user_by_id(user.id)
+        assert await UserDAO.read_one(id=user.id) is None
+        assert await UserDAO.read_many_by("id", [user.id]) == {}
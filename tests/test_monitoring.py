@@ -0,0 +1,341 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+import pytest
+
+from httpx import AsyncClient
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from app import database
+from app.config import settings
+from app.monitoring.loop import LOOP_BLOCKS, LOOP_LAG, LoopMonitor
+from app.monitoring.metrics import Registry
+from app.monitoring import profiler as profiler_module
+from app.monitoring.profiler import SamplingProfiler, sign_profile_request
+from app.monitoring.sql import statement_shape
+from app.monitoring.timing import current_phases, timed_phase
+from app.salary.schemas import SSalary
+
+
+class TestServerTiming:
+    async def test_header_disabled_by_default(self, client: AsyncClient, user_token: str):
+        '''Без включённой настройки заголовок Server-Timing не добавляется.'''
+        resp = await client.get(
+            "/salary/me/",
+            headers={"Cookie": f"users_access_token={user_token}"}
+        )
+        assert resp.status_code == 200
+        assert "server-timing" not in resp.headers
+
+    async def test_header_contains_phases(self, client: AsyncClient, user_token: str, monkeypatch):
+        '''Проверяет разбивку запроса /salary/me/ на фазы auth, db и serialize.'''
+        monkeypatch.setattr(settings, "SERVER_TIMING_ENABLED", True)
+        resp = await client.get(
+            "/salary/me/",
+            headers={"Cookie": f"users_access_token={user_token}"}
+        )
+        assert resp.status_code == 200
+        header = resp.headers["server-timing"]
+        for name in ("auth;dur=", "db;dur=", "serialize;dur=", "total;dur="):
+            assert name in header
+
+    async def test_serialize_covers_response_body(self, client: AsyncClient, user_token: str, monkeypatch):
+        '''Сборка JSON-тела ответа попадает в фазу serialize, а не только в total.'''
+        monkeypatch.setattr(settings, "SERVER_TIMING_ENABLED", True)
+        dump_json = SSalary.model_dump_json
+
+        def slow_dump_json(self, *args, **kwargs):
+            time.sleep(0.05)
+            return dump_json(self, *args, **kwargs)
+
+        monkeypatch.setattr(SSalary, "model_dump_json", slow_dump_json)
+        resp = await client.get(
+            "/salary/me/",
+            headers={"Cookie": f"users_access_token={user_token}"}
+        )
+        assert resp.status_code == 200
+        assert resp.json()["amount"]
+        phases = dict(part.split(";dur=") for part in resp.headers["server-timing"].split(", "))
+        assert float(phases["serialize"]) >= 50
+
+    async def test_access_log(self, client: AsyncClient, user_token: str, monkeypatch, caplog):
+        '''Проверяет, что access-лог содержит статус и фазы запроса.'''
+        monkeypatch.setattr(settings, "ACCESS_LOG_ENABLED", True)
+        with caplog.at_level(logging.INFO, logger="app.access"):
+            await client.get(
+                "/salary/me/",
+                headers={"Cookie": f"users_access_token={user_token}"}
+            )
+        record = next(r for r in caplog.records if r.name == "app.access")
+        assert '"status": 200' in record.getMessage()
+        assert '"db"' in record.getMessage()
+
+    def test_phase_without_request_is_noop(self):
+        '''Вне запроса замер фаз ничего не накапливает.'''
+        with timed_phase("db"):
+            pass
+        assert current_phases() is None
+
+
+class TestQueryInstrumentation:
+    async def test_salary_me_query_budget(self, client: AsyncClient, user_token: str, assert_max_queries):
+        '''/salary/me/ укладывается в два запроса: пользователь и зарплата.'''
+        with assert_max_queries(2):
+            resp = await client.get(
+                "/salary/me/",
+                headers={"Cookie": f"users_access_token={user_token}"}
+            )
+        assert resp.status_code == 200
+
+    async def test_query_budget_exceeded(self, client: AsyncClient, user_token: str, assert_max_queries):
+        '''Хелпер падает, если запросов больше допустимого.'''
+        with pytest.raises(AssertionError):
+            with assert_max_queries(1):
+                await client.get(
+                    "/salary/me/",
+                    headers={"Cookie": f"users_access_token={user_token}"}
+                )
+
+    async def test_n_plus_one_warning(self, client: AsyncClient, user_token: str, monkeypatch, caplog):
+        '''Повторяющиеся запросы одной формы попадают в лог как вероятный N+1.'''
+        monkeypatch.setattr(settings, "SQL_STATS_ENABLED", True)
+        monkeypatch.setattr(settings, "SQL_N_PLUS_ONE_THRESHOLD", 2)
+        with caplog.at_level(logging.WARNING, logger="app.sql"):
+            await client.patch(
+                "/users/update/me",
+                headers={"Cookie": f"users_access_token={user_token}"},
+                json={"first_name": "Новое"}
+            )
+        assert any("N+1" in r.getMessage() for r in caplog.records)
+
+    async def test_slow_query_parameters_redacted(self, client: AsyncClient, monkeypatch, caplog):
+        '''Лог медленных запросов не содержит значений параметров.'''
+        monkeypatch.setattr(settings, "SQL_SLOW_QUERY_MS", 1e-9)
+        with caplog.at_level(logging.WARNING, logger="app.sql"):
+            await client.post(
+                "/auth/login/",
+                json={"email": "secret@example.com", "password": "password123"}
+            )
+        messages = [r.getMessage() for r in caplog.records if r.name == "app.sql"]
+        assert messages
+        assert not any("secret@example.com" in m for m in messages)
+
+    async def test_failed_statement_does_not_leak_start_time(self):
+        '''Ошибка выражения не оставляет отметку времени в info соединения из пула.'''
+        async with database.engine.connect() as conn:
+            with pytest.raises(DBAPIError):
+                await conn.execute(text("SELECT * FROM no_such_table"))
+            info = (await conn.get_raw_connection()).info
+            assert not info.get("query_start_time")
+
+    def test_statement_shape(self):
+        '''Запросы с разными списками IN и литералами имеют одну форму.'''
+        assert statement_shape("SELECT * FROM users WHERE id IN (?, ?, ?) LIMIT 10") == \
+            statement_shape("SELECT *  FROM users\nWHERE id IN (?) LIMIT 20")
+
+
+class TestMetrics:
+    async def test_metrics_endpoint(self, client: AsyncClient, user_token: str, monkeypatch):
+        '''Проверяет формат /metrics и метки по шаблону маршрута.'''
+        monkeypatch.setattr(settings, "ADMIN_TOKEN", "admin-secret")
+        for _ in range(2):
+            await client.get(
+                "/salary/me/",
+                headers={"Cookie": f"users_access_token={user_token}"}
+            )
+        resp = await client.get("/metrics", headers={"X-Admin-Token": "admin-secret"})
+        assert resp.status_code == 200
+        body = resp.text
+        assert "# TYPE http_requests_total counter" in body
+        assert 'http_requests_total{method="GET",route="/salary/me/",status="200"}' in body
+        assert 'http_request_duration_seconds_bucket{method="GET",route="/salary/me/",le="+Inf"}' in body
+        assert "http_requests_in_progress" in body
+        assert "bcrypt_executor_queue_depth" in body
+
+    async def test_metrics_require_admin(self, client: AsyncClient, monkeypatch):
+        '''Без токена администратора метрики не отдаются.'''
+        monkeypatch.setattr(settings, "ADMIN_TOKEN", "admin-secret")
+        assert (await client.get("/metrics")).status_code == 403
+        resp = await client.get("/metrics", headers={"X-Admin-Token": "wrong"})
+        assert resp.status_code == 403
+
+    def test_multiprocess_merge(self, tmp_path, monkeypatch):
+        '''Счётчики и гистограммы суммируются по снимкам всех воркеров.'''
+        registry = Registry()
+        counter = registry.counter("jobs", "Задачи", ("kind",))
+        histogram = registry.histogram("latency_seconds", "Латентность", buckets=(0.1, 1.0))
+        counter.inc(kind="a")
+        histogram.observe(0.05)
+        registry.write_snapshot(str(tmp_path))
+
+        # снимок «другого» воркера, уже завершившегося
+        other = registry.dump()
+        (tmp_path / "999999999.json").write_text(
+            json.dumps({"pid": 999999999, "time": 0, "metrics": other})
+        )
+
+        monkeypatch.setattr(settings, "METRICS_MULTIPROC_DIR", str(tmp_path))
+        body = registry.render()
+        assert 'jobs_total{kind="a"} 2' in body
+        assert 'latency_seconds_bucket{le="0.1"} 2' in body
+        assert "latency_seconds_count 2" in body
+
+    def test_reused_pid_archives_previous_totals(self, tmp_path, monkeypatch):
+        '''Новый воркер с pid завершённого не затирает его счётчики: они уходят в архив.'''
+        previous = Registry()
+        previous.counter("jobs", "Задачи").inc(5)
+        previous.gauge("queue", "Очередь").set(7)
+        # файл прежнего процесса с тем же pid
+        (tmp_path / f"{os.getpid()}.json").write_text(
+            json.dumps({"pid": os.getpid(), "instance": "old", "time": 0, "metrics": previous.dump()})
+        )
+
+        registry = Registry()
+        counter = registry.counter("jobs", "Задачи")
+        registry.gauge("queue", "Очередь").set(1)
+        counter.inc()
+        monkeypatch.setattr(settings, "METRICS_MULTIPROC_DIR", str(tmp_path))
+        body = registry.render()
+        assert "jobs_total 6" in body
+        assert "queue 1" in body
+        archive = json.loads((tmp_path / "archive.json").read_text())
+        assert set(archive["metrics"]) == {"jobs_total"}
+
+        # повторные записи того же процесса архив не пополняют
+        counter.inc()
+        assert "jobs_total 7" in registry.render()
+
+
+class TestProfiler:
+    async def test_disabled_by_default(self, client: AsyncClient):
+        '''Без PROFILER_ENABLED заголовок профилирования игнорируется.'''
+        resp = await client.get("/", headers={"X-Debug-Profile": "1"})
+        assert resp.status_code == 200
+        assert "x-profile-id" not in resp.headers
+
+    async def test_admin_header_profiles_request(self, client: AsyncClient, monkeypatch):
+        '''Запрос с X-Debug-Profile и токеном администратора профилируется.'''
+        monkeypatch.setattr(settings, "PROFILER_ENABLED", True)
+        monkeypatch.setattr(settings, "ADMIN_TOKEN", "admin-secret")
+        admin = {"X-Admin-Token": "admin-secret"}
+
+        resp = await client.get("/", headers={"X-Debug-Profile": "1", **admin})
+        profile_id = resp.headers["x-profile-id"]
+
+        resp = await client.get(f"/debug/profiles/{profile_id}", headers=admin)
+        assert resp.status_code == 200
+
+        resp = await client.get("/", headers={"X-Debug-Profile": "1", "X-Admin-Token": "wrong"})
+        assert "x-profile-id" not in resp.headers
+
+    async def test_signed_query_flag(self, client: AsyncClient, monkeypatch):
+        '''Флаг ?__profile= работает только с верной подписью пути.'''
+        monkeypatch.setattr(settings, "PROFILER_ENABLED", True)
+        resp = await client.get("/", params={"__profile": sign_profile_request("/")})
+        assert "x-profile-id" in resp.headers
+
+        resp = await client.get("/", params={"__profile": "bad"})
+        assert "x-profile-id" not in resp.headers
+
+        resp = await client.get("/", params={"__profile": sign_profile_request("/other")})
+        assert "x-profile-id" not in resp.headers
+
+    async def test_signed_query_flag_expires(self, client: AsyncClient, monkeypatch):
+        '''Просроченный или с подменённым сроком флаг ?__profile= не действует.'''
+        monkeypatch.setattr(settings, "PROFILER_ENABLED", True)
+        resp = await client.get("/", params={"__profile": sign_profile_request("/", ttl=-1)})
+        assert "x-profile-id" not in resp.headers
+
+        expires, _, signature = sign_profile_request("/").partition(".")
+        resp = await client.get("/", params={"__profile": f"{int(expires) + 3600}.{signature}"})
+        assert "x-profile-id" not in resp.headers
+
+    async def test_arm_next_requests(self, client: AsyncClient, monkeypatch):
+        '''Взведённый профайлер снимает ровно N следующих запросов.'''
+        monkeypatch.setattr(settings, "PROFILER_ENABLED", True)
+        monkeypatch.setattr(settings, "ADMIN_TOKEN", "admin-secret")
+
+        resp = await client.post("/debug/profile/arm", params={"count": 2})
+        assert resp.status_code == 403
+
+        resp = await client.post(
+            "/debug/profile/arm", params={"count": 2}, headers={"X-Admin-Token": "admin-secret"}
+        )
+        assert resp.status_code == 200
+        ids = [(await client.get("/")).headers.get("x-profile-id") for _ in range(3)]
+        assert ids[0] and ids[1] and ids[2] is None
+
+    async def test_armed_request_not_spent_while_profiler_busy(self, client: AsyncClient, monkeypatch):
+        '''Запрос, не попавший в профиль из-за занятого профайлера, не расходует счётчик.'''
+        monkeypatch.setattr(settings, "PROFILER_ENABLED", True)
+        monkeypatch.setattr(profiler_module, "_armed_requests", 1)
+        with profiler_module._profiler_lock:
+            resp = await client.get("/")
+        assert "x-profile-id" not in resp.headers
+        assert profiler_module._armed_requests == 1
+        assert "x-profile-id" in (await client.get("/")).headers
+        assert profiler_module._armed_requests == 0
+
+    def test_sampling_profiler_collapsed_format(self):
+        '''Профайлер возвращает стеки в формате "кадр;кадр количество".'''
+        profiler = SamplingProfiler(threading.get_ident(), 0.001).start()
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+        collapsed = profiler.stop()
+        assert "test_sampling_profiler_collapsed_format" in collapsed
+        assert collapsed.splitlines()[0].rsplit(" ", 1)[1].isdigit()
+
+
+def _blocking_handler(seconds: float) -> None:
+    # синхронная работа внутри корутины — то, что ищет монитор
+    time.sleep(seconds)
+
+
+@pytest.mark.blocks_loop
+class TestLoopMonitor:
+    async def test_block_captures_stack(self, monkeypatch, caplog):
+        '''
+        Сторож снимает стек во время зависания, пульс пишет задержку
+        в гистограмму; повторное зависание в пределах интервала лога
+        считается, но стек не пишется.
+        '''
+        monkeypatch.setattr(settings, "LOOP_MONITOR_INTERVAL_MS", 10)
+        monkeypatch.setattr(settings, "LOOP_MONITOR_BLOCK_MS", 50)
+        monkeypatch.setattr(settings, "LOOP_MONITOR_LOG_INTERVAL", 60)
+        blocks_before = LOOP_BLOCKS._values.get((), 0)
+        monitor = LoopMonitor()
+        task = monitor.start()
+        try:
+            with caplog.at_level(logging.WARNING, logger="app.loop"):
+                await asyncio.sleep(0.03)
+                _blocking_handler(0.2)
+                await asyncio.sleep(0.03)
+                _blocking_handler(0.2)
+                await asyncio.sleep(0.03)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        [record] = [r for r in caplog.records if r.name == "app.loop"]
+        assert "_blocking_handler" in record.getMessage()
+        assert "test_block_captures_stack" in record.getMessage()
+        assert LOOP_BLOCKS._values[()] - blocks_before == 2
+        assert monitor.suppressed == 1
+        counts, _ = LOOP_LAG._values[()]
+        assert sum(counts[LOOP_LAG.buckets.index(0.1) + 1:]) >= 2
+
+    async def test_assert_no_loop_blocks(self, client: AsyncClient, assert_no_loop_blocks):
+        '''Хелпер пропускает неблокирующий код и падает на блокирующем шаге корутины.'''
+        async with assert_no_loop_blocks(100):
+            await client.get("/")
+            await asyncio.sleep(0.01)
+
+        with pytest.raises(AssertionError, match="заблокирован"):
+            async with assert_no_loop_blocks(20):
+                _blocking_handler(0.05)
@@ -1,9 +1,27 @@
+import csv
+import gzip
+import io
+import json
+
+import asyncio
+from datetime import date, timedelta
+
+import numpy as np
+
 import pytest
 
 from httpx import AsyncClient
+from sqlalchemy import func, select
 
+from app.config import settings
 from app.database import async_session_maker
+from app.salary.audit import salary_audit
+from app.salary.columnar import EPOCH_DAY, ColumnarSnapshot, latest_snapshot, write_snapshot
 from app.salary.dao import SalaryDAO
+from app.salary.models import SalaryView
+from app.salary.projection import NEVER, Payroll, ProjectionOverflow, RaisePolicy, month_starts
+from app.salary.snapshot import salary_snapshot
+from app.salary.stats import SalaryStats
 from app.users.dao import UserDAO
 
 
@@ -57,3 +75,424 @@ class TestSalaryEndpoints:
                 
         resp = await client.get("/salary/me/", headers=token_header)
         assert resp.status_code == 401
+
+
+class TestVersionedUpdates:
+    async def test_bulk_update_returns_only_conflicts(self):
+        '''
+        Массовое обновление применяет строки с актуальной версией и
+        возвращает ключи конфликтующих: повтор затрагивает только их.
+        '''
+        user_ids = await UserDAO.bulk_register_with_salary(
+            [{"email": f"bulk{i}@example.com", "password": "hash"} for i in range(3)]
+        )
+        rows = await SalaryDAO.read_many_by("user_id", user_ids)
+        # конкурирующий писатель успел изменить зарплату первого пользователя
+        await SalaryDAO.update({"user_id": user_ids[0]}, amount=1)
+
+        conflicts = await SalaryDAO.update_versioned(
+            "user_id", [{"user_id": uid, "version": rows[uid].version, "amount": 5000} for uid in user_ids],
+        )
+        assert conflicts == [user_ids[0]]
+
+        fresh = await SalaryDAO.read_many_by("user_id", user_ids)
+        assert [fresh[uid].amount for uid in user_ids] == [1, 5000, 5000]
+        assert await SalaryDAO.update_versioned(
+            "user_id", [{"user_id": user_ids[0], "version": fresh[user_ids[0]].version, "amount": 5000}],
+        ) == []
+
+
+class TestSalarySnapshot:
+    @pytest.fixture
+    async def snapshot(self, user_token: str):
+        '''Загружает снимок зарплат и сбрасывает его после теста.'''
+        await salary_snapshot.load()
+        yield salary_snapshot
+        salary_snapshot._reset()
+
+    async def test_served_from_snapshot(self, client: AsyncClient, user_token: str, snapshot, assert_max_queries):
+        '''Свежий снимок отвечает без запроса к таблице salary.'''
+        with assert_max_queries(1):
+            resp = await client.get(
+                "/salary/me/",
+                headers={"Cookie": f"users_access_token={user_token}"}
+            )
+        assert resp.status_code == 200
+        assert resp.json()["amount"] == 80000
+
+    async def test_stale_snapshot_falls_back_to_db(self, client: AsyncClient, user_token: str, snapshot, monkeypatch):
+        '''Устаревший снимок не используется — ответ берётся из БД.'''
+        user = await UserDAO.find_one_or_none(email="test@example.com")
+        await SalaryDAO.update({"user_id": user.id}, amount=100000)
+        monkeypatch.setattr(settings, "SALARY_SNAPSHOT_MAX_STALENESS", -1)
+
+        resp = await client.get(
+            "/salary/me/",
+            headers={"Cookie": f"users_access_token={user_token}"}
+        )
+        assert resp.json()["amount"] == 100000
+
+    async def test_refresh_picks_up_changes(self, user_token: str, snapshot):
+        '''Инкрементальный опрос подтягивает изменённые строки.'''
+        user = await UserDAO.find_one_or_none(email="test@example.com")
+        await SalaryDAO.update({"user_id": user.id}, amount=120000)
+        await snapshot.refresh()
+        assert snapshot.get(user.id)["amount"] == 120000
+
+        snapshot.evict(user.id)
+        assert snapshot.get(user.id) is None
+
+
+    async def test_reset_during_read_discards_it(self, user_token: str):
+        '''Сброс во время загрузки: дочитанные строки не попадают в снимок, и он не считается свежим.'''
+        salary_snapshot._reset()
+        user = await UserDAO.find_one_or_none(email="test@example.com")
+        task = asyncio.create_task(salary_snapshot.load())
+        await asyncio.sleep(0)  # загрузка ждёт ответа БД
+        salary_snapshot.mark_stale()
+        await task
+        assert not salary_snapshot.is_fresh() and salary_snapshot.last_seen is None
+        assert salary_snapshot.entries() == 0 and salary_snapshot.stats.count == 0
+
+        task = asyncio.create_task(salary_snapshot.rebuild())
+        await asyncio.sleep(0)
+        salary_snapshot.mark_stale()
+        await task
+        assert salary_snapshot.get(user.id) is None
+
+        await salary_snapshot.load()
+        assert salary_snapshot.get(user.id)["amount"] == 80000
+        salary_snapshot._reset()
+
+
+class TestColumnarSnapshot:
+    async def test_write_and_read(self, tmp_path):
+        '''
+        Снимок отдаёт колонки как массивы NumPy поверх mmap, строки упорядочены
+        по user_id; удалённые пользователи в снимок не попадают.
+        '''
+        user_ids = await UserDAO.bulk_register_with_salary([
+            {"email": "b@example.com", "password": "hash", "first_name": "Иван"},
+            {"email": "a@example.com", "password": "hash", "first_name": "Пётр"},
+            {"email": "c@example.com", "password": "hash"},
+        ])
+        await SalaryDAO.update({"user_id": user_ids[1]}, amount=150000, next_raise_date=None)
+        await UserDAO.delete_user_by_id(user_ids[2])
+
+        path, written = await write_snapshot(tmp_path)
+        assert written
+        with ColumnarSnapshot.open(path) as snap:
+            assert len(snap) == 2
+            assert snap["user_id"].tolist() == user_ids[:2]
+            assert snap["amount"].tolist() == [80000, 150000]
+            assert snap["next_raise_date"].dtype == np.dtype("datetime64[D]")
+            assert np.isnat(snap["next_raise_date"]).tolist() == [False, True]
+            assert snap.decode("email") == ["b@example.com", "a@example.com"]
+            assert snap["amount"][snap["first_name"] == snap.code("Пётр")].tolist() == [150000]
+            assert snap.code("Нет такого") == -2
+            assert not snap["amount"].flags.writeable
+
+    async def test_unchanged_data_not_rewritten(self, tmp_path):
+        '''Файл называется по max(updated_at): без изменений БД снимок не перезаписывается.'''
+        [user_id] = await UserDAO.bulk_register_with_salary([{"email": "a@example.com", "password": "hash"}])
+        path, written = await write_snapshot(tmp_path)
+        assert written
+        assert await write_snapshot(tmp_path) == (path, False)
+
+        with ColumnarSnapshot.open(path) as snap:
+            version = snap.version
+        await SalaryDAO.update({"user_id": user_id}, amount=90000, updated_at=version + timedelta(seconds=1))
+        new_path, written = await write_snapshot(tmp_path)
+        assert written and new_path != path
+        assert latest_snapshot(tmp_path) == new_path
+        with ColumnarSnapshot.open(new_path) as snap:
+            assert snap["amount"].tolist() == [90000]
+
+    async def test_late_commit_with_older_updated_at(self, tmp_path):
+        '''
+        Коммит с updated_at меньше максимума (транзакция началась раньше)
+        не сдвигает max(updated_at), но меняет версию данных: снимок переписывается.
+        '''
+        user_ids = await UserDAO.bulk_register_with_salary(
+            [{"email": f"u{i}@example.com", "password": "hash"} for i in range(2)]
+        )
+        path, _ = await write_snapshot(tmp_path)
+        with ColumnarSnapshot.open(path) as snap:
+            version = snap.version
+        await SalaryDAO.update({"user_id": user_ids[0]}, amount=90000, updated_at=version - timedelta(minutes=5))
+
+        new_path, written = await write_snapshot(tmp_path)
+        assert written and new_path != path
+        assert latest_snapshot(tmp_path) == new_path
+        with ColumnarSnapshot.open(new_path) as snap:
+            assert snap.version == version
+            assert sorted(snap["amount"].tolist()) == [80000, 90000]
+
+
+class TestSalaryProjection:
+    ADMIN_HEADERS = {"X-Admin-Token": "admin-secret"}
+
+    @staticmethod
+    def _reference(amount: int, raise_date: date | None, policy: RaisePolicy, points) -> list[float]:
+        '''Построчный расчёт для сверки с векторным.'''
+        result = []
+        for point in points:
+            current, due = amount, raise_date
+            while due is not None and due <= point:
+                current *= 1 + policy.percent / 100
+                due += timedelta(days=policy.interval_days)
+            result.append(min(current, max(amount, policy.cap)) if policy.cap is not None else current)
+        return result
+
+    def test_vectorized_matches_row_by_row(self):
+        '''Векторный прогноз совпадает с построчным, включая потолок и сотрудников без повышений.'''
+        start = date(2026, 1, 15)
+        amounts = [100000, 80000, 250000, 60000]
+        raise_dates = [date(2026, 2, 10), None, date(2025, 12, 1), date(2027, 6, 30)]
+        payroll = Payroll(
+            np.array([1, 2, 3, 4]),
+            np.array(amounts),
+            np.array([d.toordinal() - EPOCH_DAY if d else NEVER for d in raise_dates]),
+            source="test",
+        )
+        points = [d.astype(date) for d in month_starts(24, start)]
+        for policy in (RaisePolicy(10), RaisePolicy(5, interval_days=90, cap=270000)):
+            expected = [self._reference(a, d, policy, points) for a, d in zip(amounts, raise_dates)]
+            result = payroll.project(policy, months=24, start=start)
+            assert [m["total"] for m in result["months"]] == [round(sum(col)) for col in zip(*expected)]
+            trajectories = payroll.trajectories([4, 1, 99], policy, months=24, start=start)
+            assert trajectories.keys() == {1, 4}
+            assert trajectories[1] == pytest.approx(expected[0])
+
+        result = payroll.project(RaisePolicy(10), months=24, start=start)
+        # просроченное повышение третьего сотрудника уже применено
+        assert result["months"][0] == {"month": "2026-02", "total": 515000}
+        assert result["current"] == 490000
+
+    def test_overflow_boundary(self):
+        '''2 ** 1023 ещё конечно, 2 ** 1024 — уже нет: переполнение даёт ProjectionOverflow, а не inf.'''
+        start = date(2026, 1, 15)
+        point = int(month_starts(1, start).view("<i8")[0])
+        policy = RaisePolicy(100, interval_days=1)
+        # к первой точке прогноза elapsed // 1 + 1 повышений
+        finite = Payroll(np.array([1]), np.array([1]), np.array([point - 1022]), source="test")
+        assert finite.project(policy, months=1, start=start)["total"] == 2 ** 1023
+        assert finite.trajectories([1], policy, months=1, start=start)[1] == [2.0 ** 1023]
+
+        overflow = Payroll(np.array([1]), np.array([1]), np.array([point - 1023]), source="test")
+        with pytest.raises(ProjectionOverflow):
+            overflow.project(policy, months=1, start=start)
+        with pytest.raises(ProjectionOverflow):
+            overflow.trajectories([1], policy, months=1, start=start)
+
+    async def test_admin_endpoint(self, client: AsyncClient, monkeypatch, tmp_path):
+        '''Без колоночного снимка прогноз считается по данным из БД.'''
+        monkeypatch.setattr(settings, "ADMIN_TOKEN", "admin-secret")
+        monkeypatch.setattr(settings, "SALARY_COLUMNAR_DIR", str(tmp_path))
+        user_ids = await UserDAO.bulk_register_with_salary(
+            [{"email": f"emp{i}@example.com", "password": "hash"} for i in range(3)]
+        )
+        resp = await client.get(
+            f"/admin/salary/projection?percent=10&months=11&user_id={user_ids[0]}", headers=self.ADMIN_HEADERS,
+        )
+        assert resp.status_code == 200
+        data = resp.json()
+        assert data["employees"] == 3 and data["current"] == 240000 and data["source"] == "db"
+        assert len(data["months"]) == 11
+        # повышение через 180 дней после регистрации, следующее — через 360: за 11 месяцев одно
+        assert data["months"][-1]["total"] == 264000
+        assert data["trajectories"][str(user_ids[0])][-1] == pytest.approx(88000)
+
+        assert (await client.get("/admin/salary/projection?percent=10")).status_code == 403
+
+        # максимальные допустимые параметры переполняют float64: 422 вместо 500
+        for query in ("percent=100&interval_days=1&months=120", f"percent=25&interval_days=1&months=120&user_id={user_ids[0]}"):
+            resp = await client.get(f"/admin/salary/projection?{query}", headers=self.ADMIN_HEADERS)
+            assert resp.status_code == 422
+        resp = await client.get("/admin/salary/projection?percent=100&interval_days=1&months=36", headers=self.ADMIN_HEADERS)
+        assert resp.status_code == 200
+
+    async def test_stale_snapshot_falls_back_to_db(self, client: AsyncClient, monkeypatch, tmp_path):
+        '''source=auto берёт снимок только текущей версии данных; source=snapshot — последний файл.'''
+        monkeypatch.setattr(settings, "ADMIN_TOKEN", "admin-secret")
+        monkeypatch.setattr(settings, "SALARY_COLUMNAR_DIR", str(tmp_path))
+        url = "/admin/salary/projection?percent=10&months=1"
+        resp = await client.get(f"{url}&source=snapshot", headers=self.ADMIN_HEADERS)
+        assert resp.status_code == 404
+
+        [user_id] = await UserDAO.bulk_register_with_salary([{"email": "a@example.com", "password": "hash"}])
+        path, _ = await write_snapshot(tmp_path)
+        data = (await client.get(url, headers=self.ADMIN_HEADERS)).json()
+        assert data["source"] == f"snapshot:{path.name}" and data["current"] == 80000
+
+        with ColumnarSnapshot.open(path) as snap:
+            version = snap.version
+        await SalaryDAO.update({"user_id": user_id}, amount=90000, updated_at=version + timedelta(seconds=1))
+        data = (await client.get(url, headers=self.ADMIN_HEADERS)).json()
+        assert data["source"] == "db" and data["current"] == 90000
+
+        data = (await client.get(f"{url}&source=snapshot", headers=self.ADMIN_HEADERS)).json()
+        assert data["source"] == f"snapshot:{path.name}" and data["current"] == 80000
+        data = (await client.get(f"{url}&source=db", headers=self.ADMIN_HEADERS)).json()
+        assert data["source"] == "db"
+
+
+class TestPayrollExport:
+    ADMIN_HEADERS = {"X-Admin-Token": "admin-secret"}
+
+    @pytest.fixture(autouse=True)
+    async def employees(self, client: AsyncClient, monkeypatch):
+        '''Включает токен администратора и создаёт пять сотрудников.'''
+        monkeypatch.setattr(settings, "ADMIN_TOKEN", "admin-secret")
+        monkeypatch.setattr(settings, "EXPORT_BATCH_SIZE", 2)
+        users = [{"email": f"emp{i}@example.com", "password": "password123"} for i in range(5)]
+        resp = await client.post("/admin/users/bulk", json={"users": users}, headers=self.ADMIN_HEADERS)
+        assert resp.status_code == 201
+
+    async def test_ndjson(self, client: AsyncClient):
+        '''Каждая строка NDJSON — сотрудник с зарплатой, пачки курсора склеиваются в один поток.'''
+        resp = await client.get("/admin/export/payroll", headers=self.ADMIN_HEADERS)
+        assert resp.status_code == 200
+        assert resp.headers["content-type"] == "application/x-ndjson"
+        rows = [json.loads(line) for line in resp.text.splitlines()]
+        assert [row["email"] for row in rows] == [f"emp{i}@example.com" for i in range(5)]
+        assert all(row["amount"] == 80000 for row in rows)
+
+    async def test_csv_gzip(self, client: AsyncClient):
+        '''CSV сжимается gzip на лету, заголовок пишется один раз.'''
+        resp = await client.get("/admin/export/payroll?format=csv&gzip=true", headers=self.ADMIN_HEADERS)
+        assert resp.status_code == 200
+        assert resp.headers["content-type"] == "application/gzip"
+        rows = list(csv.reader(io.StringIO(gzip.decompress(resp.content).decode())))
+        assert rows[0][:2] == ["user_id", "email"]
+        assert len(rows) == 6
+
+    async def test_requires_admin(self, client: AsyncClient):
+        '''Без токена администратора выгрузка недоступна.'''
+        resp = await client.get("/admin/export/payroll")
+        assert resp.status_code == 403
+
+
+class TestSalaryStats:
+    ADMIN_HEADERS = {"X-Admin-Token": "admin-secret"}
+
+    @pytest.fixture(autouse=True)
+    def admin_token(self, monkeypatch):
+        monkeypatch.setattr(settings, "ADMIN_TOKEN", "admin-secret")
+        yield
+        salary_snapshot._reset()
+
+    def test_incremental_aggregates(self):
+        '''Агрегаты обновляются при добавлении и удалении, перцентили — с точностью корзины.'''
+        stats = SalaryStats(bucket=1000)
+        for amount in range(1000, 101000, 1000):
+            stats.add(amount, 0)
+        assert stats.count == 100
+        assert stats.total / stats.count == 50500
+        assert abs(stats.percentile(50) - 50000) <= 1000
+        stats.remove(100000, 0)
+        assert stats.count == 99
+        assert stats.percentile(99) <= 100000
+
+    async def test_unavailable_without_snapshot(self, client: AsyncClient):
+        '''Пока снимок не загружен, статистика не отдаётся.'''
+        resp = await client.get("/admin/salary/stats", headers=self.ADMIN_HEADERS)
+        assert resp.status_code == 503
+
+    async def test_rebuild_requires_enabled_snapshot(self, client: AsyncClient, user_token: str):
+        '''Без SALARY_SNAPSHOT_ENABLED пересборка не загружает снимок, который никто не обновлял бы.'''
+        resp = await client.post("/admin/salary/stats/rebuild", headers=self.ADMIN_HEADERS)
+        assert resp.status_code == 503
+        assert salary_snapshot.refreshed_at is None
+
+    async def test_stats_follow_snapshot(self, client: AsyncClient, user_token: str, monkeypatch):
+        '''Изменения зарплат попадают в статистику при опросе снимка, пересборка сверяет с БД.'''
+        await salary_snapshot.load()
+        resp = await client.get("/admin/salary/stats", headers=self.ADMIN_HEADERS)
+        assert resp.status_code == 200
+        data = resp.json()
+        assert data["count"] == 1 and data["mean"] == 80000
+        assert sum(month["count"] for month in data["raises_by_month"]) == 1
+
+        user = await UserDAO.find_one_or_none(email="test@example.com")
+        await SalaryDAO.update({"user_id": user.id}, amount=120000)
+        await salary_snapshot.refresh()
+        assert salary_snapshot.stats.count == 1
+        assert salary_snapshot.stats.total == 120000
+
+        salary_snapshot.stats.add(1, 0)  # расхождение, например из-за потерянного события
+        monkeypatch.setattr(settings, "SALARY_SNAPSHOT_ENABLED", True)
+        resp = await client.post("/admin/salary/stats/rebuild", headers=self.ADMIN_HEADERS)
+        assert resp.json()["count"] == 1 and resp.json()["mean"] == 120000
+
+
+class TestSalaryAudit:
+    @pytest.fixture(autouse=True)
+    def empty_queue(self):
+        salary_audit.clear()
+        yield
+        salary_audit.clear()
+
+    async def _written(self) -> int:
+        async with async_session_maker() as session:
+            return await session.scalar(select(func.count()).select_from(SalaryView))
+
+    async def test_view_is_queued_without_db_writes(self, client: AsyncClient, user_token: str, assert_max_queries):
+        '''
+        Просмотр зарплаты только ставит событие в очередь: SQL-запросов
+        не добавляется, строка аудита появляется после flush.
+        '''
+        with assert_max_queries(2):
+            resp = await client.get("/salary/me/", headers={"Cookie": f"users_access_token={user_token}"})
+        assert resp.status_code == 200
+        assert len(salary_audit) == 1
+        assert await self._written() == 0
+
+        assert await salary_audit.flush() == 1
+        user = await UserDAO.find_one_or_none(email="test@example.com")
+        async with async_session_maker() as session:
+            view = (await session.execute(select(SalaryView))).scalar_one()
+        assert view.viewer_id == view.subject_id == user.id
+
+    async def test_background_flush_by_batch_size_and_on_shutdown(self, monkeypatch):
+        '''
+        Фоновая задача пишет пачку, как только набралось SALARY_AUDIT_BATCH_SIZE
+        событий, а при отмене дописывает остаток очереди.
+        '''
+        monkeypatch.setattr(settings, "SALARY_AUDIT_BATCH_SIZE", 3)
+        monkeypatch.setattr(settings, "SALARY_AUDIT_FLUSH_INTERVAL_MS", 60000)
+        task = asyncio.create_task(salary_audit.run())
+        await asyncio.sleep(0)
+
+        for user_id in range(3):
+            await salary_audit.record(user_id, user_id)
+        for _ in range(50):
+            if await self._written() == 3:
+                break
+            await asyncio.sleep(0.01)
+        assert await self._written() == 3
+
+        await salary_audit.record(10, 10)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert await self._written() == 4
+        assert len(salary_audit) == 0
+
+    async def test_overflow_policies(self, monkeypatch):
+        '''
+        При заполненной очереди "drop" отбрасывает новое событие,
+        а "block" ждёт, пока запись освободит место.
+        '''
+        monkeypatch.setattr(settings, "SALARY_AUDIT_QUEUE_SIZE", 2)
+        for user_id in range(3):
+            await salary_audit.record(user_id, user_id)
+        assert len(salary_audit) == 2
+
+        monkeypatch.setattr(settings, "SALARY_AUDIT_OVERFLOW", "block")
+        blocked = asyncio.create_task(salary_audit.record(5, 5))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+
+        assert await salary_audit.flush() == 2
+        await asyncio.wait_for(blocked, 1)
+        assert len(salary_audit) == 1
@@ -0,0 +1,59 @@
+from httpx import AsyncClient
+from sqlalchemy import func, select
+
+from app.database import async_session_maker
+from app.salary.models import Salary
+from app.salary.schemas import SSalary
+from app.seed import seed
+from app.users.models import User
+from app.users.schemas import SUserCreate
+
+
+async def _rows() -> list:
+    async with async_session_maker() as session:
+        result = await session.execute(
+            select(User.id, User.email, User.phone_number, User.first_name, User.last_name,
+                   User.date_of_birth, Salary.amount, Salary.next_raise_date)
+            .join(Salary, Salary.user_id == User.id)
+            .order_by(User.id)
+        )
+        return result.all()
+
+
+class TestSeed:
+
+    async def test_rows_satisfy_schemas_and_login(self, client: AsyncClient):
+        '''
+        Сгенерированные строки проходят ограничения SUserCreate и SSalary,
+        а пользователь входит с общим паролем.
+        '''
+        first_id = await seed(250, seed=7, password="seedpass123", batch_size=100)
+        assert first_id == 1
+        rows = await _rows()
+        assert len(rows) == 250
+        for row in rows:
+            SUserCreate(password="seedpass123", **{k: getattr(row, k) for k in (
+                "email", "phone_number", "first_name", "last_name", "date_of_birth",
+            )})
+            if row.next_raise_date is not None:
+                SSalary(id=1, amount=row.amount, next_raise_date=row.next_raise_date)
+            assert row.amount > 0
+        assert len({row.email for row in rows}) == 250
+
+        resp = await client.post("/auth/login/", json={"email": rows[10].email, "password": "seedpass123"})
+        assert resp.status_code == 200
+
+    async def test_deterministic_and_appends_after_existing(self):
+        '''Тот же seed даёт те же строки; повторный запуск продолжает с max(id) + 1.'''
+        await seed(50, seed=1)
+        first = await _rows()
+        assert await seed(10, seed=1) == 51
+
+        async with async_session_maker() as session:
+            await session.execute(Salary.__table__.delete())
+            await session.execute(User.__table__.delete())
+            await session.commit()
+        await seed(50, seed=1)
+        assert await _rows() == first
+        async with async_session_maker() as session:
+            assert await session.scalar(select(func.count()).select_from(Salary)) == 50
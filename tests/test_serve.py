@@ -0,0 +1,43 @@
+import pytest
+
+from app import serve
+from app.config import settings
+
+
+class TestServeSizing:
+    @pytest.mark.parametrize("workers, shards", [(1, 0), (3, 0), (8, 0), (45, 0), (1, 3), (4, 2), (8, 2)])
+    def test_pool_budget_never_exceeded(self, workers, shards, monkeypatch):
+        '''
+        Пулы движков основной БД и шардов вместе с LISTEN-соединением
+        на каждую БД у всех воркеров не превышают бюджет соединений Postgres.
+        '''
+        monkeypatch.setattr(settings, "DB_MAX_CONNECTIONS", 100)
+        monkeypatch.setattr(settings, "DB_RESERVED_CONNECTIONS", 10)
+        monkeypatch.setattr(settings, "SHARD_URLS", {f"s{i}": f"postgresql+asyncpg://db/s{i}" for i in range(shards)})
+        pool_size, max_overflow = serve.split_pool_budget(workers)
+        assert pool_size >= 1
+        databases = 1 + shards
+        assert workers * databases * (pool_size + max_overflow + 1) <= 90
+
+    def test_pool_budget_too_small(self, monkeypatch):
+        '''Воркеров больше, чем соединений в бюджете — запуск отклоняется.'''
+        monkeypatch.setattr(settings, "DB_MAX_CONNECTIONS", 12)
+        monkeypatch.setattr(settings, "DB_RESERVED_CONNECTIONS", 10)
+        with pytest.raises(SystemExit):
+            serve.split_pool_budget(4)
+        # на одну БД бюджета хватает, на две с LISTEN-соединениями — нет
+        monkeypatch.setattr(settings, "DB_MAX_CONNECTIONS", 20)
+        assert serve.split_pool_budget(4, databases=1) == (1, 0)
+        with pytest.raises(SystemExit):
+            serve.split_pool_budget(4, databases=2)
+
+    def test_cpus_limited_by_cgroup_quota(self, monkeypatch):
+        '''Квота cgroup (например, 1.5 CPU) ограничивает число воркеров сверху.'''
+        monkeypatch.setattr(serve.os, "sched_getaffinity", lambda pid: set(range(16)))
+        monkeypatch.setattr(serve, "cgroup_cpu_limit", lambda: 1.5)
+        assert serve.available_cpus() == 2
+
+    def test_web_concurrency_overrides(self, monkeypatch):
+        '''WEB_CONCURRENCY задаёт число воркеров явно.'''
+        monkeypatch.setattr(settings, "WEB_CONCURRENCY", 3)
+        assert serve.default_workers() == 3
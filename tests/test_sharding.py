@@ -0,0 +1,223 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from httpx import AsyncClient
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import OperationalError
+
+from app.dao.base import Base
+from app.dao.invalidation import invalidation_bus
+from app.dao.sharding import HashRing, directory_metadata, move_user, rebalance, shard_router, sync_directory, user_shards
+from app.database import async_session_maker, engine
+from app.salary.dao import SalaryDAO
+from app.salary.models import Salary
+from app.users.dao import UserDAO
+from app.users.models import User
+
+
+async def _create_schema(shards) -> None:
+    for shard_engine in shards.values():
+        async with shard_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+
+async def _count(maker, model) -> int:
+    async with maker() as session:
+        return await session.scalar(select(func.count()).select_from(model))
+
+
+@pytest.fixture
+async def shards(tmp_path):
+    '''
+    Включает шардирование на два файла SQLite; каталог user_shards —
+    в основной тестовой БД. После теста шардирование выключается.
+    '''
+    async with engine.begin() as conn:
+        await conn.run_sync(directory_metadata.drop_all)
+        await conn.run_sync(directory_metadata.create_all)
+
+    urls = {name: f"sqlite+aiosqlite:///{tmp_path / name}.db" for name in ("a", "b")}
+    shard_router.configure(urls)
+    await _create_schema(shard_router.engines)
+    yield urls
+    await shard_router.dispose()
+    shard_router.configure({})
+
+
+def _user(i: int) -> dict:
+    return {"email": f"user{i}@example.com", "password": "password123", "first_name": f"U{i}"}
+
+
+class TestSharding:
+
+    def test_hash_ring_balance_and_stability(self):
+        '''
+        Кольцо раскладывает ключи по шардам примерно поровну, а добавление
+        третьего шарда переносит около трети ключей, а не почти все.
+        '''
+        keys = range(1, 10001)
+        two = HashRing(["a", "b"])
+        three = HashRing(["a", "b", "c"])
+
+        counts = {"a": 0, "b": 0}
+        for key in keys:
+            counts[two.shard_for(key)] += 1
+        assert min(counts.values()) > 3500
+
+        moved = sum(two.shard_for(key) != three.shard_for(key) for key in keys)
+        assert 2000 < moved < 4500
+        # ключи переезжают только на новый шард
+        assert all(three.shard_for(key) == "c" for key in keys if two.shard_for(key) != three.shard_for(key))
+
+    async def test_register_login_and_read_on_shard(self, client: AsyncClient, shards):
+        '''
+        Пользователь и его зарплата создаются на шарде, который назначило
+        кольцо; вход по email, профиль и зарплата читаются с этого шарда.
+        '''
+        resp = await client.post("/auth/register/", json=_user(1))
+        assert resp.status_code == 201
+        user_id = resp.json()["id"]
+
+        shard = shard_router.ring.shard_for(user_id)
+        assert await _count(shard_router.makers[shard], User) == 1
+        assert await _count(shard_router.makers[shard], Salary) == 1
+        assert await _count(async_session_maker, User) == 0
+
+        resp = await client.post("/auth/login/", json={"email": "user1@example.com", "password": "password123"})
+        assert resp.status_code == 200
+
+        resp = await client.get("/users/me/")
+        assert resp.status_code == 200
+        assert resp.json()["id"] == user_id
+        assert (await client.get("/salary/me/")).status_code == 200
+
+    async def test_duplicate_email_rejected_by_directory(self, client: AsyncClient, shards):
+        '''Email уникален между шардами: повтор отклоняет каталог, а не шард.'''
+        assert (await client.post("/auth/register/", json=_user(1))).status_code == 201
+        resp = await client.post("/auth/register/", json=_user(1))
+        assert resp.status_code == 409
+        assert "почты" in resp.json()["detail"]
+
+        async with async_session_maker() as session:
+            assert await session.scalar(select(func.count()).select_from(user_shards)) == 1
+
+    async def test_rebalance_after_adding_shard(self, shards, tmp_path):
+        '''
+        После добавления шарда rebalance переносит пользователей с зарплатами
+        на назначенные кольцом шарды; данные читаются и после переноса.
+        '''
+        user_ids = await UserDAO.bulk_register_with_salary(
+            [{"email": f"user{i}@example.com", "password": "hash"} for i in range(40)]
+        )
+        assert sorted(user_ids) == user_ids
+
+        urls = {**shards, "c": f"sqlite+aiosqlite:///{tmp_path / 'c'}.db"}
+        await shard_router.dispose()
+        shard_router.configure(urls)
+        await _create_schema({"c": shard_router.engines["c"]})
+
+        expected = sum(HashRing(["a", "b", "c"]).shard_for(user_id) == "c" for user_id in user_ids)
+        assert await rebalance(dry_run=True) == expected
+        assert await rebalance(batch_size=7) == expected
+        assert await rebalance() == 0
+
+        assert await _count(shard_router.makers["c"], User) == expected
+        assert await _count(shard_router.makers["c"], Salary) == expected
+        users = await UserDAO.find_many_by("id", user_ids)
+        assert sorted(users) == user_ids
+        for user_id in user_ids:
+            assert await shard_router.shard_of(user_id) == shard_router.ring.shard_for(user_id)
+            assert (await SalaryDAO.find_salary_by_user_id(user_id)).user_id == user_id
+
+    async def test_move_blocks_concurrent_salary_update(self, shards, monkeypatch):
+        '''
+        Запись зарплаты на source, начатая после копирования на target,
+        ждёт окончания переноса и ничего не обновляет, а не пропадает вместе
+        с удалёнными строками source.
+        '''
+        [user_id] = await UserDAO.bulk_register_with_salary([{"email": "mover@example.com", "password": "hash"}])
+        source = await shard_router.shard_of(user_id)
+        target = next(name for name in shards if name != source)
+
+        async def update_on_source():
+            async with shard_router.makers[source]() as session:
+                result = await session.execute(
+                    update(Salary).where(Salary.user_id == user_id).values(amount=99000)
+                )
+                await session.commit()
+                return result.rowcount
+
+        writes = []
+        publish = invalidation_bus.publish
+
+        async def publish_during_move(session, table, keys):
+            # строки уже скопированы и закоммичены на target, с source ещё не удалены
+            writes.append(asyncio.create_task(update_on_source()))
+            await asyncio.sleep(0.2)
+            assert not writes[0].done()
+            return await publish(session, table, keys)
+
+        monkeypatch.setattr(invalidation_bus, "publish", publish_during_move)
+        assert await move_user(user_id, source, target)
+        assert await writes[0] == 0
+        assert await _count(shard_router.makers[source], Salary) == 0
+        async with shard_router.makers[target]() as session:
+            assert await session.scalar(select(Salary.amount).where(Salary.user_id == user_id)) == 80000
+
+    async def test_soft_delete_and_purge_release_directory(self, shards):
+        '''Окончательное удаление освобождает email в каталоге.'''
+        [user_id] = await UserDAO.bulk_register_with_salary([{"email": "gone@example.com", "password": "hash"}])
+        assert await UserDAO.delete_user_by_id(user_id)
+        assert await UserDAO.find_one_or_none(email="gone@example.com") is None
+
+        assert await UserDAO.purge_deleted(batch_size=10) == 1
+        assert await shard_router.locate_email("gone@example.com") is None
+        await UserDAO.bulk_register_with_salary([{"email": "gone@example.com", "password": "hash"}])
+
+    async def test_sync_directory_when_enabling(self, client: AsyncClient, user_token: str, tmp_path):
+        '''
+        Пользователи, зарегистрированные без шардирования, попадают в каталог
+        при включении (шард "default" — основная БД); строка давно удалённого
+        пользователя, держащая чужой email, убирается.
+        '''
+        async with engine.begin() as conn:
+            await conn.run_sync(directory_metadata.drop_all)
+            await conn.run_sync(directory_metadata.create_all)
+        user = await UserDAO.find_one_or_none(email="test@example.com")
+        async with async_session_maker() as session:
+            await session.execute(user_shards.insert().values(
+                user_id=user.id + 100, email="test@example.com", shard="default",
+                created_at=datetime(2000, 1, 1),
+            ))
+            await session.commit()
+
+        shard_router.configure({name: f"sqlite+aiosqlite:///{tmp_path / name}.db" for name in ("default", "b")})
+        shard_router.makers["default"] = async_session_maker
+        try:
+            await _create_schema({"b": shard_router.engines["b"]})
+            assert await sync_directory() == 1
+            assert await shard_router.locate_email("test@example.com") == (user.id, "default")
+            assert await sync_directory() == 0
+
+            resp = await client.post("/auth/login/", json={"email": "test@example.com", "password": "password123"})
+            assert resp.status_code == 200
+            assert (await client.get("/users/me/")).json()["id"] == user.id
+
+            resp = await client.post("/auth/register/", json=_user(2))
+            assert resp.status_code == 201
+            assert resp.json()["id"] > user.id
+        finally:
+            await shard_router.dispose()
+            shard_router.configure({})
+
+    async def test_failed_registration_releases_directory(self, shards):
+        '''Не только нарушение уникальности: любая ошибка записи на шард освобождает каталог.'''
+        for shard_engine in shard_router.engines.values():
+            async with shard_engine.begin() as conn:
+                await conn.run_sync(Salary.__table__.drop)
+
+        with pytest.raises(OperationalError):
+            await UserDAO.register_with_salary({"email": "lost@example.com", "password": "hash"})
+        assert await shard_router.locate_email("lost@example.com") is None
@@ -1,6 +1,20 @@
+import asyncio
+import hashlib
+import hmac
+
 import pytest
 
 from httpx import AsyncClient
+from sqlalchemy import func, select
+
+from app.config import settings
+from app.dao.idempotency import IdempotencyKey, idempotency_store
+from app.database import async_session_maker
+from app.salary.models import Salary
+from app.users.dao import UserDAO
+from app.users.models import User
+from app.users.schemas import SUserCreate
+from app.users.purge import purge_deleted_users
 
 
 class TestUserEndpoints:
@@ -25,6 +39,15 @@ class TestUserEndpoints:
         assert data["id"] > 0
         assert data["email"] == "new@example.com"
 
+    async def test_register_query_budget(self, client: AsyncClient, assert_max_queries):
+        '''Регистрация с зарплатой выполняется не более чем двумя SQL-запросами.'''
+        with assert_max_queries(2):
+            resp = await client.post(
+                "/auth/register/",
+                json={"email": "budget@example.com", "password": "password123"}
+            )
+        assert resp.status_code == 201
+
     @pytest.mark.parametrize("payload, field", [
         ({"email": "bademail", "password": "password123"}, "email"),
         ({"email": "ok@example.com", "password": "short"}, "password"),
@@ -137,3 +160,267 @@ class TestUserEndpoints:
             headers={"Cookie": f"users_access_token={user_token}"}
         )
         assert resp2.status_code in (401, 404)
+
+    async def test_soft_delete_and_purge(self, client: AsyncClient, user_token: str, assert_max_queries):
+        '''Удаление — один UPDATE; строки пользователя и зарплаты удаляет фоновая очистка.'''
+        with assert_max_queries(2):  # загрузка текущего пользователя + UPDATE
+            resp = await client.delete(
+                "/users/delete/me",
+                headers={"Cookie": f"users_access_token={user_token}"}
+            )
+        assert resp.status_code == 204
+
+        resp = await client.post("/auth/login/", json={"email": "test@example.com", "password": "password123"})
+        assert resp.status_code == 401
+
+        async with async_session_maker() as session:
+            assert await session.scalar(select(func.count()).select_from(User)) == 1
+        assert await purge_deleted_users() == 1
+        async with async_session_maker() as session:
+            assert await session.scalar(select(func.count()).select_from(User)) == 0
+            assert await session.scalar(select(func.count()).select_from(Salary)) == 0
+
+    async def test_purge_respects_grace_period(self, user_token: str):
+        '''Граница срока хранения считается часами СУБД, как и deleted_at.'''
+        user = await UserDAO.find_one_or_none(email="test@example.com")
+        await UserDAO.delete_user_by_id(user.id)
+        assert await UserDAO.purge_deleted(batch_size=10, grace_seconds=3600) == 0
+        assert await UserDAO.purge_deleted(batch_size=10, grace_seconds=0) == 1
+
+    async def test_update_to_email_of_soft_deleted_user(self, client: AsyncClient, user_token: str):
+        '''Email мягко удалённого пользователя занят до очистки: 409, а не 500.'''
+        await client.delete("/users/delete/me", headers={"Cookie": f"users_access_token={user_token}"})
+        await client.post("/auth/register/", json={"email": "other@example.com", "password": "password123"})
+        resp = await client.post("/auth/login/", json={"email": "other@example.com", "password": "password123"})
+        token = resp.cookies["users_access_token"]
+
+        resp = await client.patch(
+            "/users/update/me",
+            headers={"Cookie": f"users_access_token={token}"},
+            json={"email": "test@example.com"},
+        )
+        assert resp.status_code == 409
+
+
+class TestLogin:
+
+    async def test_email_is_case_insensitive(self, client: AsyncClient, assert_max_queries):
+        '''
+        Email приводится к нижнему регистру при регистрации и входе; повтор
+        с другим регистром — занятый адрес. Вход читает только (id, password).
+        '''
+        resp = await client.post("/auth/register/", json={"email": "Case@Example.COM", "password": "password123"})
+        assert resp.status_code == 201
+        assert resp.json()["email"] == "case@example.com"
+
+        resp = await client.post("/auth/register/", json={"email": "case@example.com", "password": "password123"})
+        assert resp.status_code == 409
+
+        with assert_max_queries(1) as stats:
+            resp = await client.post("/auth/login/", json={"email": "CASE@example.com", "password": "password123"})
+        assert resp.status_code == 200
+        [shape] = stats.shapes
+        assert shape.startswith("SELECT users.id, users.password FROM users")
+
+
+class TestOptimisticLocking:
+
+    async def test_if_match_updates_and_bumps_etag(self, client: AsyncClient, user_token: str):
+        '''PATCH с актуальным ETag проходит и возвращает ETag новой версии.'''
+        cookies = {"Cookie": f"users_access_token={user_token}"}
+        etag = (await client.get("/users/me/", headers=cookies)).headers["ETag"]
+
+        resp = await client.patch(
+            "/users/update/me", headers={**cookies, "If-Match": etag}, json={"first_name": "First"},
+        )
+        assert resp.status_code == 200
+        assert resp.headers["ETag"] != etag
+        assert (await client.get("/users/me/", headers=cookies)).headers["ETag"] == resp.headers["ETag"]
+
+    async def test_stale_if_match_conflicts(self, client: AsyncClient, user_token: str):
+        '''
+        Второй писатель с ETag, прочитанным до первой записи, получает 409,
+        и его изменения не затирают первые.
+        '''
+        cookies = {"Cookie": f"users_access_token={user_token}"}
+        etag = (await client.get("/users/me/", headers=cookies)).headers["ETag"]
+
+        first = await client.patch("/users/update/me", headers={**cookies, "If-Match": etag}, json={"first_name": "One"})
+        second = await client.patch("/users/update/me", headers={**cookies, "If-Match": etag}, json={"first_name": "Two"})
+        assert first.status_code == 200
+        assert second.status_code == 409
+        assert (await client.get("/users/me/", headers=cookies)).json()["first_name"] == "One"
+
+        resp = await client.patch("/users/update/me", headers={**cookies, "If-Match": "abc"}, json={"first_name": "Three"})
+        assert resp.status_code == 400
+
+    async def test_stale_version_between_check_and_update(self, client: AsyncClient, user_token: str):
+        '''Запись с устаревшей версией отклоняет сам UPDATE, а не только проверка в эндпоинте.'''
+        from sqlalchemy.orm.exc import StaleDataError
+        from app.users.dao import UserDAO
+
+        user = await UserDAO.read_one(email="test@example.com")
+        assert await UserDAO.update({"id": user.id}, expected_version=user.version, first_name="A") == 1
+        with pytest.raises(StaleDataError):
+            await UserDAO.update({"id": user.id}, expected_version=user.version, first_name="B")
+        assert (await UserDAO.read_one(id=user.id)).version == user.version + 1
+
+
+class TestSparseFields:
+
+    async def test_user_fields_load_only_requested_columns(self, client: AsyncClient, user_token: str, assert_max_queries):
+        '''?fields= читает из БД только выбранные колонки и возвращает только их.'''
+        with assert_max_queries(1) as stats:
+            resp = await client.get(
+                "/users/me/?fields=email,first_name",
+                headers={"Cookie": f"users_access_token={user_token}"}
+            )
+        assert resp.status_code == 200
+        assert resp.json() == {"email": "test@example.com", "first_name": "Test"}
+        [shape] = stats.shapes
+        assert "password" not in shape and "last_name" not in shape
+
+    async def test_salary_fields(self, client: AsyncClient, user_token: str):
+        '''Клиенту, которому нужна только сумма, возвращается только amount.'''
+        resp = await client.get(
+            "/salary/me/?fields=amount",
+            headers={"Cookie": f"users_access_token={user_token}"}
+        )
+        assert resp.status_code == 200
+        assert resp.json() == {"amount": 80000}
+
+    @pytest.mark.parametrize("path", [
+        "/users/me/?fields=email,password",
+        "/users/me/?fields=",
+        "/salary/me/?fields=amount,user_id",
+    ])
+    async def test_unknown_fields_rejected(self, client: AsyncClient, user_token: str, path: str, assert_max_queries):
+        '''Неизвестные поля отклоняются с 422 до обращения к БД.'''
+        with assert_max_queries(0):
+            resp = await client.get(path, headers={"Cookie": f"users_access_token={user_token}"})
+        assert resp.status_code == 422
+
+
+class TestBulkRegistration:
+    ADMIN_HEADERS = {"X-Admin-Token": "admin-secret"}
+
+    @pytest.fixture(autouse=True)
+    def admin_token(self, monkeypatch):
+        monkeypatch.setattr(settings, "ADMIN_TOKEN", "admin-secret")
+
+    async def test_bulk_register_and_login(self, client: AsyncClient):
+        '''Созданные массово пользователи получают зарплату и могут войти.'''
+        users = [
+            {"email": f"emp{i}@example.com", "password": "password123", "phone_number": f"+7900000000{i}"}
+            for i in range(3)
+        ]
+        resp = await client.post("/admin/users/bulk", json={"users": users}, headers=self.ADMIN_HEADERS)
+        assert resp.status_code == 201
+        assert resp.json() == {"created": 3, "skipped": []}
+
+        resp = await client.post("/auth/login/", json={"email": "emp1@example.com", "password": "password123"})
+        assert resp.status_code == 200
+        resp = await client.get(
+            "/salary/me/",
+            headers={"Cookie": f"users_access_token={resp.cookies['users_access_token']}"}
+        )
+        assert resp.status_code == 200
+
+    async def test_bulk_skips_taken_contacts(self, client: AsyncClient, user_token: str):
+        '''Занятые email и повторы внутри запроса пропускаются, остальные создаются.'''
+        users = [
+            {"email": "test@example.com", "password": "password123"},
+            {"email": "fresh@example.com", "password": "password123"},
+            {"email": "fresh@example.com", "password": "password456"},
+        ]
+        resp = await client.post("/admin/users/bulk", json={"users": users}, headers=self.ADMIN_HEADERS)
+        assert resp.status_code == 201
+        assert resp.json() == {"created": 1, "skipped": ["test@example.com", "fresh@example.com"]}
+
+    async def test_bulk_requires_admin(self, client: AsyncClient):
+        '''Без токена администратора эндпоинт недоступен.'''
+        resp = await client.post(
+            "/admin/users/bulk",
+            json={"users": [{"email": "x@example.com", "password": "password123"}]},
+        )
+        assert resp.status_code == 403
+
+
+class TestIdempotency:
+    REGISTER = {"email": "retry@example.com", "password": "password123"}
+
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        idempotency_store.clear()
+        yield
+        idempotency_store.clear()
+
+    async def test_register_retry_replayed(self, client: AsyncClient, assert_max_queries):
+        '''Повтор регистрации с тем же ключом отдаётся из кэша без запросов к БД.'''
+        headers = {"Idempotency-Key": "reg-1"}
+        resp = await client.post("/auth/register/", json=self.REGISTER, headers=headers)
+        assert resp.status_code == 201
+
+        with assert_max_queries(0):
+            retry = await client.post("/auth/register/", json=self.REGISTER, headers=headers)
+        assert retry.status_code == 201
+        assert retry.json() == resp.json()
+        assert retry.headers["Idempotent-Replayed"] == "true"
+
+    async def test_concurrent_duplicates_run_once(self, client: AsyncClient):
+        '''Одновременные дубликаты ждут первое выполнение, пользователь создаётся один раз.'''
+        headers = {"Idempotency-Key": "reg-2"}
+        first, second = await asyncio.gather(
+            client.post("/auth/register/", json=self.REGISTER, headers=headers),
+            client.post("/auth/register/", json=self.REGISTER, headers=headers),
+        )
+        assert first.status_code == second.status_code == 201
+        assert first.json()["id"] == second.json()["id"]
+
+    async def test_key_reused_with_other_body(self, client: AsyncClient):
+        '''Тот же ключ с другим телом запроса отклоняется.'''
+        headers = {"Idempotency-Key": "reg-3"}
+        await client.post("/auth/register/", json=self.REGISTER, headers=headers)
+        resp = await client.post(
+            "/auth/register/", json={**self.REGISTER, "email": "other@example.com"}, headers=headers,
+        )
+        assert resp.status_code == 422
+
+    async def test_stored_hash_is_keyed(self, client: AsyncClient):
+        '''В таблицу ключей не попадает хэш, по которому можно подобрать пароль без SECRET_KEY.'''
+        await client.post("/auth/register/", json=self.REGISTER, headers={"Idempotency-Key": "reg-4"})
+        async with async_session_maker() as session:
+            stored = await session.scalar(select(IdempotencyKey.request_hash))
+        body = SUserCreate(**self.REGISTER).model_dump_json().encode()
+        assert stored != hashlib.sha256(body).hexdigest()
+        assert stored == hmac.new(settings.SECRET_KEY.encode(), body, hashlib.sha256).hexdigest()
+
+    async def test_update_replayed_from_db(self, client: AsyncClient, user_token: str):
+        '''Ответ сохраняется в БД: повтор в другом воркере (пустой кэш) не выполняет запрос заново.'''
+        headers = {"Cookie": f"users_access_token={user_token}", "Idempotency-Key": "upd-1"}
+        resp = await client.patch("/users/update/me", json={"first_name": "Первый"}, headers=headers)
+        assert resp.status_code == 200
+
+        idempotency_store.clear()
+        retry = await client.patch("/users/update/me", json={"first_name": "Первый"}, headers=headers)
+        assert retry.status_code == 200
+        assert retry.json() == resp.json()
+        assert retry.headers["Idempotent-Replayed"] == "true"
+
+    async def test_update_replay_keeps_etag(self, client: AsyncClient, user_token: str):
+        '''ETag, выставленный обработчиком, отдаётся при первом выполнении и при повторах из кэша и из БД.'''
+        cookie = {"Cookie": f"users_access_token={user_token}"}
+        version = (await client.get("/users/me/", headers=cookie)).headers["ETag"]
+        headers = {**cookie, "Idempotency-Key": "upd-2", "If-Match": version}
+        resp = await client.patch("/users/update/me", json={"first_name": "Второй"}, headers=headers)
+        assert resp.status_code == 200
+        assert resp.headers["ETag"] != version
+
+        retry = await client.patch("/users/update/me", json={"first_name": "Второй"}, headers=headers)
+        assert retry.headers["Idempotent-Replayed"] == "true"
+        assert retry.headers["ETag"] == resp.headers["ETag"]
+
+        idempotency_store.clear()
+        retry = await client.patch("/users/update/me", json={"first_name": "Второй"}, headers=headers)
+        assert retry.headers["Idempotent-Replayed"] == "true"
+        assert retry.headers["ETag"] == resp.headers["ETag"]